@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from cStringIO import StringIO
+from wegweiser import core
+from wegweiser.core import Search, Scrape
+from wegweiser.collection import SpotCollection
+from wegweiser.coordinates import parse_coordinates
+from wegweiser.markup import Markup
+from wegweiser.map import Map
+from wegweiser.parsers import ParserPool
+from wegweiser.__wegweiser__ import generate_json
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+BASELINE = os.path.join(FIXTURES, 'baseline.json')
+SIZES = [10, 1000, 100000]
+PARSERS = [1, 2, 4]
+# seconds `wegweiser json --help` may take over a bare interpreter
+STARTUP_BUDGET = 0.05
+STARTUP = [sys.executable, '-m', 'wegweiser.__wegweiser__', 'json', '--help']
+
+
+def fixture(name):
+    path = os.path.join(FIXTURES, name)
+    opener = gzip.open if name.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read()
+
+
+# stand-in for the shared agent serving recorded pages
+class FixtureAgent(object):
+
+    cache = None
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def open(self, url, headers=None, cache=True):
+        return StringIO(self.pages[url])
+
+
+def spots(count, seed=17):
+    generator = random.Random(seed)
+    collection = SpotCollection()
+    latitudes = [generator.uniform(47.3, 55.0) for index in xrange(count)]
+    longitudes = [generator.uniform(5.9, 15.0) for index in xrange(count)]
+    collection.extend_columns(
+        ['Spot %d' % index for index in xrange(count)],
+        ['https://de.wikipedia.org/wiki/Spot_%d' % index
+         for index in xrange(count)],
+        latitudes, longitudes,
+        [generator.choice([None, 34.0]) for index in xrange(count)])
+    return collection
+
+
+def coordinate_strings(count, seed=16):
+    generator = random.Random(seed)
+    decimals = ['%.6f' % generator.uniform(-90, 90) for index in range(count)]
+    commas = [text.replace('.', ',') for text in decimals]
+    dms = [
+        u'%d°%d′%d″%s' % (
+            generator.randint(0, 89), generator.randint(0, 59),
+            generator.randint(0, 59), generator.choice(u'NSEWO'))
+        for index in range(count)]
+    return decimals, commas, dms
+
+
+def bench_search(name):
+    content = fixture(name)
+
+    def run():
+        Search('Berlin')._evaluate_result(content)
+    return run, 1, len(content)
+
+
+def bench_scrape(name, url):
+    page = fixture(name)
+    pages = {Scrape.URL_OPTS % url: page}
+
+    def run():
+        agent = core.agent
+        core.agent = FixtureAgent(pages)
+        try:
+            Scrape(url).scrape_url()
+        finally:
+            core.agent = agent
+    return run, 1, len(page)
+
+
+def bench_parsers(workers, count=32):
+    # a re-scrape of cached pages, bound by parsing only
+    page = fixture('article_huge.html.gz')
+    urls = ['https://de.wikipedia.org/wiki/Berlin_%d' % index
+            for index in xrange(count)]
+    pages = dict((Scrape.URL_OPTS % url, page) for url in urls)
+    parsers = ParserPool(workers)
+
+    def run():
+        agent = core.agent
+        core.agent = FixtureAgent(pages)
+        core.parsers = parsers
+        try:
+            core.resolve_spots(urls, workers=parsers.fetchers)
+        finally:
+            core.agent = agent
+            core.parsers = None
+    return run, count, count * len(page)
+
+
+def bench_coordinates(kind, count=200000):
+    decimals, commas, dms = coordinate_strings(count)
+    texts, language = {
+        'decimal': (decimals, 'en'),
+        'comma': (commas, 'de'),
+        'dms': (dms, 'fr'),
+    }[kind]
+    return lambda: parse_coordinates(texts, language), count, None
+
+
+def bench_kml(count):
+    markup = Markup()
+    markup.add_spot(spots(count))
+    return markup.generate_kml, count, None
+
+
+def bench_map(count):
+    collection = spots(count)
+
+    def run():
+        for map in Map.tiles(collection, size_x=640, size_y=400):
+            map.generate_url()
+    return run, count, None
+
+
+def bench_json(count):
+    collection = spots(count)
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    def run():
+        try:
+            generate_json(collection, filename=filename)
+        finally:
+            os.remove(filename)
+    return run, count, None
+
+
+BENCHMARKS = [
+    ('search.small', lambda: bench_search('search_small.xml')),
+    ('search.huge', lambda: bench_search('search_huge.xml')),
+    ('scrape.small', lambda: bench_scrape(
+        'article_small.html', 'https://de.wikipedia.org/wiki/Berlin')),
+    ('scrape.huge', lambda: bench_scrape(
+        'article_huge.html.gz', 'https://de.wikipedia.org/wiki/Berlin')),
+    ('scrape.malformed', lambda: bench_scrape(
+        'article_malformed.html', 'https://en.wikipedia.org/wiki/Moscow')),
+    ('coordinates.decimal', lambda: bench_coordinates('decimal')),
+    ('coordinates.comma', lambda: bench_coordinates('comma')),
+    ('coordinates.dms', lambda: bench_coordinates('dms')),
+]
+for size in SIZES:
+    BENCHMARKS.extend([
+        ('markup.generate_kml.%d' % size, lambda size=size: bench_kml(size)),
+        ('map.generate_url.%d' % size, lambda size=size: bench_map(size)),
+        ('json.generate_json.%d' % size, lambda size=size: bench_json(size)),
+    ])
+for workers in PARSERS:
+    BENCHMARKS.append(('scrape.parsers.%d' % workers,
+                       lambda workers=workers: bench_parsers(workers)))
+
+
+def cold_start(command, repeat=11):
+    # median wall time of fresh interpreters
+    root = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PYTHONPATH=root)
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for index in xrange(repeat):
+            start = time.time()
+            subprocess.check_call(
+                command, stdout=devnull, cwd=root, env=environment)
+            times.append(time.time() - start)
+    return sorted(times)[repeat // 2]
+
+
+def startup(repeat=11):
+    seconds = cold_start(STARTUP, repeat)
+    bare = cold_start([sys.executable, '-c', 'pass'], repeat)
+    return {'seconds': seconds, 'overhead': seconds - bare,
+            'rate': 1 / seconds}
+
+
+def measure(setup, budget=1.0, repeat=3):
+    # best of several runs, at least `repeat` within the time budget
+    function, items, size = setup()
+    best = None
+    runs = 0
+    started = time.time()
+    while runs < repeat or time.time() - started < budget:
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        runs += 1
+        if best is None or elapsed < best:
+            best = elapsed
+        if runs >= 1000:
+            break
+    best = max(best, 1e-9)
+    result = {'seconds': best, 'runs': runs, 'rate': items / best}
+    if size is not None:
+        result['bytes_per_second'] = size / best
+    return result
+
+
+def isolated(setup, budget):
+    # run in a child process, its peak memory belongs to this benchmark
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        try:
+            data = json.dumps(measure(setup, budget))
+        except Exception as error:
+            data = json.dumps({'error': '%s' % error})
+        with os.fdopen(write, 'w') as f:
+            f.write(data)
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        data = f.read()
+    pid, status, usage = os.wait4(pid, 0)
+    result = json.loads(data) if data else {'error': 'status %d' % status}
+    # kilobytes on linux
+    result['memory'] = usage.ru_maxrss
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        reference = baseline.get(name)
+        if reference is None or 'rate' not in result:
+            continue
+        if result['rate'] < reference['rate'] * (1 - tolerance):
+            regressions.append('%s: %.0f/s, baseline %.0f/s' % (
+                name, result['rate'], reference['rate']))
+        if 'memory' not in result:
+            continue
+        if result['memory'] > reference['memory'] * (1 + tolerance):
+            regressions.append('%s: %d KB, baseline %d KB' % (
+                name, result['memory'], reference['memory']))
+    return regressions
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmarks of wegweiser.')
+    parser.add_argument(
+        'names',
+        type=str,
+        nargs='*',
+        help='run benchmarks starting with these names only'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        default=None,
+        help='write results as JSON to file'
+    )
+    parser.add_argument(
+        '-b', '--baseline',
+        type=str,
+        default=BASELINE,
+        help='compare against baseline JSON file'
+    )
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='store results as new baseline'
+    )
+    parser.add_argument(
+        '-t', '--tolerance',
+        type=float,
+        default=0.3,
+        help='relative slowdown or memory growth flagged as regression'
+    )
+    parser.add_argument(
+        '--startup-budget',
+        type=float,
+        default=STARTUP_BUDGET,
+        help='seconds `wegweiser json --help` may take over bare python'
+    )
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=1.0,
+        help='seconds spent repeating each benchmark'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_options()
+    results = {}
+    for name, setup in BENCHMARKS:
+        if args.names and not any(
+                name.startswith(prefix) for prefix in args.names):
+            continue
+        result = results[name] = isolated(setup, args.budget)
+        if 'error' in result:
+            print >> sys.stderr, '%s: %s' % (name, result['error'])
+            continue
+        print '%-32s %14.0f per second %10d KB' % (
+            name, result['rate'], result['memory'])
+    over_budget = False
+    if not args.names or any(
+            'startup'.startswith(prefix) for prefix in args.names):
+        result = results['startup'] = startup()
+        print '%-32s %14.1f ms %13.1f ms over python' % (
+            'startup', result['seconds'] * 1000, result['overhead'] * 1000)
+        if result['overhead'] > args.startup_budget:
+            print >> sys.stderr, 'startup over budget %.1f ms' % (
+                args.startup_budget * 1000)
+            over_budget = True
+    data = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+        return
+    if not os.path.exists(args.baseline):
+        if over_budget:
+            sys.exit(1)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    for msg in regressions:
+        print >> sys.stderr, 'regression %s' % msg
+    if over_budget or regressions or any(
+            'error' in result for result in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
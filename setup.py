@@ -19,7 +19,7 @@ setup(
     packages=['wegweiser'],
     entry_points={'console_scripts': [
         'wegweiser=wegweiser.__wegweiser__:main']},
-    install_requires=['simplekml>=1.1', 'motionless>=1.1'],
+    install_requires=['motionless>=1.1'],
     author="Tobias Schäfer",
     author_email="Tobias.Schaefer@blackox.org",
     url="https://github.com/tschaefer/wegweiser/",
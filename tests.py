@@ -1,12 +1,56 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import math
+import time
+import shutil
+import subprocess
 import unittest
 import tempfile
+import threading
+import gzip
+import json
+import random
+import zipfile
+import httplib
+import urllib2
+import urlparse
+import SocketServer
+import BaseHTTPServer
 
-from wegweiser.core import Search, Scrape, Spot
-from wegweiser.markup import Markup
-from wegweiser.map import Map
+from array import array
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+
+from wegweiser import core
+from wegweiser.cache import Cache, FileCache, normalize_url
+from wegweiser.transport import Agent
+from wegweiser.throttle import Scheduler, TokenBucket, Limiter, retry_after
+from wegweiser.core import Search, Scrape, BatchScrape, Locate, Spot
+from wegweiser.core import resolve_spot, resolve_spots, iresolve_spots
+from wegweiser.core import aresolve_spots
+from wegweiser.future import Future, ThreadTransport, TimeoutError
+from wegweiser.future import completed, failed, gather, as_completed
+from wegweiser.collection import SpotCollection
+from wegweiser.coordinates import parse_coordinate, parse_coordinates
+from wegweiser.index import SpotIndex, distance
+from wegweiser.instrument import Phase, Profile, percentile
+from wegweiser.instrument import subscribe, unsubscribe
+from wegweiser.ingest import Ingest, read_dump
+from wegweiser.journal import Journal, read_objs
+from wegweiser.flight import SingleFlight
+from wegweiser.store import SpotStore, normalize_title
+from wegweiser.parsers import ParserPool
+from wegweiser.markup import Markup, KmlWriter
+from wegweiser.server import Server, SpotService
+from wegweiser.stream import NdjsonWriter, GeoJsonWriter
+from wegweiser.map import Map, encode_polyline, decode_polyline, simplify
+from wegweiser.map import cluster, fit_zoom, save_map_files, build_maps
+from wegweiser.__wegweiser__ import batch_spots, stream_markup
+from wegweiser.__wegweiser__ import generate_json, generate_markup
+
+import benchmarks
 
 
 class BaseTest(unittest.TestCase):
@@ -33,6 +77,110 @@ class BaseTest(unittest.TestCase):
         self.assert_(str1 == str2, msg)
 
 
+SEARCH_XML = '''<?xml version="1.0"?>
+<SearchSuggestion xmlns="http://opensearch.org/searchsuggest2" version="2.0">
+<Query xml:space="preserve">%s</Query>
+<Section>%s</Section>
+</SearchSuggestion>'''
+
+SEARCH_ITEM_XML = '''<Item>
+<Text xml:space="preserve">%s</Text>
+<Url xml:space="preserve">%s</Url>
+</Item>'''
+
+PAGE_XHTML = '''<?xml version="1.0" encoding="UTF-8"?>
+<html><body>
+<h1 id="firstHeading" class="firstHeading">%s</h1>
+<div id="content">%s</div>
+</body></html>'''
+
+COORDINATES_XHTML = '''<span class="geo">
+<span class="latitude">%s</span> <span class="longitude">%s</span>
+</span>'''
+
+
+# stand-in for the shared agent serving recorded responses by url
+class FakeAgent(object):
+
+    def __init__(self, responses=None, cache=None, agent=None):
+        self.responses = responses or {}
+        self.requests = []
+        self.cache = cache
+        self.agent = agent
+
+    def add_search(self, term, results, language='de', limit=3):
+        url = Search.BASE_URL % (language, term.replace(' ', '%20'), limit)
+        items = ''.join(
+            SEARCH_ITEM_XML % (title, url) for title, url in results)
+        self.responses[url] = (SEARCH_XML % (term, items)).encode('utf-8')
+
+    def add_page(self, url, title, latitude=None, longitude=None,
+                 elevation=None):
+        content = ''
+        if latitude is not None and longitude is not None:
+            content += COORDINATES_XHTML % (latitude, longitude)
+        if elevation is not None:
+            content += '<span class="elevation">%s</span>' % elevation
+        content = PAGE_XHTML % (title, content)
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        self.responses[Scrape.URL_OPTS % url] = content
+
+    def open(self, url, headers=None, cache=True):
+        self.requests.append(url)
+        if url not in self.responses:
+            # only local stand-in servers are passed through
+            if self.agent is not None and urlparse.urlsplit(
+                    url).hostname == '127.0.0.1':
+                return self.agent.open(url)
+            raise urllib2.URLError('%s not recorded' % url)
+        response = self.responses[url]
+        if isinstance(response, Exception):
+            raise response
+        return urllib2.addinfourl(
+            StringIO(response), httplib.HTTPMessage(StringIO('')), url)
+
+
+class ThreadingHTTPServer(
+        SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+# local stand-in http server, requests are answered by `handle`
+class StandInServer(object):
+
+    def __init__(self, handle, protocol_version='HTTP/1.0'):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        Handler.protocol_version = protocol_version
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeAgentTest(BaseTest):
+
+    def setUp(self):
+        self._agent = core.agent
+        self.agent = core.agent = FakeAgent()
+
+    def tearDown(self):
+        core.agent = self._agent
+
+
 class CoreTest(BaseTest):
 
     def test_Search(self):
@@ -168,6 +316,1914 @@ class CoreTest(BaseTest):
             ValueError, lambda: Spot.from_scrape(Search('New York City')))
 
 
+class ResolveTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.agent.add_search(
+            'Berlin', [('Berlin', 'https://de.wikipedia.org/wiki/Berlin')])
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+        self.agent.add_page('https://de.wikipedia.org/wiki/Python', 'Python')
+        self.agent.add_search('Nirgendwo', [])
+
+    def test_resolve_spots(self):
+
+        objs = [
+            'Berlin',
+            'https://de.wikipedia.org/wiki/Python',
+            'https://de.wikipedia.org/wiki/Hamburg',
+            'Nirgendwo',
+        ]
+        for workers in 1, 4:
+            results = resolve_spots(objs, workers=workers)
+            self.assertEqual(len(results), len(objs))
+            # order is kept
+            self.assertIs(results[0], Spot)
+            self.assertStrEqual(results[0].title, 'Berlin')
+            self.assertEqual(results[0].elevation, 34.0)
+            self.assertIs(results[2], Spot)
+            self.assertStrEqual(results[2].title, 'Hamburg')
+            self.assertEqual(results[2].elevation, None)
+            # errors are reported per object
+            self.assertIs(results[1], UserWarning)
+            self.assertIs(results[3], UserWarning)
+            self.assertIn('no search results', str(results[3]))
+        # invalid language and workers
+        results = resolve_spots(['Berlin'], language='it')
+        self.assertIs(results[0], ValueError)
+        self.assertRaises(
+            ValueError, lambda: resolve_spots(objs, workers=0))
+
+
+# transport answering requests when the test says so
+class ManualTransport(object):
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.pending = []
+
+    def fetch(self, url, **options):
+        future = Future()
+        self.pending.append((url, future))
+        return future
+
+    def answer(self):
+        url, future = self.pending.pop(0)
+        try:
+            future.set_result(self.agent.open(url).read())
+        except Exception as error:
+            future.set_exception(error)
+
+
+class AsyncTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self._transport = core.transport
+        core.transport = ThreadTransport(self.agent.open, workers=4)
+        self.agent.add_search(
+            'Berlin', [('Berlin', 'https://de.wikipedia.org/wiki/Berlin')])
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+        self.agent.add_page('https://de.wikipedia.org/wiki/Python', 'Python')
+        self.agent.add_search('Nirgendwo', [])
+
+    def tearDown(self):
+        if isinstance(core.transport, ThreadTransport):
+            core.transport.close()
+        core.transport = self._transport
+        FakeAgentTest.tearDown(self)
+
+    def test_Future(self):
+
+        future = Future()
+        chained = future.then(lambda value: value + 1).then(
+            lambda value: completed(value * 2))
+        self.assertFalse(chained.done())
+        self.assertRaises(TimeoutError, lambda: chained.result(0.01))
+        future.set_result(1)
+        self.assertEqual(chained.result(), 4)
+        self.assertRaises(ValueError, lambda: future.set_result(2))
+        # exceptions are passed along
+        chained = failed(UserWarning('failed')).then(lambda value: value)
+        self.assertIs(chained.exception(), UserWarning)
+        self.assertRaises(UserWarning, chained.result)
+        chained = completed(0).then(lambda value: 1 / value)
+        self.assertIs(chained.exception(), ZeroDivisionError)
+        # gather keeps the order, as_completed does not
+        first, second = Future(), Future()
+        gathered = gather([first, second, failed(ValueError())])
+        second.set_result('second')
+        completion = as_completed([first, second], timeout=0.01)
+        self.assertEqual(next(completion).result(), 'second')
+        self.assertRaises(TimeoutError, lambda: next(completion))
+        self.assertFalse(gathered.done())
+        first.set_result('first')
+        results = gathered.result()
+        self.assertEqual(results[:2], ['first', 'second'])
+        self.assertIs(results[2], ValueError)
+        self.assertEqual(gather([]).result(), [])
+
+    def test_Future_callbacks(self):
+
+        def fail(future):
+            raise KeyError(future.result())
+
+        # failing callbacks fail their downstream future, the others run
+        future, downstream, called = Future(), Future(), []
+        future._add_done_callback(fail, downstream)
+        future.add_done_callback(called.append)
+        future.set_result('value')
+        self.assertEqual(called, [future])
+        self.assertIs(downstream.exception(), KeyError)
+        # and are reported if there is none
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            completed('value').add_done_callback(fail)
+            self.assertTrue('KeyError' in sys.stderr.getvalue())
+            # chained futures are done even if their callbacks fail
+            future = Future()
+            chained = future.then(lambda value: value)
+            chained.add_done_callback(fail)
+            gathered = gather([chained])
+            future.set_result('value')
+            self.assertEqual(gathered.result(1), ['value'])
+        finally:
+            sys.stderr = stderr
+
+    def test_afrom_search(self):
+
+        future = Spot.afrom_search(Search('Berlin'))
+        self.assertIs(future, Future)
+        spot = future.result(5)
+        self.assertEqual(spot, Spot.from_search(Search('Berlin')))
+        self.assertEqual(spot.elevation, 34.0)
+        future = Spot.afrom_scrape(
+            Scrape('https://de.wikipedia.org/wiki/Python'))
+        self.assertIs(future.exception(5), UserWarning)
+        self.assertRaises(ValueError, lambda: Spot.afrom_search('Berlin'))
+
+    def test_aresolve_spots(self):
+
+        objs = [
+            'Berlin',
+            'https://de.wikipedia.org/wiki/Python',
+            'https://de.wikipedia.org/wiki/Hamburg',
+            'Nirgendwo',
+        ]
+        futures = aresolve_spots(objs, limit=2)
+        results = gather(futures).result(5)
+        self.assertEqual(
+            map(repr, results), map(repr, resolve_spots(objs)))
+        self.assertIn('no search results', str(results[3]))
+        self.assertRaises(ValueError, lambda: aresolve_spots(objs, limit=0))
+        # no more lookups than the limit are in flight
+        core.transport.close()
+        core.transport = transport = ManualTransport(self.agent)
+        futures = aresolve_spots(objs * 3, limit=3)
+        self.assertEqual(len(transport.pending), 3)
+        while transport.pending:
+            self.assertTrue(len(transport.pending) <= 3)
+            transport.answer()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(
+            map(repr, gather(futures).result()), map(repr, results) * 3)
+
+
+MALFORMED_HTML = '''<!DOCTYPE html>
+<html><head><title>Moscow</title>
+<script>if (a < b && c) { document.write("<span class='latitude'>") }</script>
+<body><p>unclosed paragraph<br>
+<h1 id="firstHeading" class="firstHeading mw-first-heading"><span
+ class="mw-page-title-main">Moscow</span></h1>
+<div id="content"><table><tr><td>&nbsp;&#160;
+<span class="geo-dms"><span class="latitude">55&#176;45&prime;21&Prime;N</span>
+<span class="longitude">37\xc2\xb037\xe2\x80\xb217\xe2\x80\xb3E</span></span>
+<span class="latitude">1\xc2\xb02\xe2\x80\xb2N</span>
+<span class="elevation">156</span>
+</td></div>'''
+
+
+class CoordinatesTest(BaseTest):
+
+    def test_parse_coordinate(self):
+
+        for text, language, expected in (
+                ('52.516666666667', 'de', 52.516666666667),
+                (u'52,5', 'de', 52.5),
+                (u'−12,5', 'de', -12.5),
+                (u'1°30′N', 'en', 1.5),
+                (u'2°15′W', 'en', -2.25),
+                (u'55°45′21″N', 'en', 55.75583333333333),
+                ('55\xc2\xb045\xe2\x80\xb221\xe2\x80\xb3S', 'en',
+                 -55.75583333333333),
+                (u'37° 37′ 17″ O', 'de', 37.62138888888889),
+                (u'2° 21′ 03″ O', 'fr', -2.3508333333333336),
+                (u'48° 51\' 24" N', 'fr', 48.85666666666667),
+                (u'48° 51\' 24\'\' E', 'fr', 48.85666666666667),
+                ('40 42 51 N', 'en', 40.71416666666667),
+                (u'10,5° S', 'de', -10.5),
+                (u'52°N', 'en', 52.0)):
+            self.assertAlmostEqual(
+                parse_coordinate(text, language), expected, 10)
+        for text in u'abc', u'', u'61′ N', u'52°61′N', u'52°30′61″N':
+            self.assertRaises(ValueError, lambda: parse_coordinate(text))
+        # french hemispheres are spelled out as well
+        for text, expected in (
+                (u'48° 51′ 24″ nord', 48.85666666666667),
+                (u'2° 21′ 03″ Est', 2.3508333333333336),
+                (u'33° 52′ sud', -33.86666666666667),
+                (u'2° 21′ 03″ ouest', -2.3508333333333336)):
+            self.assertAlmostEqual(parse_coordinate(text, 'fr'), expected, 10)
+        # degrees beyond the poles or the antimeridian
+        for text, limit in (
+                ('nan', 180), ('inf', 180), ('-inf', 180), ('1e5', 180),
+                ('200', 180), ('91', 90), (u'95° N', 90), (u'181°W', 180)):
+            self.assertRaises(
+                ValueError, lambda: parse_coordinate(text, limit=limit))
+        self.assertEqual(parse_coordinate('-90', limit=90), -90.0)
+        self.assertRaises(
+            ValueError, lambda: parse_coordinate('52.5', language='it'))
+
+    def test_parse_coordinates(self):
+
+        values = parse_coordinates(['1.5', '-2', '3e1'])
+        self.assertIs(values, array)
+        self.assertEqual(list(values), [1.5, -2.0, 30.0])
+        self.assertEqual(list(parse_coordinates(['1,5', '2'], 'de')),
+                         [1.5, 2.0])
+        self.assertEqual(
+            list(parse_coordinates(iter([u'1,5', u'1°30′O']), 'de')),
+            [1.5, 1.5])
+        self.assertEqual(
+            list(parse_coordinates([u'1,5', u'1°30′O'], 'fr')), [1.5, -1.5])
+        self.assertEqual(len(parse_coordinates([])), 0)
+        self.assertRaises(
+            ValueError, lambda: parse_coordinates(['1.5', 'north']))
+        for texts in ['1.5', 'nan'], ['1.5', '-inf'], ['1,5', '200']:
+            self.assertRaises(
+                ValueError, lambda: parse_coordinates(texts, 'de'))
+        self.assertRaises(
+            ValueError, lambda: parse_coordinates(['45', '91'], limit=90))
+
+
+# file-like object counting the bytes read
+class CountingFile(object):
+
+    def __init__(self, content):
+        self.fd = StringIO(content)
+        self.size = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        data = self.fd.read(size)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class ScrapeTest(FakeAgentTest):
+
+    def test_evaluate_page(self):
+
+        url = 'https://en.wikipedia.org/wiki/Moscow'
+        self.agent.add_page(url, 'Moscow')
+        self.agent.responses[Scrape.URL_OPTS % url] = MALFORMED_HTML
+        scrape = Scrape(url)
+        scrape.scrape_url()
+        self.assertStrEqual(scrape.title, 'Moscow')
+        self.assertAlmostEqual(scrape.latitude, 55.755833, places=5)
+        self.assertAlmostEqual(scrape.longitude, 37.621389, places=5)
+        self.assertEqual(scrape.elevation, 156.0)
+
+    def test_invalid_coordinates(self):
+
+        # out of range or not finite coordinates are no spot
+        for latitude, longitude in ('nan', '13.4'), ('95', '13.4'), (
+                '52.5', '1e5'):
+            url = 'https://de.wikipedia.org/wiki/Berlin_%s' % latitude
+            self.agent.add_page(
+                url, 'Berlin', latitude=latitude, longitude=longitude)
+            self.assertRaises(UserWarning, Scrape(url).scrape_url)
+
+    def test_early_termination(self):
+
+        scrape = Scrape('https://de.wikipedia.org/wiki/Berlin')
+        # title and coordinates followed by elevation
+        content = PAGE_XHTML % (
+            'Berlin', COORDINATES_XHTML % ('52.5', '13.4') +
+            '<span class="elevation">34</span>' + ' ' * (1024 * 1024))
+        fd = CountingFile(content)
+        fields = scrape._evaluate_page(fd)
+        self.assertEqual(fields, {
+            'title': 'Berlin', 'latitude': '52.5', 'longitude': '13.4',
+            'elevation': '34'})
+        self.assertEqual(fd.size, Scrape.CHUNK_SIZE)
+        # title and coordinates without elevation
+        content = PAGE_XHTML % (
+            'Berlin', COORDINATES_XHTML % ('52.5', '13.4') +
+            ' ' * (1024 * 1024) + '<span class="elevation">34</span>')
+        fd = CountingFile(content)
+        fields = scrape._evaluate_page(fd)
+        self.assertEqual(fields, {
+            'title': 'Berlin', 'latitude': '52.5', 'longitude': '13.4'})
+        self.assertEqual(fd.size, Scrape.CHUNK_SIZE + Scrape.LOOKAHEAD)
+
+
+# local stand-in for the mediawiki query api
+class StandInApi(StandInServer):
+
+    def __init__(self, pages, redirects=None, searches=None):
+        self.pages = pages
+        self.redirects = redirects or {}
+        self.searches = searches or {}
+        self.requests = []
+        StandInServer.__init__(self, self.handle)
+
+    def handle(self, request):
+        language = request.path.split('/')[1]
+        query = urlparse.parse_qs(urlparse.urlsplit(request.path).query)
+        self.requests.append((language, query))
+        content = self.query(language, query)
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.end_headers()
+        request.wfile.write(json.dumps(content))
+
+    def query(self, language, query):
+        if 'gsrsearch' in query:
+            return self.search(language, query)
+        result = {'normalized': [], 'redirects': [], 'pages': {}}
+        for index, title in enumerate(query['titles'][0].split('|')):
+            title = title.decode('utf-8')
+            if title[:1].islower():
+                normalized = title[0].upper() + title[1:]
+                result['normalized'].append({'from': title, 'to': normalized})
+                title = normalized
+            if title in self.redirects:
+                result['redirects'].append(
+                    {'from': title, 'to': self.redirects[title]})
+                title = self.redirects[title]
+            page = {'ns': 0, 'title': title}
+            if (language, title) not in self.pages:
+                page['missing'] = ''
+            elif self.pages[(language, title)] is not None:
+                latitude, longitude = self.pages[(language, title)]
+                page['coordinates'] = [{
+                    'lat': latitude, 'lon': longitude, 'primary': '',
+                    'globe': 'earth'}]
+            result['pages'][str(-1 - index)] = page
+        return {'query': result}
+
+    def search(self, language, query):
+        term = query['gsrsearch'][0].decode('utf-8')
+        result = {'pages': {}}
+        for index, title in enumerate(self.searches.get(term, [])):
+            page = {
+                'ns': 0, 'title': title, 'index': index + 1,
+                'fullurl': 'https://%s.wikipedia.org/wiki/%s' % (
+                    language, title.replace(' ', '_'))}
+            if self.pages.get((language, title)) is not None:
+                latitude, longitude = self.pages[(language, title)]
+                page['coordinates'] = [{
+                    'lat': latitude, 'lon': longitude, 'primary': '',
+                    'globe': 'earth'}]
+            result['pages'][str(1000 - index)] = page
+        if not result['pages']:
+            return {}
+        return {'query': result}
+
+
+class ApiTest(BaseTest):
+
+    def setUp(self):
+        pages = {
+            ('de', u'Köln'): (50.938056, 6.956944),
+            ('en', u'New York City'): (40.71274, -74.005974),
+            ('en', u'Python'): None,
+        }
+        for index in range(120):
+            pages[('de', u'Ort %d' % index)] = (float(index) / 10, 8.0)
+        searches = {
+            u'Koeln': [u'Köln', u'Kölner Dom'],
+            u'New York': [u'New York City'],
+            u'Schlange': [u'Python'],
+        }
+        self.api = StandInApi(
+            pages, redirects={u'NYC': u'New York City'}, searches=searches)
+        self._api_url = BatchScrape.API_URL
+        BatchScrape.API_URL = Locate.API_URL = self.api.url + '/%s/api.php'
+        self._agent = core.agent
+        self.agent = core.agent = FakeAgent(agent=self._agent)
+        self.agent.add_page(
+            'https://en.wikipedia.org/wiki/Python', 'Python',
+            latitude=u'1°30′N', longitude=u'2°15′W', elevation='3')
+        url = Scrape.URL_OPTS % 'https://fr.wikipedia.org/wiki/Nulle_part'
+        self.agent.responses[url] = urllib2.HTTPError(
+            url, 404, 'Not Found', None, None)
+
+    def test_BatchScrape(self):
+
+        self.assertRaises(ValueError, lambda: BatchScrape(
+            ['https://it.wikipedia.org/wiki/Roma']))
+        urls = ['https://de.wikipedia.org/wiki/Ort_%d' % index
+                for index in range(120)]
+        urls[7:7] = [
+            'https://en.wikipedia.org/wiki/NYC',
+            'https://de.wikipedia.org/wiki/K%C3%B6ln',
+            'https://en.wikipedia.org/wiki/new_York_City',
+            'https://en.wikipedia.org/wiki/Python',
+            'https://fr.wikipedia.org/wiki/Nulle_part',
+        ]
+        batch = BatchScrape(urls)
+        batch.scrape_urls()
+        # one request per language and 50 titles
+        self.assertEqual(len(self.api.requests), 5)
+        self.assertEqual(len(batch.results), len(urls))
+        self.assertEqual(batch.results[6], {
+            'title': 'Ort 6', 'url': urls[6], 'latitude': 0.6,
+            'longitude': 8.0, 'elevation': None})
+        # redirects and normalized titles
+        self.assertStrEqual(batch.results[7]['title'], 'New York City')
+        self.assertStrEqual(batch.results[7]['url'], urls[7])
+        self.assertStrEqual(batch.results[9]['title'], 'New York City')
+        self.assertEqual(batch.results[8]['title'], u'Köln')
+        # pages without coordinates are scraped
+        self.assertEqual(batch.results[10]['latitude'], 1.5)
+        self.assertEqual(batch.results[10]['longitude'], -2.25)
+        self.assertEqual(batch.results[10]['elevation'], 3.0)
+        self.assertIs(batch.results[11], urllib2.HTTPError)
+        self.assertEqual(batch.results[-1]['latitude'], 11.9)
+        # without fallback
+        batch = BatchScrape(urls[7:12], fallback=False)
+        batch.scrape_urls()
+        self.assertIs(batch.results[3], UserWarning)
+        self.assertIs(batch.results[4], UserWarning)
+
+    def test_Spot(self):
+
+        self.assertRaises(ValueError, lambda: Spot.from_titles(
+            Search('New York City')))
+        spots = Spot.from_titles(BatchScrape([
+            'https://en.wikipedia.org/wiki/NYC',
+            'https://fr.wikipedia.org/wiki/Nulle_part']))
+        self.assertIs(spots[0], Spot)
+        self.assertStrEqual(spots[0].title, 'New York City')
+        self.assertIs(spots[1], urllib2.HTTPError)
+
+    def test_Locate(self):
+
+        self.assertRaises(ValueError, lambda: Locate('Roma', language='it'))
+        locate = Locate('Koeln')
+        locate.locate_term()
+        self.assertEqual(locate.title, u'Köln')
+        self.assertStrEqual(
+            locate.url, 'https://de.wikipedia.org/wiki/K\xc3\xb6ln')
+        self.assertEqual(locate.latitude, 50.938056)
+        self.assertEqual(locate.longitude, 6.956944)
+        self.assertEqual(locate.elevation, None)
+        locate = Locate('Nirgendwo')
+        self.assertRaises(UserWarning, lambda: locate.locate_term())
+        # spot
+        self.assertRaises(ValueError, lambda: Spot.from_locate(
+            Search('New York City')))
+        spot = Spot.from_locate(Locate('New York', language='en'))
+        self.assertIs(spot, Spot)
+        self.assertStrEqual(spot.title, 'New York City')
+        self.assertEqual(len(self.api.requests), 3)
+        # best match without coordinates is scraped
+        spot = Spot.from_locate(Locate('Schlange', language='en'))
+        self.assertEqual(spot.elevation, 3.0)
+
+    def test_resolve_spots(self):
+
+        objs = [
+            'Koeln',
+            'https://de.wikipedia.org/wiki/Ort_1',
+            'Nirgendwo',
+            'https://de.wikipedia.org/wiki/Ort_2',
+        ]
+        spots = resolve_spots(objs, api=True, workers=2)
+        self.assertEqual(spots[0].title, u'Köln')
+        self.assertStrEqual(spots[1].title, 'Ort 1')
+        self.assertIs(spots[2], UserWarning)
+        self.assertStrEqual(spots[3].title, 'Ort 2')
+        # one request per search term, one for all urls
+        self.assertEqual(len(self.api.requests), 3)
+
+    def tearDown(self):
+        BatchScrape.API_URL = Locate.API_URL = self._api_url
+        core.agent = self._agent
+        self.api.close()
+
+
+class AgentTest(BaseTest):
+
+    def setUp(self):
+        self.connections = set()
+        self.requests = []
+
+        def handle(request):
+            self.connections.add(request.client_address)
+            self.requests.append(request.headers)
+            if request.path.startswith('/redirect'):
+                request.send_response(302)
+                request.send_header('Location', '/page')
+                request.send_header('Content-Length', '0')
+                request.end_headers()
+                return
+            if request.path == '/missing':
+                request.send_response(404)
+                request.send_header('Content-Length', '7')
+                request.end_headers()
+                request.wfile.write('missing')
+                return
+            content = 'content of %s\n' % request.path
+            if request.path == '/large':
+                content *= 100000
+            request.send_response(200)
+            encoding = request.headers.get('Accept-Encoding', '')
+            if 'gzip' in encoding and request.path != '/large':
+                buf = StringIO()
+                with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                    f.write(content)
+                content = buf.getvalue()
+                request.send_header('Content-Encoding', 'gzip')
+            request.send_header('Content-Length', str(len(content)))
+            request.end_headers()
+            request.wfile.write(content)
+
+        self.server = StandInServer(handle, protocol_version='HTTP/1.1')
+        self.agent = Agent(timeout=5)
+        self.agent.addheaders = [('User-agent', 'Mozilla/5.0')]
+
+    def test_open(self):
+
+        url = '%s/page' % self.server.url
+        for index in range(3):
+            fd = self.agent.open(url)
+            self.assertStrEqual(fd.read(), 'content of /page\n')
+            fd.close()
+        # connection is kept alive, transfer is compressed
+        self.assertEqual(len(self.connections), 1)
+        self.assertStrEqual(self.requests[0]['Accept-Encoding'], 'gzip')
+        self.assertStrEqual(self.requests[0]['User-agent'], 'Mozilla/5.0')
+        # redirects are followed
+        fd = self.agent.open('%s/redirect' % self.server.url)
+        self.assertStrEqual(fd.read(), 'content of /page\n')
+        self.assertStrEqual(fd.geturl(), url)
+        self.assertEqual(len(self.connections), 1)
+        # errors
+        try:
+            self.agent.open('%s/missing' % self.server.url)
+        except urllib2.HTTPError as error:
+            self.assertEqual(error.code, 404)
+            self.assertStrEqual(error.read(), 'missing')
+        else:
+            self.fail('HTTPError not raised')
+        self.assertRaises(
+            urllib2.URLError, lambda: self.agent.open('ftp://localhost/'))
+
+    def test_proxy(self):
+
+        # the stand-in server proxies plain requests by their absolute url
+        address = self.server.url[len('http://'):]
+        agent = Agent(timeout=5, proxies={
+            'http': 'http://user:secret@%s' % address,
+            'https': address})
+        try:
+            fd = agent.open('http://wegweiser.invalid/page')
+            self.assertStrEqual(
+                fd.read(), 'content of http://wegweiser.invalid/page\n')
+            fd.close()
+            self.assertStrEqual(
+                self.requests[-1]['Proxy-Authorization'],
+                'Basic dXNlcjpzZWNyZXQ=')
+            # tls through a tunnel of the proxy
+            connection, pooled = agent._acquire(('https', 'de.wikipedia.org'))
+            self.assertEqual(
+                (connection.host, connection.port), ('127.0.0.1', int(
+                    address.split(':')[1])))
+            self.assertEqual(connection._tunnel_host, 'de.wikipedia.org')
+        finally:
+            agent.close()
+        # proxies of the environment
+        proxy = os.environ.get('http_proxy')
+        os.environ['http_proxy'] = 'http://proxy.invalid:3128'
+        try:
+            self.assertStrEqual(
+                Agent().proxies['http'], 'http://proxy.invalid:3128')
+        finally:
+            if proxy is None:
+                del os.environ['http_proxy']
+            else:
+                os.environ['http_proxy'] = proxy
+
+    def test_streaming(self):
+
+        fd = self.agent.open('%s/large' % self.server.url)
+        self.assertStrEqual(fd.read(5), 'conte')
+        self.assertStrEqual(fd.read(12), 'nt of /large')
+        # partially read connection is not reused
+        fd.close()
+        fd = self.agent.open('%s/large' % self.server.url)
+        self.assertEqual(len(fd.read()), 1800000)
+        fd.close()
+        self.assertEqual(len(self.connections), 2)
+
+    def tearDown(self):
+        self.agent.close()
+        self.server.close()
+
+
+class InstrumentTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.events = []
+        subscribe(self.events.append)
+
+    def tearDown(self):
+        unsubscribe(self.events.append)
+        FakeAgentTest.tearDown(self)
+
+    def phases(self):
+        return [event.phase for event in self.events]
+
+    def test_Phase(self):
+
+        with Phase('parse', 'url') as phase:
+            phase.bytes = 10
+            phase.cached = False
+        event, = self.events
+        self.assertEqual(event.phase, 'parse')
+        self.assertEqual(event.url, 'url')
+        self.assertEqual(event.bytes, 10)
+        self.assertEqual(event.cached, False)
+        self.assertTrue(event.seconds >= 0)
+        # nothing is timed without subscribers
+        unsubscribe(self.events.append)
+        try:
+            with Phase('parse'):
+                pass
+        finally:
+            subscribe(self.events.append)
+        self.assertEqual(len(self.events), 1)
+
+    def test_Profile(self):
+
+        self.assertEqual(percentile(range(1, 101), 0.5), 50)
+        self.assertEqual(percentile(range(1, 101), 0.99), 99)
+        self.assertEqual(percentile([3], 0.95), 3)
+        self.assertRaises(ValueError, lambda: percentile([], 0.5))
+        self.assertRaises(ValueError, lambda: percentile([1], 2))
+        profile = Profile()
+        subscribe(profile)
+        try:
+            for index in range(100):
+                with Phase('download') as phase:
+                    phase.bytes = 100
+                with Phase('cache') as phase:
+                    phase.cached = index % 4 == 0
+        finally:
+            unsubscribe(profile)
+        self.assertEqual(profile.phases, ['cache', 'download'])
+        self.assertEqual(profile.count('download'), 100)
+        self.assertEqual(profile.bytes('download'), 10000)
+        self.assertEqual(profile.hits('cache'), (25, 100))
+        p50, p95, p99 = profile.percentiles('download')
+        self.assertTrue(p50 <= p95 <= p99)
+        lines = profile.report().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('cache'))
+        self.assertTrue(lines[1].endswith('25/100'))
+        self.assertEqual(lines[2].split()[-2], '10000')
+
+    def test_transport(self):
+
+        def handle(request):
+            request.send_response(200)
+            request.send_header('Content-Length', '7')
+            request.end_headers()
+            request.wfile.write('content')
+
+        server = StandInServer(handle, protocol_version='HTTP/1.1')
+        directory = tempfile.mkdtemp()
+        try:
+            agent = Agent(cache=Cache(directory, ttl=60), timeout=5)
+            url = '%s/page' % server.url
+            for index in range(2):
+                fd = agent.open(url)
+                self.assertStrEqual(fd.read(), 'content')
+                fd.close()
+        finally:
+            server.close()
+            shutil.rmtree(directory)
+        self.assertEqual(
+            self.phases(),
+            ['cache', 'connect', 'request', 'download', 'cache'])
+        self.assertEqual(self.events[0].cached, False)
+        self.assertEqual(self.events[3].bytes, 7)
+        self.assertEqual(self.events[3].url, url)
+        self.assertEqual(self.events[4].cached, True)
+
+    def test_resolve(self):
+
+        url = 'https://de.wikipedia.org/wiki/Berlin'
+        self.agent.add_page(url, 'Berlin', '52.516667', '13.383333')
+        resolve_spot(url)
+        self.assertEqual(self.phases(), ['parse', 'coordinates', 'resolve'])
+        self.assertEqual(self.events[-1].url, url)
+        self.assertTrue(self.events[0].bytes > 0)
+
+
+# stand-in server answering 429 above a number of concurrent requests
+class ThrottlingServer(StandInServer):
+
+    def __init__(self, concurrency=2, delay=0.02):
+        self.concurrency = concurrency
+        self.active = 0
+        self.served = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        # status and headers answered first, before throttling applies
+        self.script = []
+
+        def handle(request):
+            with self.lock:
+                scripted = self.script.pop(0) if self.script else None
+                self.active += 1
+                throttled = scripted is None and (
+                    self.active > self.concurrency)
+            try:
+                if scripted is not None:
+                    code, headers = scripted
+                elif throttled:
+                    code, headers = 429, {}
+                else:
+                    time.sleep(delay)
+                    code, headers = 200, {}
+                content = 'content of %s' % request.path
+                request.send_response(code)
+                for name, value in headers.items():
+                    request.send_header(name, value)
+                request.send_header('Content-Length', str(len(content)))
+                request.end_headers()
+                request.wfile.write(content)
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    if code == 429:
+                        self.throttled += 1
+                    elif code == 200:
+                        self.served += 1
+
+        StandInServer.__init__(self, handle, protocol_version='HTTP/1.1')
+
+
+class ThrottleTest(BaseTest):
+
+    def setUp(self):
+        self.server = ThrottlingServer()
+        self.url = '%s/page' % self.server.url
+
+    def tearDown(self):
+        self.server.close()
+
+    def agent(self, **options):
+        options.setdefault('backoff', 0.01)
+        return Agent(timeout=5, scheduler=Scheduler(**options))
+
+    def read(self, agent, url=None):
+        fd = agent.open(url or self.url)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def test_retry_after(self):
+
+        self.assertEqual(retry_after('3'), 3.0)
+        self.assertEqual(retry_after(None), None)
+        self.assertEqual(retry_after('soon'), None)
+        self.assertEqual(
+            retry_after('Wed, 21 Oct 2015 07:28:10 GMT', now=1445412480),
+            10.0)
+        self.assertEqual(
+            retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412490),
+            0.0)
+
+    def test_retry(self):
+
+        self.server.script = [
+            (503, {'Retry-After': '0'}),
+            (429, {}),
+            (200, {'MediaWiki-API-Error': 'maxlag', 'Retry-After': '0'}),
+        ]
+        agent = self.agent()
+        self.assertStrEqual(self.read(agent), 'content of /page')
+        self.assertEqual(self.server.served, 2)
+        # given up after the retries
+        self.server.script = [(503, {})] * 2 + [(404, {})]
+        agent = self.agent(retries=1)
+        try:
+            self.read(agent)
+            self.fail('HTTPError expected')
+        except urllib2.HTTPError as error:
+            self.assertEqual(error.code, 503)
+        # other errors are not retried
+        try:
+            self.read(agent)
+            self.fail('HTTPError expected')
+        except urllib2.HTTPError as error:
+            self.assertEqual(error.code, 404)
+        self.assertEqual(self.server.script, [])
+        self.assertRaises(ValueError, lambda: Scheduler(retries=-1))
+        self.assertRaises(ValueError, lambda: Scheduler(rate=0))
+        # pauses of the host are capped like the delays
+        self.server.script = [(503, {'Retry-After': '3600'})]
+        agent = self.agent(max_delay=0.1)
+        start = time.time()
+        self.assertStrEqual(self.read(agent), 'content of /page')
+        self.assertTrue(time.time() - start < 5)
+        host = agent.scheduler.host(self.url)
+        self.assertTrue(host.resume < time.time() + 1)
+
+    def test_adaptive(self):
+
+        agent = self.agent(concurrency=8, retries=10)
+        pool = ThreadPool(8)
+        try:
+            results = pool.map(
+                lambda index: self.read(agent, '%s/%d' % (
+                    self.server.url, index)), range(40))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(
+            results, ['content of /%d' % index for index in range(40)])
+        # concurrency backs off towards what the server sustains
+        limiter = agent.scheduler.host(self.url).limiter
+        self.assertTrue(self.server.throttled > 0)
+        self.assertTrue(limiter.limit < 8)
+        self.assertEqual(limiter.active, 0)
+
+    def test_TokenBucket(self):
+
+        self.assertRaises(ValueError, lambda: TokenBucket(0))
+        bucket = TokenBucket(100, burst=2)
+        start = time.time()
+        for index in range(12):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.09)
+        self.assertRaises(ValueError, lambda: Limiter(1, minimum=2))
+        limiter = Limiter(4)
+        limiter.decrease()
+        limiter.decrease()
+        self.assertEqual(limiter.limit, 1)
+        for index in range(10):
+            limiter.increase()
+        self.assertEqual(limiter.limit, 4)
+
+
+class CacheTest(BaseTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.requests = []
+
+        def handle(request):
+            self.requests.append(request.headers.get('If-None-Match'))
+            if request.headers.get('If-None-Match') == '"v1"':
+                request.send_response(304)
+                request.end_headers()
+                return
+            request.send_response(200)
+            request.send_header('ETag', '"v1"')
+            request.end_headers()
+            request.wfile.write('content of %s' % request.path)
+
+        self.server = StandInServer(handle)
+
+    def test_normalize_url(self):
+
+        self.assertStrEqual(
+            normalize_url('HTTPS://DE.Wikipedia.org/wiki/New%20York?b=2&a=1'),
+            normalize_url('https://de.wikipedia.org/wiki/New York?a=1&b=2'))
+
+    def test_Cache(self):
+
+        self.assertRaises(ValueError, lambda: Cache(self.directory, ttl=-1))
+        cache = Cache(self.directory, ttl=60, max_size=1024)
+        self.assertEqual(cache.get('missing'), (None, False))
+        cache.set('key', {'title': u'Köln', 'latitude': 50.93})
+        self.assertEqual(
+            cache.get('key'), ({'title': u'Köln', 'latitude': 50.93}, True))
+        # ttl
+        cache = Cache(self.directory, ttl=0)
+        self.assertEqual(
+            cache.get('key'), ({'title': u'Köln', 'latitude': 50.93}, False))
+        # least recently used entries are evicted
+        cache = Cache(self.directory, max_size=1300)
+        cache.clear()
+        for index in range(3):
+            cache.set('entry%d' % index, 'x' * 400)
+            os.utime(cache._path('entry%d' % index), (index, index))
+        cache.get('entry0')
+        cache.set('entry3', 'x' * 400)
+        self.assertEqual(cache.get('entry1'), (None, False))
+        self.assertEqual(cache.get('entry0')[0], 'x' * 400)
+        self.assertEqual(cache.get('entry3')[0], 'x' * 400)
+        # evicted below the maximum, the next entry fits without eviction
+        self.assertTrue(cache._size <= 1300 * Cache.LOW_WATER)
+        entries = cache._entries
+        cache._entries = lambda: self.fail('cache evicted again')
+        cache.set('entry4', 'x' * 10)
+        cache._entries = entries
+        cache.clear()
+        self.assertEqual(cache.get('entry3'), (None, False))
+
+    def test_Agent(self):
+
+        url = '%s/page' % self.server.url
+        agent = Agent(cache=Cache(self.directory, ttl=60))
+        self.assertStrEqual(agent.open(url).read(), 'content of /page')
+        self.assertStrEqual(agent.open(url).read(), 'content of /page')
+        self.assertEqual(self.requests, [None])
+        # stale entries are revalidated
+        agent.cache = Cache(self.directory, ttl=0)
+        self.assertStrEqual(agent.open(url).read(), 'content of /page')
+        self.assertEqual(self.requests, [None, '"v1"'])
+        # no cache
+        agent.cache = None
+        self.assertStrEqual(agent.open(url).read(), 'content of /page')
+        self.assertEqual(len(self.requests), 3)
+        # pages read partially are not cached
+        agent.cache = Cache(self.directory, ttl=60)
+        url = '%s/partial' % self.server.url
+        for index in range(2):
+            fd = agent.open(url, cache=False)
+            self.assertStrEqual(fd.read(7), 'content')
+            fd.close()
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(agent.cache.get(normalize_url(url)), (None, False))
+
+    def test_Scrape(self):
+
+        url = 'https://de.wikipedia.org/wiki/Python'
+        agent = FakeAgent(cache=Cache(self.directory))
+        agent.add_page(url, 'Python')
+        core.agent, _agent = agent, core.agent
+        try:
+            for index in range(2):
+                scrape = Scrape(url)
+                self.assertRaises(UserWarning, lambda: scrape.scrape_url())
+        finally:
+            core.agent = _agent
+        # negative result is cached
+        self.assertEqual(len(agent.requests), 1)
+
+    def test_revalidate_Scrape(self):
+
+        requests = []
+        page = PAGE_XHTML % (
+            'Berlin', COORDINATES_XHTML % ('52.5', '13.4'))
+
+        def handle(request):
+            requests.append(request.headers.get('If-None-Match'))
+            if request.headers.get('If-None-Match') == '"v2"':
+                request.send_response(304)
+                request.end_headers()
+                return
+            request.send_response(200)
+            request.send_header('ETag', '"v2"')
+            request.send_header('Content-Length', str(len(page)))
+            request.end_headers()
+            request.wfile.write(page)
+
+        server = StandInServer(handle)
+        agent = Agent(cache=Cache(self.directory, ttl=0))
+        # articles are served by the stand-in server
+        fetch = agent._fetch
+        agent._fetch = lambda url, headers=None: fetch(url.replace(
+            'https://de.wikipedia.org', server.url), headers)
+        core.agent, _agent = agent, core.agent
+        try:
+            url = 'https://de.wikipedia.org/wiki/Berlin'
+            for index in range(2):
+                scrape = Scrape(url)
+                scrape.scrape_url()
+                self.assertEqual(scrape.latitude, 52.5)
+            scrape = Scrape(url)
+            scrape.ascrape_url().result(5)
+            self.assertEqual(scrape.longitude, 13.4)
+        finally:
+            core.agent = _agent
+            agent.close()
+            server.close()
+        # stale fields are revalidated, unchanged pages are not read again
+        self.assertEqual(requests, [None, '"v2"', '"v2"'])
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+
+class SpotCollectionTest(BaseTest):
+
+    def setUp(self):
+        self.spots = [
+            Spot(title='Berlin', latitude=52.52, longitude=13.405,
+                 elevation=34.0, url='https://de.wikipedia.org/wiki/Berlin'),
+            Spot(title='Hamburg', latitude=53.55, longitude=10.0,
+                 url='https://de.wikipedia.org/wiki/Hamburg'),
+            Spot(title='Munich', latitude=48.1375, longitude=11.575,
+                 elevation=519.0,
+                 url='https://de.wikipedia.org/wiki/M%C3%BCnchen'),
+        ]
+
+    def test_Spot(self):
+
+        spot = self.spots[0]
+        self.assertEqual(spot, Spot(
+            title='Berlin', latitude=52.52, longitude=13.405, elevation=34.0,
+            url='https://de.wikipedia.org/wiki/Berlin'))
+        self.assertNotEqual(spot, self.spots[1])
+        self.assertEqual(len(set(self.spots + self.spots)), 3)
+        self.failUnlessRaises(
+            AttributeError, setattr, spot, "population", 3500000)
+
+    def test_SpotCollection(self):
+
+        collection = SpotCollection(self.spots)
+        self.assertEqual(len(collection), 3)
+        self.assertEqual(list(collection), self.spots)
+        self.assertEqual(collection[1], self.spots[1])
+        self.assertEqual(collection[-1], self.spots[2])
+        self.assertRaises(
+            ValueError, lambda: collection.append(Search('Berlin')))
+        # columns
+        self.assertEqual(list(collection.latitudes), [52.52, 53.55, 48.1375])
+        self.assertEqual(collection.titles, ['Berlin', 'Hamburg', 'Munich'])
+        self.assertEqual(list(collection.rows())[1], (
+            'Hamburg', 'https://de.wikipedia.org/wiki/Hamburg', 53.55, 10.0,
+            None))
+        # slicing
+        part = collection[1:]
+        self.assertIs(part, SpotCollection)
+        self.assertEqual(list(part), self.spots[1:])
+        self.assertEqual(list(collection[::2]), self.spots[::2])
+        # bulk append
+        collection.extend(part)
+        self.assertEqual(len(collection), 5)
+        self.assertEqual(collection[4], self.spots[2])
+        collection.extend_columns(
+            ['A', 'B'], ['a', 'b'], [1.0, 2.0], [3.0, 4.0], [None, 5.0])
+        self.assertEqual(collection[5].elevation, None)
+        self.assertEqual(collection[6].elevation, 5.0)
+        self.assertRaises(ValueError, lambda: collection.extend_columns(
+            ['A'], ['a'], [1.0, 2.0], [3.0]))
+
+    def test_output(self):
+
+        collection = SpotCollection(self.spots)
+        markup = Markup()
+        markup.add_spot(collection)
+        markup.add_spot(self.spots[0])
+        self.assertEqual(len(markup.spots), 4)
+        kml = markup.generate_kml()
+        self.assertIn('<coordinates>10.0,53.55,0.0</coordinates>', kml)
+        self.assertIn('<coordinates>11.575,48.1375,519.0</coordinates>', kml)
+        geomap = Map()
+        geomap.add_marker(collection, label='A')
+        self.assertEqual(len(geomap.markers), 3)
+        self.assertEqual(geomap.spots, self.spots)
+        self.assertIn('53.55%2C10.0', geomap.generate_url())
+
+
+class SpotIndexTest(BaseTest):
+
+    def setUp(self):
+        rand = random.Random(42)
+        self.spots = SpotCollection()
+        self.spots.extend_columns(
+            ['spot %d' % index for index in range(2000)],
+            ['url %d' % index for index in range(2000)],
+            [rand.uniform(-89, 89) for index in range(2000)],
+            [rand.uniform(-180, 180) for index in range(2000)])
+        self.index = SpotIndex(self.spots, cell_size=1.0)
+        self.tmpfile = tempfile.NamedTemporaryFile(suffix='.idx')
+        self.tmpfile.close()
+
+    def distances(self, latitude, longitude):
+        return sorted(
+            (distance(latitude, longitude, spot.latitude, spot.longitude),
+             spot.title) for spot in self.spots)
+
+    def test_distance(self):
+
+        self.assertAlmostEqual(
+            distance(52.52, 13.405, 48.1375, 11.575), 504200, delta=500)
+        self.assertEqual(distance(10.0, 179.9, 10.0, 179.9), 0.0)
+
+    def test_nearest(self):
+
+        self.assertRaises(ValueError, lambda: SpotIndex(cell_size=0))
+        self.assertRaises(ValueError, lambda: self.index.nearest(0, 0, k=0))
+        for latitude, longitude in (0, 0), (52.5, 13.4), (-88, 179.9), (
+                89.9, -20):
+            expected = [
+                title for meters, title in self.distances(
+                    latitude, longitude)[:5]]
+            nearest = self.index.nearest(latitude, longitude, k=5)
+            self.assertEqual(nearest.titles, expected)
+        # more than indexed
+        self.assertEqual(len(self.index.nearest(0, 0, k=5000)), 2000)
+
+    def test_nearest_far(self):
+
+        # polar queries and queries far off a regional index
+        rand = random.Random(43)
+        for south, west, north, east, queries in (
+                (-90, -180, 90, 180, [(89.99, 45), (-89.99, -135)]),
+                (47, 6, 55, 15, [(0, 0), (-40, -120), (89.9, 100)])):
+            self.spots = SpotCollection()
+            self.spots.extend_columns(
+                ['spot %d' % index for index in range(20000)],
+                ['url %d' % index for index in range(20000)],
+                [rand.uniform(south, north) for index in range(20000)],
+                [rand.uniform(west, east) for index in range(20000)])
+            index = SpotIndex(self.spots)
+            for latitude, longitude in queries:
+                expected = [
+                    title for meters, title in self.distances(
+                        latitude, longitude)[:3]]
+                start = time.time()
+                nearest = index.nearest(latitude, longitude, k=3)
+                self.assertTrue(time.time() - start < 0.5)
+                self.assertEqual(nearest.titles, expected)
+
+    def test_within(self):
+
+        self.assertRaises(ValueError, lambda: self.index.within(0, 0, -1))
+        for latitude, longitude, radius in (
+                (0, 0, 500000), (45, 179.5, 800000), (-89, 0, 300000)):
+            expected = [
+                title for meters, title in self.distances(
+                    latitude, longitude) if meters <= radius]
+            within = self.index.within(latitude, longitude, radius)
+            self.assertEqual(within.titles, expected)
+
+    def test_bbox(self):
+
+        for south, west, north, east in (
+                (-10, -10, 10, 10), (30, 170, 60, -170), (-90, -180, 90, 180)):
+            expected = [
+                spot.title for spot in self.spots
+                if south <= spot.latitude <= north and (
+                    west <= spot.longitude <= east if west <= east else
+                    spot.longitude >= west or spot.longitude <= east)]
+            bbox = self.index.bbox(south, west, north, east)
+            self.assertEqual(bbox.titles, expected)
+
+    def test_insert_save_load(self):
+
+        index = SpotIndex()
+        index.extend(self.spots[:10])
+        index.insert(Spot(title='Berlin', latitude=52.52, longitude=13.405))
+        self.assertEqual(len(index), 11)
+        self.assertStrEqual(index.nearest(52.5, 13.4)[0].title, 'Berlin')
+        self.assertRaises(
+            ValueError, lambda: index.insert(Search('Berlin')))
+        self.index.save(self.tmpfile.name)
+        index = SpotIndex.load(self.tmpfile.name)
+        self.assertEqual(len(index), 2000)
+        self.assertEqual(index.cell_size, 1.0)
+        self.assertEqual(list(index.spots), list(self.spots))
+        self.assertEqual(
+            index.nearest(10, 10, k=3).titles,
+            self.index.nearest(10, 10, k=3).titles)
+
+    def tearDown(self):
+        if os.path.exists(self.tmpfile.name):
+            os.remove(self.tmpfile.name)
+
+
+GEO_TAGS_SQL = '''-- MySQL dump
+DROP TABLE IF EXISTS `geo_tags`;
+CREATE TABLE `geo_tags` (
+  `gt_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `gt_page_id` int(10) unsigned NOT NULL,
+  `gt_globe` varbinary(32) NOT NULL,
+  `gt_primary` tinyint(1) NOT NULL,
+  `gt_lat` decimal(11,8) DEFAULT NULL,
+  `gt_lon` decimal(11,8) DEFAULT NULL,
+  `gt_dim` int(11) DEFAULT NULL,
+  `gt_type` varbinary(32) DEFAULT NULL,
+  `gt_name` varbinary(255) DEFAULT NULL,
+  PRIMARY KEY (`gt_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `geo_tags` VALUES (1,10,'earth',1,52.51666667,13.38333333,10000,'city','Berlin (Stadt)'),(2,10,'earth',0,52.5,13.4,NULL,NULL,NULL),(3,11,'earth',1,50.93805556,6.95694444,NULL,'city',NULL);
+INSERT INTO `geo_tags` VALUES (4,12,'moon',1,0.67408,23.47297,NULL,'landmark','Tranquility'),(5,13,'earth',1,40.71274,-74.005974,NULL,NULL,'It\\'s (NYC)'),(6,14,'earth',1,48.8567,2.3508,NULL,NULL,NULL);
+'''
+
+PAGE_SQL = '''-- MySQL dump
+CREATE TABLE `page` (
+  `page_id` int(8) unsigned NOT NULL AUTO_INCREMENT,
+  `page_namespace` int(11) NOT NULL DEFAULT '0',
+  `page_title` varbinary(255) NOT NULL DEFAULT '',
+  `page_is_redirect` tinyint(1) unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`page_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+INSERT INTO `page` VALUES (10,0,'Berlin',0),(11,0,'K\xc3\xb6ln',0),(12,0,'Mond',0),(13,0,'New_York_(\\'City\\')',0),(14,2,'Paris',0),(15,0,'Python',0);
+'''
+
+
+class IngestTest(BaseTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.geo_tags = os.path.join(self.directory, 'geo_tags.sql.gz')
+        with gzip.open(self.geo_tags, 'wb') as f:
+            f.write(GEO_TAGS_SQL)
+        self.page = os.path.join(self.directory, 'page.sql')
+        with open(self.page, 'wb') as f:
+            f.write(PAGE_SQL)
+        self.store = SpotStore(os.path.join(self.directory, 'spots.sqlite'))
+
+    def test_read_dump(self):
+
+        rows = list(read_dump(
+            StringIO(GEO_TAGS_SQL), 'geo_tags', ['gt_name', 'gt_lat']))
+        self.assertEqual(rows[0], ('Berlin (Stadt)', 52.51666667))
+        self.assertEqual(rows[1], (None, 52.5))
+        self.assertEqual(rows[4], ("It's (NYC)", 40.71274))
+        self.assertEqual(len(rows), 6)
+        self.assertRaises(ValueError, lambda: list(read_dump(
+            StringIO(GEO_TAGS_SQL), 'geo_tags', ['gt_elevation'])))
+        self.assertRaises(ValueError, lambda: list(read_dump(
+            StringIO(GEO_TAGS_SQL.split('\n', 14)[-1]), 'geo_tags',
+            ['gt_lat'])))
+
+    def test_ingest(self):
+
+        self.assertRaises(ValueError, lambda: Ingest(self.store, 'it'))
+        ingest = Ingest(self.store, language='de')
+        self.assertEqual(ingest.ingest(self.geo_tags, self.page), 3)
+        self.assertEqual(len(self.store), 3)
+        spot = self.store.get('de', 'Berlin')
+        self.assertStrEqual(spot.title, 'Berlin')
+        self.assertStrEqual(spot.url, 'https://de.wikipedia.org/wiki/Berlin')
+        self.assertEqual(spot.latitude, 52.51666667)
+        self.assertEqual(spot.longitude, 13.38333333)
+        self.assertEqual(spot.elevation, None)
+        spot = self.store.get('de', 'new york (\'city\')')
+        self.assertStrEqual(
+            spot.url, "https://de.wikipedia.org/wiki/New_York_('City')")
+        spot = self.store.get('de', u'köln')
+        self.assertEqual(spot.title, u'Köln')
+        # secondary, non earth coordinates and other namespaces are skipped
+        self.assertEqual(self.store.get('de', 'Mond'), None)
+        self.assertEqual(self.store.get('de', 'Paris'), None)
+        self.assertEqual(self.store.get('en', 'Berlin'), None)
+
+    def test_normalize_title(self):
+
+        self.assertEqual(normalize_title(' New_York  City '), 'new york city')
+        self.assertEqual(normalize_title('K\xc3\xb6ln'), u'köln')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+
+class StoreTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.store = SpotStore(os.path.join(self.directory, 'spots.sqlite'))
+        self._store = core.store
+        self.agent.add_search(
+            'Berlin', [('Berlin', 'https://de.wikipedia.org/wiki/Berlin')])
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+
+    def test_SpotStore(self):
+
+        spots = [
+            Spot(title='Hamburg', latitude=53.55, longitude=10.0,
+                 url='https://de.wikipedia.org/wiki/Hamburg'),
+            Spot(title='Hameln', latitude=52.1, longitude=9.36,
+                 url='https://de.wikipedia.org/wiki/Hameln'),
+            Spot(title=u'Köln', latitude=50.94, longitude=6.96,
+                 url='https://de.wikipedia.org/wiki/K%C3%B6ln'),
+        ]
+        self.assertEqual(self.store.upsert('de', spots), 3)
+        self.assertEqual(self.store.upsert('de', spots[:1]), 1)
+        self.assertEqual(len(self.store), 3)
+        journal = self.store._connection.execute(
+            'PRAGMA journal_mode').fetchone()[0]
+        self.assertStrEqual(journal, 'wal')
+        # urls are matched normalized
+        spot = self.store.get_url(
+            'HTTPS://de.wikipedia.org/wiki/K%c3%b6ln#Lage')
+        self.assertEqual(spot.title, u'Köln')
+        self.assertEqual(self.store.get_url(
+            'https://de.wikipedia.org/wiki/Bremen'), None)
+        # prefix search by normalized title
+        self.assertEqual(
+            self.store.search('de', 'ham').titles, ['Hamburg', 'Hameln'])
+        self.assertEqual(self.store.search('de', 'HAM', limit=1).titles,
+                         ['Hamburg'])
+        self.assertEqual(len(self.store.search('en', 'ham')), 0)
+        self.assertEqual(
+            sorted(self.store.bbox(52, 9, 54, 11).titles),
+            ['Hamburg', 'Hameln'])
+        self.assertEqual(len(self.store.bbox(52, 11, 54, 9)), 0)
+        # search terms resolve to stored spots
+        self.assertEqual(self.store.get_term('de', 'hamburg').title, 'Hamburg')
+        self.assertEqual(self.store.get_term('de', 'Hansestadt'), None)
+        self.store.add_term(
+            'de', 'Hansestadt', 'https://de.wikipedia.org/wiki/Hamburg')
+        self.assertEqual(
+            self.store.get_term('de', 'hansestadt').title, 'Hamburg')
+        # articles differing by case only are kept apart
+        self.store.upsert('de', [
+            Spot(title='SAP', latitude=49.29, longitude=8.64,
+                 url='https://de.wikipedia.org/wiki/SAP'),
+            Spot(title='Sap', latitude=10.0, longitude=20.0,
+                 url='https://de.wikipedia.org/wiki/Sap')])
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.get_url(
+            'https://de.wikipedia.org/wiki/SAP').latitude, 49.29)
+        self.assertEqual(self.store.get('de', 'SAP').latitude, 49.29)
+        self.assertEqual(self.store.get('de', 'Sap').latitude, 10.0)
+        self.assertEqual(self.store.get_term('de', 'SAP').latitude, 49.29)
+        # ambiguous terms are searched again
+        self.assertEqual(self.store.get_term('de', 'sap'), None)
+        self.store.add_term('de', 'sap', 'https://de.wikipedia.org/wiki/SAP')
+        self.assertEqual(self.store.get_term('de', 'sap').latitude, 49.29)
+
+    def test_resolve_spots(self):
+
+        core.store = self.store
+        objs = ['Berlin', 'https://de.wikipedia.org/wiki/Hamburg']
+        results = resolve_spots(objs)
+        self.assertEqual(len(self.agent.requests), 3)
+        self.assertEqual(len(self.store), 2)
+        # resolved spots and terms are written back, no further requests
+        for api in False, True:
+            self.assertEqual(resolve_spots(objs, api=api), results)
+        self.assertEqual(len(self.agent.requests), 3)
+        self.assertStrEqual(self.store.get('de', 'Berlin').url,
+                            'https://de.wikipedia.org/wiki/Berlin')
+
+    def tearDown(self):
+        core.store = self._store
+        self.store.close()
+        shutil.rmtree(self.directory)
+        FakeAgentTest.tearDown(self)
+
+
+KML = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2" \
+xmlns:gx="http://www.google.com/kml/ext/2.2">
+    <Document id="1">
+        <Folder id="2">
+            <name>Weg &amp; Steg</name>
+            <Placemark id="4">
+                <name>Berlin &quot;Mitte&quot; &lt;DE&gt;</name>
+                <Point id="3">
+                    <coordinates>13.3833333333,52.5166666667,34.0</coordinates>
+                </Point>
+            </Placemark>
+            <Placemark id="6">
+                <name>K\xc3\xb6ln</name>
+                <Point id="5">
+                    <coordinates>6.96,50.94,0.0</coordinates>
+                </Point>
+            </Placemark>
+        </Folder>
+    </Document>
+</kml>
+'''
+
+
+class KmlWriterTest(BaseTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spots = SpotCollection([
+            Spot(title='Berlin "Mitte" <DE>', latitude=52.516666666667,
+                 longitude=13.383333333333, elevation=34.0,
+                 url='https://de.wikipedia.org/wiki/Berlin'),
+            Spot(title=u'K\xf6ln', latitude=50.94, longitude=6.96,
+                 url='https://de.wikipedia.org/wiki/K%C3%B6ln'),
+        ])
+
+    def test_KmlWriter(self):
+
+        f = StringIO()
+        writer = KmlWriter(f, title='Weg & Steg')
+        # placemarks are written as spots arrive
+        writer.write(self.spots[0])
+        self.assertIn('<name>Berlin &quot;Mitte', f.getvalue())
+        self.assertRaises(ValueError, lambda: writer.write('Berlin'))
+        writer.write_row(*list(self.spots.rows())[1])
+        writer.close()
+        writer.close()
+        self.assertEqual(writer.count, 2)
+        self.assertEqual(f.getvalue(), KML)
+        # names not set are left out like simplekml does
+        f = StringIO()
+        with KmlWriter(f, title=None) as writer:
+            writer.write(Spot(latitude=52.5, longitude=13.4))
+        self.assertEqual(f.getvalue(), (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<kml xmlns="http://www.opengis.net/kml/2.2" '
+            'xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+            '    <Document id="1">\n'
+            '        <Folder id="2">\n'
+            '            <Placemark id="4">\n'
+            '                <Point id="3">\n'
+            '                    <coordinates>13.4,52.5,0.0</coordinates>\n'
+            '                </Point>\n'
+            '            </Placemark>\n'
+            '        </Folder>\n'
+            '    </Document>\n'
+            '</kml>\n'))
+
+    def test_Markup(self):
+
+        markup = Markup(title='Weg & Steg')
+        markup.add_spot(self.spots)
+        self.assertIs(markup.generate_kml(), unicode)
+        self.assertEqual(markup.generate_kml(), KML.decode('utf-8'))
+        markup.filename = os.path.join(self.directory, 'spots.kml')
+        markup.save_kml_file()
+        with open(markup.filename, 'rb') as f:
+            self.assertEqual(f.read(), KML)
+        # zip compressed
+        markup.filename = os.path.join(self.directory, 'spots.kmz')
+        markup.save_kml_file()
+        with zipfile.ZipFile(markup.filename) as kmz:
+            self.assertEqual(kmz.namelist(), ['doc.kml'])
+            self.assertEqual(
+                kmz.getinfo('doc.kml').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(kmz.read('doc.kml'), KML)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+# file-like object recording what was written at every flush
+class FlushingFile(object):
+
+    def __init__(self):
+        self.data = ''
+        self.flushes = []
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        self.flushes.append(self.data)
+
+
+class StreamTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+        self.agent.add_page('https://de.wikipedia.org/wiki/Python', 'Python')
+        self.objs = [
+            'https://de.wikipedia.org/wiki/Berlin',
+            'https://de.wikipedia.org/wiki/Python',
+            'https://de.wikipedia.org/wiki/Hamburg',
+        ]
+
+    def test_iresolve_spots(self):
+
+        results = iresolve_spots(iter(self.objs))
+        # objects are resolved one by one as results are consumed
+        self.assertStrEqual(next(results).title, 'Berlin')
+        self.assertEqual(len(self.agent.requests), 1)
+        self.assertIs(next(results), UserWarning)
+        self.assertStrEqual(next(results).title, 'Hamburg')
+        self.assertRaises(StopIteration, lambda: next(results))
+        self.assertEqual(
+            map(repr, iresolve_spots(self.objs, workers=4)),
+            map(repr, resolve_spots(self.objs)))
+        self.assertRaises(
+            ValueError, lambda: iresolve_spots(self.objs, workers=0))
+
+    def test_NdjsonWriter(self):
+
+        f = FlushingFile()
+        with NdjsonWriter(f) as writer:
+            for spot in resolve_spots(self.objs[::2]):
+                writer.write(spot)
+        self.assertEqual(writer.count, 2)
+        # every record is flushed on its own
+        self.assertEqual(len(f.flushes), 2)
+        records = [json.loads(line) for line in f.flushes[0].splitlines()]
+        self.assertEqual(records, [{
+            'title': 'Berlin',
+            'url': 'https://de.wikipedia.org/wiki/Berlin',
+            'latitude': 52.516666666667,
+            'longitude': 13.383333333333,
+            'elevation': 34.0}])
+        self.assertEqual(len(f.data.splitlines()), 2)
+        self.assertRaises(ValueError, lambda: writer.write('Berlin'))
+
+    def test_GeoJsonWriter(self):
+
+        f = FlushingFile()
+        writer = GeoJsonWriter(f)
+        writer.extend(SpotCollection(resolve_spots(self.objs[::2])))
+        writer.close()
+        writer.close()
+        self.assertEqual(len(f.flushes), 4)
+        collection = json.loads(f.data)
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(len(collection['features']), 2)
+        feature = collection['features'][1]
+        self.assertEqual(feature['geometry'], {
+            'type': 'Point', 'coordinates': [10.0, 53.55]})
+        self.assertEqual(feature['properties']['title'], 'Hamburg')
+        self.assertEqual(
+            collection['features'][0]['geometry']['coordinates'][2], 34.0)
+        # empty collections are valid as well
+        f = FlushingFile()
+        GeoJsonWriter(f).close()
+        self.assertEqual(json.loads(f.data)['features'], [])
+
+    def test_plain_lists(self):
+
+        # lists of spots are taken like collections
+        spots = resolve_spots(self.objs[::2])
+        collection = SpotCollection(spots)
+        directory = tempfile.mkdtemp()
+        try:
+            for generate in generate_json, generate_markup:
+                outputs = []
+                for obj in spots, collection:
+                    filename = os.path.join(directory, 'spots')
+                    generate(obj, filename=filename)
+                    with open(filename, 'rb') as f:
+                        outputs.append(f.read())
+                self.assertEqual(outputs[0], outputs[1])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(
+            [geomap.generate_url() for geomap in build_maps(
+                spots, path=True)],
+            [geomap.generate_url() for geomap in build_maps(
+                collection, path=True)])
+
+    def test_stream_markup(self):
+
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'spots.kml')
+            count, errors = stream_markup(
+                self.objs, 'de', jobs=2, filename=filename)
+            self.assertEqual(count, 2)
+            self.assertEqual(len(errors), 1)
+            self.assertTrue(errors[0].startswith(self.objs[1]))
+            markup = Markup()
+            markup.add_spot(SpotCollection(resolve_spots(self.objs[::2])))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read().decode('utf-8'),
+                                 markup.generate_kml())
+            # zip compressed
+            filename = os.path.join(directory, 'spots.kmz')
+            count, errors = stream_markup(
+                self.objs, 'de', filename=filename)
+            self.assertEqual(count, 2)
+            with zipfile.ZipFile(filename) as kmz:
+                self.assertEqual(kmz.read('doc.kml').decode('utf-8'),
+                                 markup.generate_kml())
+        finally:
+            shutil.rmtree(directory)
+
+
+class ServerTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.agent.add_search(
+            'Berlin', [('Berlin', 'https://de.wikipedia.org/wiki/Berlin')])
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+        self.agent.add_page('https://de.wikipedia.org/wiki/Python', 'Python')
+        self.server = Server(('127.0.0.1', 0), SpotService(size=2))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        FakeAgentTest.tearDown(self)
+
+    def get(self, path, data=None):
+        try:
+            fd = urllib2.urlopen(self.server.url + path, data, timeout=5)
+        except urllib2.HTTPError as error:
+            fd = error
+        try:
+            content = fd.read()
+            if fd.info().getheader('Content-Type') == 'application/json':
+                content = json.loads(content)
+            return fd.getcode(), content
+        finally:
+            fd.close()
+
+    def test_spots(self):
+
+        path = '/spots?q=Berlin&q=https://de.wikipedia.org/wiki/Python'
+        code, content = self.get(path)
+        self.assertEqual(code, 200)
+        self.assertEqual(content['spots'][0]['title'], 'Berlin')
+        self.assertEqual(content['spots'][0]['elevation'], 34.0)
+        self.assertEqual(
+            content['errors'][0]['obj'],
+            'https://de.wikipedia.org/wiki/Python')
+        # resolved spots are kept warm, failures are not
+        requests = len(self.agent.requests)
+        self.assertEqual(self.get(path), (code, content))
+        self.assertEqual(len(self.agent.requests), requests + 1)
+        code, content = self.get(
+            '/spots', 'q=https://de.wikipedia.org/wiki/Hamburg')
+        self.assertEqual(content['spots'][0]['title'], 'Hamburg')
+        # bad requests
+        self.assertEqual(self.get('/spots')[0], 400)
+        self.assertEqual(self.get('/spots?q=Berlin&language=it')[0], 400)
+        self.assertEqual(self.get('/missing')[0], 404)
+        code, stats = self.get('/stats')
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(stats['errors'], 3)
+        self.assertEqual(stats['cache'], {'size': 2, 'hits': 1, 'misses': 4})
+        self.assertEqual(stats['phases']['serve /spots']['count'], 5)
+        self.assertTrue('p99' in stats['phases']['resolve'])
+
+    def test_kml(self):
+
+        code, content = self.get(
+            '/kml?q=Berlin&q=https://de.wikipedia.org/wiki/Hamburg'
+            '&title=Cities')
+        self.assertEqual(code, 200)
+        self.assertIn('<name>Cities</name>', content)
+        self.assertEqual(content.count('<Placemark'), 2)
+        code, content = self.get('/kml?q=https://de.wikipedia.org/wiki/Python')
+        self.assertEqual(code, 404)
+        code, content = self.get(
+            '/map?q=Berlin&q=https://de.wikipedia.org/wiki/Hamburg&path=1'
+            '&size=300x200')
+        self.assertEqual(code, 200)
+        url, = content['urls']
+        self.assertIn('size=300x200', url)
+        self.assertIn('path=', url)
+        self.assertEqual(self.get('/map?q=Berlin&size=huge')[0], 400)
+
+    def test_SpotService(self):
+
+        self.assertRaises(ValueError, lambda: SpotService(language='it'))
+        self.assertRaises(ValueError, lambda: SpotService(size=-1))
+        service = SpotService(size=1)
+        berlin, = service.resolve(['Berlin'])
+        hamburg, = service.resolve(['https://de.wikipedia.org/wiki/Hamburg'])
+        # least recently used spots are dropped
+        self.assertEqual(len(service), 1)
+        self.assertEqual(
+            service.resolve(['https://de.wikipedia.org/wiki/Hamburg']),
+            [hamburg])
+        self.assertEqual((service.hits, service.misses), (1, 2))
+        # spots located through the api are cached apart
+        service.resolve(['https://de.wikipedia.org/wiki/Hamburg'], api=True)
+        self.assertEqual((service.hits, service.misses), (1, 3))
+
+
+class BatchTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'spots.ndjson')
+        self.journal = os.path.join(self.directory, 'spots.journal')
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333')
+        self.agent.add_page('https://de.wikipedia.org/wiki/Python', 'Python')
+        self.objs = [
+            'https://de.wikipedia.org/wiki/Berlin',
+            'https://de.wikipedia.org/wiki/Python',
+            'https://de.wikipedia.org/wiki/Hamburg',
+        ]
+        self._stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self._stderr
+        shutil.rmtree(self.directory)
+        FakeAgentTest.tearDown(self)
+
+    def run_batch(self, workers=1):
+        with Journal(self.journal) as journal:
+            objs = read_objs(StringIO('\n'.join(self.objs) + '\n\n'))
+            return batch_spots(
+                objs, 'de', jobs=workers, filename=self.output,
+                journal=journal)
+
+    def titles(self):
+        with open(self.output) as f:
+            return [json.loads(line)['title'] for line in f]
+
+    def test_read_objs(self):
+
+        self.assertEqual(
+            list(read_objs(StringIO(' Berlin \n\nNew York City\n'))),
+            ['Berlin', 'New York City'])
+
+    def test_batch_spots(self):
+
+        # Hamburg is not reachable, Python has no coordinates
+        self.assertEqual(self.run_batch(), (1, 2))
+        self.assertEqual(self.titles(), ['Berlin'])
+        with Journal(self.journal) as journal:
+            self.assertEqual(len(journal), 2)
+            self.assertEqual(journal.failed, 1)
+            self.assertIn(self.objs[1], journal)
+            self.assertNotIn(self.objs[2], journal)
+        # a restart resolves the rest only and appends
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Hamburg', 'Hamburg',
+            latitude='53.55', longitude='10')
+        del self.agent.requests[:]
+        self.assertEqual(self.run_batch(workers=4), (1, 0))
+        self.assertEqual(self.agent.requests, [
+            Scrape.URL_OPTS % 'https://de.wikipedia.org/wiki/Hamburg'])
+        self.assertEqual(self.titles(), ['Berlin', 'Hamburg'])
+        self.assertEqual(self.run_batch(), (0, 0))
+        # a record cut off by a crash is ignored
+        with open(self.journal, 'a') as f:
+            f.write('{"error": null, "obj": "https://de.wiki')
+        with Journal(self.journal) as journal:
+            self.assertEqual(len(journal), 3)
+            journal.record('Berlin')
+        with Journal(self.journal) as journal:
+            self.assertIn('Berlin', journal)
+
+
+class FlightTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self._flight = core.flight
+        core.flight = SingleFlight()
+        self.agent.add_search(
+            'Berlin', [('Berlin', 'https://de.wikipedia.org/wiki/Berlin')])
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333')
+        self.agent.add_search('New York City', [
+            ('New York City', 'https://de.wikipedia.org/wiki/New_York_City')])
+        # redirect pages are served with the canonical url of their target
+        url = 'https://de.wikipedia.org/wiki/NYC'
+        self.agent.add_page(
+            url, 'New York City', latitude='40.712778',
+            longitude='-74.005833')
+        self.agent.responses[Scrape.URL_OPTS % url] = self.agent.responses[
+            Scrape.URL_OPTS % url].replace('<html><body>', (
+                '<html><head><link rel="canonical" '
+                'href="https://de.wikipedia.org/wiki/New_York_City"/></head>'
+                '<body>'))
+
+    def tearDown(self):
+        core.flight = self._flight
+        FakeAgentTest.tearDown(self)
+
+    def test_SingleFlight(self):
+
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def function():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        pool = ThreadPool(4)
+        try:
+            results = pool.map_async(
+                lambda index: flight.do('key', function), range(4))
+            started.wait()
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual(results.get(5), ['result'] * 4)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.shared, 3)
+        # results and errors are kept for the run
+        self.assertEqual(flight.do('key', lambda: 'other'), 'result')
+        def fail():
+            calls.append(1)
+            raise UserWarning('failed')
+
+        for index in range(2):
+            self.assertRaises(UserWarning, lambda: flight.do('error', fail))
+        self.assertEqual(len(calls), 2)
+        flight.add('alias', 'known')
+        flight.add('key', 'ignored')
+        self.assertEqual(flight.do('alias', lambda: None), 'known')
+        self.assertEqual(flight.do('key', lambda: None), 'result')
+        flight.forget('key')
+        self.assertNotIn('key', flight)
+        # requests in flight are shared only
+        flight = SingleFlight(memoize=False)
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+        self.assertEqual(len(flight), 0)
+
+    def test_resolve_spots(self):
+
+        objs = [
+            'https://de.wikipedia.org/wiki/NYC',
+            'New York City',
+            ' new york  City',
+            'https://de.wikipedia.org/wiki/new_York_City',
+            'Berlin',
+            'https://de.wikipedia.org/wiki/Berlin',
+        ]
+        results = resolve_spots(objs)
+        self.assertEqual(
+            [spot.title for spot in results],
+            ['New York City'] * 4 + ['Berlin'] * 2)
+        # each term is searched and each article scraped once
+        self.assertEqual(sorted(self.agent.requests), sorted([
+            Scrape.URL_OPTS % 'https://de.wikipedia.org/wiki/NYC',
+            Search.BASE_URL % ('de', 'New%20York%20City', 3),
+            Search.BASE_URL % ('de', 'Berlin', 3),
+            Scrape.URL_OPTS % 'https://de.wikipedia.org/wiki/Berlin',
+        ]))
+
+    def test_concurrent(self):
+
+        agent = self.agent
+
+        def open(url, **options):
+            time.sleep(0.02)
+            return FakeAgent.open(agent, url, **options)
+
+        agent.open = open
+        objs = ['Berlin', 'https://de.wikipedia.org/wiki/Berlin'] * 8
+        results = resolve_spots(objs, workers=8)
+        self.assertEqual(set(spot.title for spot in results), set(['Berlin']))
+        self.assertEqual(len(self.agent.requests), 2)
+        # without coalescing every object is resolved on its own
+        core.flight = None
+        del self.agent.requests[:]
+        resolve_spots(objs, workers=8)
+        self.assertEqual(len(self.agent.requests), 24)
+
+
 class MarkupTest(BaseTest):
 
     def setUp(self):
@@ -211,6 +2267,514 @@ class MarkupTest(BaseTest):
         os.remove(self.tmpfile.name)
 
 
+class PolylineTest(BaseTest):
+
+    def setUp(self):
+        # a spiral of 5000 points of about 50 m distance
+        self.latitudes = []
+        self.longitudes = []
+        for index in xrange(5000):
+            angle = index / 200.0
+            self.latitudes.append(
+                round(53.55 + angle / 100 * math.sin(angle), 5))
+            self.longitudes.append(
+                round(10 + angle / 60 * math.cos(angle), 5))
+
+    def polyline(self, url):
+        path = urlparse.parse_qs(urlparse.urlsplit(url).query)['path'][0]
+        return urllib2.unquote(path.split('enc:', 1)[1])
+
+    # distance in meters of a point to the segment between two others
+    def offset(self, index, first, last):
+        scale = math.cos(math.radians(self.latitudes[index])) * 111319.49
+        points = [
+            (self.longitudes[i] * scale, self.latitudes[i] * 111319.49)
+            for i in (index, first, last)]
+        (px, py), (x1, y1), (x2, y2) = points
+        dx, dy = x2 - x1, y2 - y1
+        t = ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy)
+        t = min(1, max(0, t))
+        return math.hypot(px - x1 - t * dx, py - y1 - t * dy)
+
+    def test_encode_polyline(self):
+
+        self.assertStrEqual(encode_polyline(
+            [38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]),
+            '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertStrEqual(encode_polyline([], []), '')
+        latitudes, longitudes = decode_polyline(
+            encode_polyline(self.latitudes, self.longitudes))
+        self.assertEqual(len(latitudes), 5000)
+        for expected, value in zip(self.latitudes, latitudes):
+            self.assertAlmostEqual(expected, value, 5)
+        for expected, value in zip(self.longitudes, longitudes):
+            self.assertAlmostEqual(expected, value, 5)
+        self.assertRaises(ValueError, lambda: decode_polyline('_p~iF~ps|'))
+
+    def test_simplify(self):
+
+        # points on a straight line are dropped
+        self.assertEqual(
+            simplify([0, 1, 2, 3], [0, 0, 0, 0], 1), [0, 3])
+        self.assertEqual(simplify([0, 1], [0, 0], 1), [0, 1])
+        self.assertEqual(
+            simplify([0, 0.001, 0], [0, 1, 2], 100), [0, 1, 2])
+        self.assertEqual(
+            simplify([0, 0.001, 0], [0, 1, 2], 200), [0, 2])
+        self.assertRaises(ValueError, lambda: simplify([0], [0], -1))
+        indices = simplify(self.latitudes, self.longitudes, 25)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 4999)
+        self.assertEqual(indices, sorted(set(indices)))
+        self.assertTrue(len(indices) < 500)
+        # every dropped point is within tolerance of the simplified path
+        for first, last in zip(indices, indices[1:]):
+            for index in xrange(first + 1, last):
+                self.assertTrue(self.offset(index, first, last) < 25.5)
+
+    def test_Map(self):
+
+        spots = SpotCollection()
+        spots.extend_columns(
+            ['Spot %d' % index for index in xrange(5000)], [''] * 5000,
+            self.latitudes, self.longitudes)
+        map = Map(tolerance=10)
+        self.assertEqual(map.tolerance, 10)
+        map.add_path(spots)
+        self.assertRaises(ValueError, lambda: map.add_path('Hamburg'))
+        url = map.generate_url()
+        self.assertTrue(len(url) <= Map.MAX_URL_LEN)
+        latitudes, longitudes = decode_polyline(self.polyline(url))
+        self.assertAlmostEqual(latitudes[0], self.latitudes[0], 5)
+        self.assertAlmostEqual(longitudes[-1], self.longitudes[-1], 5)
+        # closed regions keep their first and last point
+        map = Map(region=True, tolerance=10)
+        map.add_path(spots)
+        map.add_path(spots[0])
+        latitudes, longitudes = decode_polyline(
+            self.polyline(map.generate_url()))
+        self.assertEqual(latitudes[0], latitudes[-1])
+        self.assertRaises(ValueError, lambda: Map(tolerance=-1))
+
+    def test_Map_fitted(self):
+
+        spots = SpotCollection()
+        spots.extend_columns(
+            ['Spot %d' % index for index in xrange(3000)], [''] * 3000,
+            self.latitudes[:3000], self.longitudes[:3000])
+        # the tolerance is raised until the url fits
+        for tolerance in (None, 0.1):
+            map = Map(tolerance=tolerance)
+            map.add_path(spots)
+            url = map.generate_url()
+            self.assertTrue(len(url) <= Map.MAX_URL_LEN)
+            self.assertEqual(map.tolerance, tolerance)
+            self.assertTrue(map.fitted_tolerance > tolerance)
+            latitudes, longitudes = decode_polyline(self.polyline(url))
+            self.assertAlmostEqual(latitudes[0], self.latitudes[0], 5)
+            self.assertAlmostEqual(longitudes[-1], self.longitudes[2999], 5)
+        # short paths are left as they are
+        map = Map()
+        map.add_path(spots[:10])
+        latitudes, longitudes = decode_polyline(
+            self.polyline(map.generate_url()))
+        self.assertEqual(len(latitudes), 10)
+        self.assertEqual(map.fitted_tolerance, None)
+
+
+class ClusterTest(BaseTest):
+
+    def setUp(self):
+        random.seed(14)
+        # dense towns around Hamburg and Munich plus scattered spots
+        self.spots = SpotCollection()
+        rows = []
+        for latitude, longitude, spread, count in (
+                (53.55, 10.0, 0.05, 400), (48.14, 11.58, 0.05, 300),
+                (51, 9, 2.5, 300)):
+            for index in xrange(count):
+                rows.append((
+                    latitude + random.uniform(-spread, spread),
+                    longitude + random.uniform(-spread, spread)))
+        self.spots.extend_columns(
+            ['Spot %d' % index for index in xrange(len(rows))],
+            [''] * len(rows), [row[0] for row in rows],
+            [row[1] for row in rows])
+
+    def test_cluster(self):
+
+        latitudes, longitudes, weights = cluster(
+            [0.1, 0.2, 0.9, 1.5, -0.5], [0.1, 0.3, 0.8, 0.1, 0.1], 1)
+        self.assertEqual(list(weights), [3, 1, 1])
+        self.assertAlmostEqual(latitudes[0], 0.4)
+        self.assertAlmostEqual(longitudes[0], 0.4)
+        self.assertEqual(sum(cluster(
+            self.spots.latitudes, self.spots.longitudes, 0.5)[2]), 1000)
+        self.assertRaises(ValueError, lambda: cluster([0], [0], 0))
+
+    def test_fit_zoom(self):
+
+        self.assertEqual(fit_zoom(-85, -180, 85, 180, 256, 256), 0)
+        self.assertEqual(fit_zoom(53.5, 9.9, 53.6, 10.1, 640, 400), 11)
+        self.assertEqual(fit_zoom(53.5, 10, 53.5, 10, 640, 400), 21)
+
+    def test_add_cluster(self):
+
+        map = Map(size_x=640, size_y=400)
+        count = map.add_cluster(self.spots)
+        self.assertEqual(count, len(map.markers))
+        self.assertTrue(count < 100)
+        self.assertEqual(len(map.spots), 1000)
+        # heavy clusters are red, small ones labelled by their weight
+        self.assertEqual(map.markers[0].color, 'red')
+        for marker in map.markers:
+            if marker.label is not None:
+                self.assertTrue(1 < int(marker.label) < 10)
+        self.assertTrue(len(map.generate_url()) <= Map.MAX_URL_LEN)
+        self.assertEqual(Map().add_cluster(SpotCollection()), 0)
+        self.assertRaises(ValueError, lambda: map.add_cluster('Hamburg'))
+
+    def test_tiles(self):
+
+        maps = Map.tiles(self.spots, size_x=640, size_y=400)
+        self.assertEqual(len(maps), 1)
+        maps = Map.tiles(
+            self.spots, max_markers=10, size_x=640, size_y=400)
+        self.assertTrue(len(maps) > 1)
+        self.assertEqual(sum(len(map.spots) for map in maps), 1000)
+        for map in maps:
+            self.assertTrue(len(map.markers) <= 10)
+            map.generate_url()
+        self.assertRaises(
+            ValueError, lambda: Map.tiles(self.spots, max_markers=0))
+
+
+PNG = '\x89PNG\r\n\x1a\n'
+
+
+class MapCacheTest(BaseTest):
+
+    def setUp(self):
+        self.requests = []
+
+        # stand-in for the static maps api, images differ by query
+        def handle(request):
+            self.requests.append(request.path)
+            if 'label%3AZ' in request.path:
+                request.send_response(403)
+                request.send_header('Content-Length', '0')
+                request.end_headers()
+                return
+            content = PNG + request.path * 1000
+            request.send_response(200)
+            request.send_header('Content-Type', 'image/png')
+            request.send_header('Content-Length', str(len(content)))
+            request.end_headers()
+            request.wfile.write(content)
+
+        self.server = StandInServer(handle, protocol_version='HTTP/1.1')
+        self.directory = tempfile.mkdtemp()
+        self.cache = FileCache(os.path.join(self.directory, 'cache'))
+        self._agent = core.agent
+        # images are not kept in the response cache
+        core.agent = Agent(
+            cache=Cache(os.path.join(self.directory, 'responses')),
+            timeout=5)
+
+    def maps(self, labels):
+        maps = []
+        for index, label in enumerate(labels):
+            map = Map(filename=os.path.join(
+                self.directory, 'map-%s.png' % label))
+            map.base_url = self.server.url
+            map.add_marker(Spot(
+                title='Hamburg', latitude=53.55, longitude=10 + index,
+                url='https://de.wikipedia.org/wiki/Hamburg'), label=label)
+            maps.append(map)
+        return maps
+
+    def test_FileCache(self):
+
+        path = self.cache.path('key')
+        self.assertEqual(self.cache.get('key'), None)
+        self.assertEqual(self.cache.set('key', lambda f: f.write('a')), path)
+        self.assertEqual(self.cache.get('key'), path)
+        self.assertEqual(self.cache.get(u'key'), path)
+        self.assertTrue(path.startswith(self.cache.directory))
+
+        # failed writes leave nothing behind
+        def fail(f):
+            f.write('partial')
+            raise IOError('failed')
+
+        self.assertRaises(IOError, lambda: self.cache.set('other', fail))
+        self.assertEqual(self.cache.get('other'), None)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [
+            os.path.basename(path)])
+
+    def test_save_map_files(self):
+
+        maps = self.maps('ABCDEF')
+        results = save_map_files(maps, workers=3, cache=self.cache)
+        self.assertEqual(results, [None] * 6)
+        self.assertEqual(len(self.requests), 6)
+        for map in maps:
+            with open(map.filename, 'rb') as f:
+                content = f.read()
+            self.assertTrue(content.startswith(PNG))
+            self.assertIn(urlparse.urlsplit(map.generate_url()).query,
+                          content)
+        # unchanged maps are served from the cache
+        for map in maps:
+            os.remove(map.filename)
+        self.assertEqual(
+            save_map_files(maps, workers=3, cache=self.cache), [None] * 6)
+        self.assertEqual(len(self.requests), 6)
+        self.assertTrue(all(os.path.exists(map.filename) for map in maps))
+        # failed downloads are reported per map and not cached
+        maps = self.maps('GZ')
+        results = save_map_files(maps, workers=2, cache=self.cache)
+        self.assertEqual(results[0], None)
+        self.assertIs(results[1], urllib2.HTTPError)
+        self.assertEqual(self.cache.get(maps[1].generate_url()), None)
+        self.assertFalse(os.path.exists(maps[1].filename))
+        # without cache
+        maps = self.maps('H')
+        self.assertEqual(save_map_files(maps), [None])
+        self.assertEqual(save_map_files(maps), [None])
+        self.assertEqual(len(self.requests), 10)
+        self.assertRaises(
+            ValueError, lambda: save_map_files(maps, workers=0))
+
+    def tearDown(self):
+        core.agent.close()
+        core.agent = self._agent
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+
+class BenchmarkTest(BaseTest):
+
+    def test_fixtures(self):
+        for name, url, title in [
+                ('article_small.html',
+                 'https://de.wikipedia.org/wiki/Berlin', 'Berlin'),
+                ('article_huge.html.gz',
+                 'https://de.wikipedia.org/wiki/Berlin', 'Berlin'),
+                ('article_malformed.html',
+                 'https://en.wikipedia.org/wiki/Moscow', 'Moscow')]:
+            pages = {Scrape.URL_OPTS % url: benchmarks.fixture(name)}
+            agent = core.agent
+            core.agent = benchmarks.FixtureAgent(pages)
+            try:
+                spot = Spot.from_scrape(Scrape(url))
+            finally:
+                core.agent = agent
+            self.assertEqual(spot.title, title)
+        search = Search('Berlin')
+        search._evaluate_result(benchmarks.fixture('search_huge.xml'))
+        self.assertEqual(len(search.results), 99)
+
+    def test_measure(self):
+        result = benchmarks.isolated(lambda: benchmarks.bench_kml(10), 0)
+        self.assertTrue(result['rate'] > 0)
+        self.assertTrue(result['memory'] > 0)
+        self.assertEqual(result['runs'], 3)
+
+    def test_compare(self):
+        baseline = {
+            'fast': {'rate': 100.0, 'memory': 1000},
+            'lean': {'rate': 100.0, 'memory': 1000},
+        }
+        results = {
+            'fast': {'rate': 60.0, 'memory': 1000},
+            'lean': {'rate': 90.0, 'memory': 1500},
+            'new': {'rate': 1.0, 'memory': 1},
+            'broken': {'error': 'failed', 'memory': 1},
+        }
+        regressions = benchmarks.compare(results, baseline, 0.3)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('fast:'))
+        self.assertTrue(regressions[1].startswith('lean:'))
+        self.assertEqual(benchmarks.compare(results, baseline, 0.6), [])
+
+
+class ParserTest(FakeAgentTest):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.parsers = ParserPool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.parsers.close()
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        core.parsers = self.parsers
+        self.agent.add_page(
+            'https://de.wikipedia.org/wiki/Berlin', 'Berlin',
+            latitude='52.516666666667', longitude='13.383333333333',
+            elevation='34')
+        url = 'https://en.wikipedia.org/wiki/Moscow'
+        self.agent.responses[Scrape.URL_OPTS % url] = MALFORMED_HTML
+        self.agent.add_page('https://de.wikipedia.org/wiki/Nirgendwo',
+                            'Nirgendwo')
+
+    def tearDown(self):
+        core.parsers = None
+        FakeAgentTest.tearDown(self)
+
+    def test_ParserPool(self):
+
+        self.assertRaises(ValueError, ParserPool, 0)
+        self.assertEqual(self.parsers.workers, 2)
+        self.failUnlessRaises(
+            AttributeError, setattr, self.parsers, "workers", 4)
+
+    def test_parse(self):
+
+        urls = ['https://de.wikipedia.org/wiki/Berlin',
+                'https://en.wikipedia.org/wiki/Moscow']
+        # fields of parser processes match those parsed in process
+        for url in urls:
+            scrape = Scrape(url)
+            scrape.scrape_url()
+            core.parsers = None
+            expected = Scrape(url)
+            expected.scrape_url()
+            core.parsers = self.parsers
+            self.assertEqual(
+                (scrape.title, scrape.latitude, scrape.longitude,
+                 scrape.elevation),
+                (expected.title, expected.latitude, expected.longitude,
+                 expected.elevation))
+        # errors of parser processes are raised as before
+        scrape = Scrape('https://de.wikipedia.org/wiki/Nirgendwo')
+        self.assertRaises(UserWarning, scrape.scrape_url)
+        results = resolve_spots(
+            urls + ['https://de.wikipedia.org/wiki/Nirgendwo'], workers=4)
+        self.assertEqual(
+            [spot.title for spot in results[:2]], ['Berlin', 'Moscow'])
+        self.assertTrue(isinstance(results[2], UserWarning))
+
+    def test_aparse(self):
+
+        url = 'https://de.wikipedia.org/wiki/Berlin'
+        future = self.parsers.aparse(url, self.agent.responses[
+            Scrape.URL_OPTS % url])
+        self.assertIs(future, Future)
+        self.assertEqual(future.result(5)['elevation'], 34.0)
+        self.assertEqual(self.parsers.fetchers, 4)
+        # asynchronous scrapes hand pages over without waiting for them
+        futures = aresolve_spots(
+            [url, 'https://en.wikipedia.org/wiki/Moscow',
+             'https://de.wikipedia.org/wiki/Nirgendwo'])
+        results = gather(futures).result(5)
+        self.assertEqual(
+            [spot.title for spot in results[:2]], ['Berlin', 'Moscow'])
+        self.assertTrue(isinstance(results[2], UserWarning))
+
+    def test_events(self):
+
+        profile = Profile()
+        subscribe(profile)
+        try:
+            Scrape('https://de.wikipedia.org/wiki/Berlin').scrape_url()
+        finally:
+            unsubscribe(profile)
+        self.assertEqual(profile.count('parse'), 1)
+        self.assertEqual(profile.bytes('parse'), len(self.agent.responses[
+            Scrape.URL_OPTS % 'https://de.wikipedia.org/wiki/Berlin']))
+
+
+class ParserError(Exception):
+
+    # can be pickled but not unpickled
+    def __init__(self, url, reason):
+        Exception.__init__(self, '%s: %s' % (url, reason))
+
+
+class ParserFailureTest(FakeAgentTest):
+
+    def setUp(self):
+        FakeAgentTest.setUp(self)
+        self.evaluate_page = Scrape._evaluate_page
+        self.timeout = ParserPool.TIMEOUT
+
+    def tearDown(self):
+        Scrape._evaluate_page = self.evaluate_page
+        ParserPool.TIMEOUT = self.timeout
+        FakeAgentTest.tearDown(self)
+
+    def test_unpicklable(self):
+
+        def evaluate_page(scrape, fd):
+            raise ParserError(scrape.url, 'broken')
+
+        # forked parsers fail with an exception the pool can not send back
+        Scrape._evaluate_page = evaluate_page
+        parsers = ParserPool(1)
+        try:
+            future = parsers.aparse('https://de.wikipedia.org/wiki/Berlin',
+                                    PAGE_XHTML)
+            self.assertRaises(RuntimeError, future.result, 5)
+            # the pool keeps parsing
+            future = parsers.aparse('https://de.wikipedia.org/wiki/Berlin',
+                                    PAGE_XHTML)
+            self.assertRaises(RuntimeError, future.result, 5)
+        finally:
+            parsers.terminate()
+
+    def test_timeout(self):
+
+        def evaluate_page(scrape, fd):
+            time.sleep(2)
+
+        # a parser that does not answer, as a killed one, fails the page
+        Scrape._evaluate_page = evaluate_page
+        ParserPool.TIMEOUT = 0.5
+        parsers = ParserPool(1)
+        try:
+            future = parsers.aparse('https://de.wikipedia.org/wiki/Berlin',
+                                    PAGE_XHTML)
+            self.assertRaises(TimeoutError, future.result, 5)
+        finally:
+            parsers.terminate()
+
+
+class StartupTest(BaseTest):
+
+    def test_lazy_imports(self):
+
+        script = (
+            'import sys\n'
+            'sys.argv = ["wegweiser", "json", "--help"]\n'
+            'from wegweiser import __wegweiser__\n'
+            'try:\n'
+            '    __wegweiser__.main()\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print >> sys.stderr, " ".join(sorted(\n'
+            '    name for name in sys.modules if sys.modules[name]))\n')
+        process = subprocess.Popen(
+            [sys.executable, '-c', script], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, cwd=os.path.dirname(
+                os.path.abspath(__file__)))
+        output, modules = process.communicate()
+        self.assertIn('usage:', output)
+        modules = modules.split()
+        for name in ('wegweiser.core', 'wegweiser.map', 'wegweiser.server',
+                     'motionless', 'urllib2', 'sqlite3', 'json'):
+            self.assertNotIn(name, modules)
+
+    def test_startup(self):
+
+        # generous, the benchmark holds the actual budget
+        result = benchmarks.startup(repeat=3)
+        self.assertTrue(result['overhead'] < 0.5)
+
+
 class MapTest(BaseTest):
 
     def setUp(self):
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import argparse
-import re
-import json
 
-from wegweiser.core import Spot, Search, Scrape
-from wegweiser.markup import Markup
-from wegweiser.map import Map
+from itertools import izip, islice
+
+# backends are imported by the commands using them, so short runs and
+# --help do not pay for the network stack, sqlite or motionless
+RETRIES = 4
+SPOT_CACHE = 10000
 
 
 def parse_options():
@@ -29,6 +31,13 @@ def parse_options():
         default=None,
         help='write JSON to file'
     )
+    parser_json.add_argument(
+        '--format',
+        type=str,
+        choices=['json', 'ndjson', 'geojson'],
+        default='json',
+        help='output format, ndjson and geojson are streamed'
+    )
     parser_json.add_argument(
         '-l', '--language',
         type=str,
@@ -49,7 +58,7 @@ def parse_options():
         '-f', '--filename',
         type=str,
         default=None,
-        help='write KML to file'
+        help='write KML to file, zip compressed KMZ for .kmz files'
     )
     parser_markup.add_argument(
         '-l', '--language',
@@ -103,38 +112,208 @@ def parse_options():
         default='roadmap',
         help='type of map to construct'
     )
+    parser_map.add_argument(
+        '--simplify',
+        type=float,
+        default=None,
+        help='simplify path and region within tolerance in meters'
+    )
+    parser_map.add_argument(
+        '-e', '--each',
+        action='store_true',
+        help='render one map per spot'
+    )
+    parser_map.add_argument(
+        '--map-cache',
+        type=str,
+        default=None,
+        help='keep downloaded map images in directory'
+    )
+    # parser batch
+    parser_batch = subparsers.add_parser('batch')
+    parser_batch.set_defaults(batch=True)
+    parser_batch.add_argument(
+        'input',
+        type=str,
+        nargs='?',
+        default='-',
+        help='file of wikipedia urls or search terms, one per line, '
+             'stdin by default'
+    )
+    parser_batch.add_argument(
+        '-f', '--filename',
+        type=str,
+        default=None,
+        help='append NDJSON to file'
+    )
+    parser_batch.add_argument(
+        '--journal',
+        type=str,
+        default=None,
+        help='record resolved objects in file, skipped when run again'
+    )
+    parser_batch.add_argument(
+        '-l', '--language',
+        type=str,
+        choices=['de', 'en', 'fr'],
+        default='de',
+        help='select wikipedia language'
+    )
+    # parser serve
+    parser_serve = subparsers.add_parser('serve')
+    parser_serve.set_defaults(serve=True)
+    parser_serve.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='address to listen on'
+    )
+    parser_serve.add_argument(
+        '-p', '--port',
+        type=int,
+        default=8080,
+        help='port to listen on'
+    )
+    parser_serve.add_argument(
+        '--spot-cache',
+        type=int,
+        default=SPOT_CACHE,
+        help='number of resolved spots kept in memory'
+    )
+    parser_serve.add_argument(
+        '-l', '--language',
+        type=str,
+        choices=['de', 'en', 'fr'],
+        default='de',
+        help='select default wikipedia language'
+    )
+    # parser ingest
+    parser_ingest = subparsers.add_parser('ingest')
+    parser_ingest.set_defaults(ingest=True)
+    parser_ingest.add_argument(
+        'geo_tags',
+        type=str,
+        help='wikipedia geo_tags SQL dump, plain or gzip compressed'
+    )
+    parser_ingest.add_argument(
+        'page',
+        type=str,
+        help='wikipedia page SQL dump, plain or gzip compressed'
+    )
+    parser_ingest.add_argument(
+        '-s', '--store',
+        type=str,
+        required=True,
+        help='write spots to store file'
+    )
+    parser_ingest.add_argument(
+        '-l', '--language',
+        type=str,
+        choices=['de', 'en', 'fr'],
+        default='de',
+        help='select wikipedia language'
+    )
+    # common options
+    for subparser in (
+            parser_json, parser_markup, parser_map, parser_batch,
+            parser_serve):
+        subparser.add_argument(
+            '-j', '--jobs',
+            type=int,
+            default=1,
+            help='number of spots to resolve concurrently'
+        )
+        subparser.add_argument(
+            '-a', '--api',
+            action='store_true',
+            help='locate spots through the wikipedia api'
+        )
+        subparser.add_argument(
+            '-c', '--cache',
+            type=str,
+            default=None,
+            help='cache wikipedia responses in directory'
+        )
+        subparser.add_argument(
+            '--cache-ttl',
+            type=int,
+            default=86400,
+            help='seconds cached responses are used without revalidation'
+        )
+        subparser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='seconds to wait for wikipedia and google maps'
+        )
+        subparser.add_argument(
+            '--parsers',
+            type=int,
+            default=0,
+            help='number of processes parsing pages, at least two jobs each'
+        )
+        subparser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='requests per second and host, unlimited by default'
+        )
+        subparser.add_argument(
+            '--retries',
+            type=int,
+            default=RETRIES,
+            help='retries of throttled requests, Retry-After is honored'
+        )
+        subparser.add_argument(
+            '--store',
+            type=str,
+            default=None,
+            help='resolve spots from store file first and write back'
+        )
+        subparser.add_argument(
+            '--profile',
+            action='store_true',
+            help='print latency percentiles per phase to stderr'
+        )
     # parse and return options
     return parser.parse_args()
 
 
-def get_spots(wikiobj, language):
-    wiki_url_pattern = re.compile(
-        r'^https://(de|en|fr).wikipedia.org/wiki/.+'
-    )
-    spots = []
-    for obj in wikiobj:
-        if wiki_url_pattern.match(obj):
-            # scrape url
-            spot = Spot.from_scrape(Scrape(obj))
+def get_spots(wikiobj, language, jobs=1, api=False):
+    from wegweiser.collection import SpotCollection
+    from wegweiser.core import resolve_spots
+    spots = SpotCollection()
+    errors = []
+    results = resolve_spots(
+        wikiobj, language=language, workers=jobs, api=api)
+    for obj, result in zip(wikiobj, results):
+        if isinstance(result, Exception):
+            errors.append("%s: %s" % (obj, result))
         else:
-            # search term
-            try:
-                spot = Spot.from_search(Search(obj, language=language))
-            except IndexError:
-                raise UserWarning("'%s' no search results" % obj)
-        spots.append(spot)
-    return spots
+            spots.append(result)
+    return spots, errors
 
 
 def generate_json(spots, filename=None):
+    from wegweiser.collection import SpotCollection
+    from wegweiser.instrument import Phase
+    # plain lists of spots are taken as well
+    if not isinstance(spots, SpotCollection):
+        spots = SpotCollection(spots)
+    with Phase('json'):
+        _generate_json(spots, filename)
+
+
+def _generate_json(spots, filename):
+    import json
     geojson = []
-    for spot in spots:
+    for title, url, latitude, longitude, elevation in spots.rows():
         entry = {
-            'title': spot.title,
-            'url': spot.url,
-            'latitude': spot.latitude,
-            'longitude': spot.longitude,
-            'elevation': spot.elevation
+            'title': title,
+            'url': url,
+            'latitude': latitude,
+            'longitude': longitude,
+            'elevation': elevation
         }
         geojson.append(entry)
     if filename is not None:
@@ -144,69 +323,324 @@ def generate_json(spots, filename=None):
         print json.dumps(geojson, sort_keys=True, indent=4)
 
 
+def stream_json(
+        wikiobj, language, jobs=1, api=False, format='ndjson',
+        filename=None):
+    from wegweiser.core import iresolve_spots
+    from wegweiser.stream import NdjsonWriter, GeoJsonWriter
+    writers = {'ndjson': NdjsonWriter, 'geojson': GeoJsonWriter}
+    errors = []
+    results = iresolve_spots(
+        wikiobj, language=language, workers=jobs, api=api)
+    f = sys.stdout if filename is None else open(filename, 'w')
+    try:
+        # spots are written as soon as they are resolved
+        with writers[format](f) as writer:
+            for obj, result in izip(wikiobj, results):
+                if isinstance(result, Exception):
+                    errors.append("%s: %s" % (obj, result))
+                    print >> sys.stderr, errors[-1]
+                else:
+                    writer.write(result)
+    finally:
+        if filename is not None:
+            f.close()
+    return writer.count, errors
+
+
+BATCH_SIZE = 1000
+
+
+def batch_spots(
+        objs, language, jobs=1, api=False, filename=None, journal=None):
+    from wegweiser.core import iresolve_spots
+    from wegweiser.stream import NdjsonWriter
+    errors = 0
+    if journal is not None:
+        objs = (obj for obj in objs if obj not in journal)
+    objs = iter(objs)
+    f = sys.stdout if filename is None else open(filename, 'a')
+    try:
+        with NdjsonWriter(f) as writer:
+            # input is read and resolved chunk by chunk
+            while True:
+                chunk = list(islice(objs, BATCH_SIZE))
+                if not chunk:
+                    break
+                results = iresolve_spots(
+                    chunk, language=language, workers=jobs, api=api)
+                for obj, result in izip(chunk, results):
+                    if not isinstance(result, Exception):
+                        writer.write(result)
+                        if journal is not None:
+                            journal.record(obj)
+                        continue
+                    errors += 1
+                    print >> sys.stderr, "%s: %s" % (obj, result)
+                    # spots not found are final, other errors are retried
+                    if journal is not None and isinstance(
+                            result, UserWarning):
+                        journal.record(obj, error=str(result))
+    finally:
+        if filename is not None:
+            f.close()
+    return writer.count, errors
+
+
+def stream_markup(wikiobj, language, jobs=1, api=False, filename=None):
+    from wegweiser.core import iresolve_spots
+    from wegweiser.markup import KmlWriter, write_kmz
+    errors = []
+    results = iresolve_spots(
+        wikiobj, language=language, workers=jobs, api=api)
+
+    def spots():
+        for obj, result in izip(wikiobj, results):
+            if isinstance(result, Exception):
+                errors.append("%s: %s" % (obj, result))
+                print >> sys.stderr, errors[-1]
+            else:
+                yield result
+
+    # placemarks are written as soon as spots are resolved
+    if filename is not None and filename.lower().endswith('.kmz'):
+        return write_kmz(filename, spots()), errors
+    f = sys.stdout if filename is None else open(filename, 'wb')
+    try:
+        with KmlWriter(f) as writer:
+            writer.extend(spots())
+    finally:
+        if filename is not None:
+            f.close()
+    return writer.count, errors
+
+
 def generate_markup(spots, filename=None):
+    from wegweiser.collection import SpotCollection
+    from wegweiser.markup import Markup
+    if not isinstance(spots, SpotCollection):
+        spots = SpotCollection(spots)
     geomarkup = Markup()
-    for spot in spots:
-        geomarkup.add_spot(spot)
+    geomarkup.add_spot(spots)
     if filename is not None:
         geomarkup.filename = filename
         geomarkup.save_kml_file()
     else:
-        print geomarkup.generate_kml()
+        geomarkup.write_kml(sys.stdout)
 
 
 def generate_map(
         spots, map=None, size=None, type=None, path=False, region=False,
-        filename=None):
-    labels = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    size_x, size_y = size.split('x')
-    geomap = Map(
-        size_x=int(size_x), size_y=int(size_y), maptype=type,
-        region=region, fillcolor='gray')
-    max_index = (len(spots) - 1)
-    if path is True:
-        for index, spot in enumerate(spots):
-            geomap.add_marker(spot, label=labels[index])
-            geomap.add_path_latlon(str(spot.latitude), str(spot.longitude))
-    if region is True:
-        for index, spot in enumerate(spots):
-            geomap.add_path_latlon(str(spot.latitude), str(spot.longitude))
-            if index == max_index:
-                geomap.add_path_latlon(
-                    str(spots[0].latitude), str(spots[0].longitude))
-    else:
-        for index, spot in enumerate(spots):
-            geomap.add_marker(spot, label=labels[index])
-    if filename is not None:
+        filename=None, simplify=None, each=False, jobs=1, cache=None):
+    from wegweiser.map import build_maps, save_map_files
+    maps = build_maps(
+        spots, size=size, type=type, path=path, region=region,
+        simplify=simplify, each=each)
+    if filename is None:
+        for geomap in maps:
+            print geomap.generate_url()
+        return []
+    for index, geomap in enumerate(maps):
         geomap.filename = filename
-        geomap.save_map_file()
-    else:
-        print geomap.generate_url()
+        if len(maps) > 1:
+            name, extension = os.path.splitext(filename)
+            geomap.filename = '%s-%d%s' % (name, index + 1, extension)
+    # maps are downloaded concurrently
+    results = save_map_files(maps, workers=jobs, cache=cache)
+    return [
+        "%s: %s" % (geomap.filename, result)
+        for geomap, result in zip(maps, results) if result is not None]
+
+
+def serve(host, port, language, jobs=1, api=False, size=SPOT_CACHE):
+    from wegweiser.server import Server, SpotService
+    try:
+        service = SpotService(
+            language=language, jobs=jobs, api=api, size=size)
+        server = Server((host, port), service)
+    except (IOError, ValueError) as msg:
+        print msg
+        sys.exit(1)
+    print >> sys.stderr, 'serving on %s' % server.url
+    # connections and caches stay warm until interrupted
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def ingest_dumps(geo_tags, page, store, language):
+    from wegweiser.ingest import Ingest
+    from wegweiser.store import SpotStore
+    spotstore = SpotStore(store)
+    try:
+        count = Ingest(spotstore, language=language).ingest(geo_tags, page)
+    finally:
+        spotstore.close()
+    print >> sys.stderr, '%d spots ingested' % count
 
 
 def run(args):
+    # ingest
+    if hasattr(args, 'ingest'):
+        try:
+            ingest_dumps(
+                args.geo_tags, args.page, args.store, args.language)
+        except (IOError, ValueError) as msg:
+            print msg
+            sys.exit(1)
+        return
+    from wegweiser import core
+    from wegweiser.flight import SingleFlight
+    from wegweiser.throttle import Scheduler
+    core.agent.timeout = args.timeout
+    # throttling
+    try:
+        core.agent.scheduler = Scheduler(rate=args.rate, retries=args.retries)
+    except ValueError as msg:
+        print msg
+        sys.exit(1)
+    # parsing
+    if args.parsers:
+        from wegweiser.parsers import ParserPool
+        try:
+            core.parsers = ParserPool(args.parsers)
+        except ValueError as msg:
+            print msg
+            sys.exit(1)
+        # enough fetching threads to keep every parser busy
+        args.jobs = max(args.jobs, core.parsers.fetchers)
+    # cache
+    if args.cache is not None:
+        from wegweiser.cache import Cache
+        try:
+            core.agent.cache = Cache(args.cache, ttl=args.cache_ttl)
+        except (OSError, ValueError) as msg:
+            print msg
+            sys.exit(1)
+    # store
+    if args.store is not None:
+        import sqlite3
+        from wegweiser.store import SpotStore
+        try:
+            core.store = SpotStore(args.store)
+        except (OSError, sqlite3.Error) as msg:
+            print msg
+            sys.exit(1)
+    # every term and article is resolved once per run, servers and
+    # streaming commands share requests in flight only to keep memory flat
+    streaming = (
+        hasattr(args, 'serve') or hasattr(args, 'batch') or
+        hasattr(args, 'markup') or
+        (hasattr(args, 'json') and args.format != 'json'))
+    core.flight = SingleFlight(memoize=not streaming)
+    # serve
+    if hasattr(args, 'serve'):
+        serve(args.host, args.port, args.language, jobs=args.jobs,
+              api=args.api, size=args.spot_cache)
+        return
+    # batch
+    if hasattr(args, 'batch'):
+        from wegweiser.journal import Journal, read_objs
+        journal = None
+        f = sys.stdin
+        try:
+            if args.input != '-':
+                f = open(args.input)
+            if args.journal is not None:
+                journal = Journal(args.journal)
+            count, errors = batch_spots(
+                read_objs(f), args.language, jobs=args.jobs, api=args.api,
+                filename=args.filename, journal=journal)
+        except (IOError, ValueError) as msg:
+            print msg
+            sys.exit(1)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            if journal is not None:
+                journal.close()
+        print >> sys.stderr, '%d spots resolved, %d failed' % (count, errors)
+        if errors:
+            sys.exit(1)
+        return
+    # streamed json
+    if hasattr(args, 'json') and args.format != 'json':
+        try:
+            count, errors = stream_json(
+                args.wikiobj, args.language, jobs=args.jobs, api=args.api,
+                format=args.format, filename=args.filename)
+        except (IOError, ValueError) as msg:
+            print msg
+            sys.exit(1)
+        if not count or errors:
+            sys.exit(1)
+        return
+    # markup
+    if hasattr(args, 'markup'):
+        try:
+            count, errors = stream_markup(
+                args.wikiobj, args.language, jobs=args.jobs, api=args.api,
+                filename=args.filename)
+        except (IOError, ValueError) as msg:
+            print msg
+            sys.exit(1)
+        if not count or errors:
+            sys.exit(1)
+        return
     # get spots
     try:
-        spots = get_spots(args.wikiobj, args.language)
-    except UserWarning as msg:
+        spots, errors = get_spots(
+            args.wikiobj, args.language, jobs=args.jobs, api=args.api)
+    except ValueError as msg:
         print msg
         sys.exit(1)
+    for msg in errors:
+        print >> sys.stderr, msg
+    if not spots:
+        sys.exit(1)
     # json
     if hasattr(args, 'json'):
         generate_json(spots, filename=args.filename)
-    # markup
-    if hasattr(args, 'markup'):
-        generate_markup(spots, filename=args.filename)
     # map
     if hasattr(args, 'map'):
-        generate_map(
-            spots, map=args.map, size=args.size, type=args.type,
-            path=args.path, region=args.region, filename=args.filename)
+        cache = None
+        if args.map_cache is not None:
+            from wegweiser.cache import FileCache
+            cache = FileCache(args.map_cache)
+        try:
+            failed = generate_map(
+                spots, map=args.map, size=args.size, type=args.type,
+                path=args.path, region=args.region, filename=args.filename,
+                simplify=args.simplify, each=args.each, jobs=args.jobs,
+                cache=cache)
+        except ValueError as msg:
+            print msg
+            sys.exit(1)
+        for msg in failed:
+            print >> sys.stderr, msg
+        errors.extend(failed)
+    if errors:
+        sys.exit(1)
 
 
 def main():
     args = parse_options()
-    run(args)
+    profile = None
+    if getattr(args, 'profile', False):
+        from wegweiser.instrument import Profile, subscribe
+        profile = Profile()
+        subscribe(profile)
+    try:
+        run(args)
+    finally:
+        # also reported for failed runs
+        if profile is not None:
+            from wegweiser.instrument import unsubscribe
+            unsubscribe(profile)
+            print >> sys.stderr, profile.report()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import errno
+import urllib
+import marshal
+import hashlib
+import urlparse
+import tempfile
+import threading
+import unicodedata
+
+PATH_SAFE = "/:@!$&'()*+,;=-._~"
+
+
+def normalize_url(url):
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    path = urllib.quote(urllib.unquote(path), safe=PATH_SAFE)
+    query = urllib.urlencode(
+        sorted(urlparse.parse_qsl(query, keep_blank_values=True)))
+    return urlparse.urlunsplit(
+        (scheme.lower(), netloc.lower(), path, query, ''))
+
+
+def normalize_title(title):
+    if isinstance(title, str):
+        title = title.decode('utf-8')
+    title = u' '.join(title.replace(u'_', u' ').split()).lower()
+    return unicodedata.normalize('NFC', title)
+
+
+class Cache(object):
+
+    # share of max_size left after eviction, the next ones are far apart
+    LOW_WATER = 0.9
+
+    def __init__(self, directory, ttl=86400, max_size=256 * 1024 * 1024):
+        if ttl < 0:
+            raise ValueError("'%d' no valid ttl" % ttl)
+        if max_size < 0:
+            raise ValueError("'%d' no valid max size" % max_size)
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        self._directory = directory
+        self._ttl = ttl
+        self._max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored, value = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None, False
+        # mark entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value, (time.time() - stored) < self._ttl
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = marshal.dumps((time.time(), value), 2)
+        fd, tmpname = tempfile.mkstemp(prefix='.', dir=self._directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            size = self._current_size()
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.rename(tmpname, path)
+            self._size = size + len(data)
+            if self._size > self._max_size:
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            for path, mtime, size in self._entries():
+                self._remove(path)
+            self._size = 0
+
+    def _path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self._directory, hashlib.sha1(key).hexdigest())
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self._directory):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _current_size(self):
+        if self._size is None:
+            self._size = sum(size for path, mtime, size in self._entries())
+        return self._size
+
+    def _evict(self):
+        # drop least recently used entries down to the low water mark
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        size = sum(size for path, mtime, size in entries)
+        low_water = self._max_size * Cache.LOW_WATER
+        for path, mtime, entry_size in entries:
+            if size <= low_water:
+                break
+            if self._remove(path):
+                size -= entry_size
+        self._size = size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+
+class FileCache(object):
+
+    def __init__(self, directory):
+        try:
+            os.makedirs(directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        self._directory = directory
+
+    def path(self, key):
+        # content is addressed by the hash of its key
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._directory, digest[:2], digest)
+
+    def get(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            return path
+        return None
+
+    def set(self, key, write):
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+        # written to a temporary file, readers never see partial content
+        fd, tmpname = tempfile.mkstemp(
+            prefix='.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.rename(tmpname, path)
+        except:
+            os.remove(tmpname)
+            raise
+        return path
+
+    @property
+    def directory(self):
+        return self._directory
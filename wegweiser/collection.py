@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from itertools import izip
+from wegweiser.core import Spot
+
+NAN = float('nan')
+
+
+class SpotCollection(object):
+
+    def __init__(self, spots=None):
+        self._titles = []
+        self._urls = []
+        self._latitudes = array('d')
+        self._longitudes = array('d')
+        # missing elevations are stored as NaN
+        self._elevations = array('d')
+        if spots is not None:
+            self.extend(spots)
+
+    def append(self, spot):
+        if not isinstance(spot, Spot):
+            raise ValueError("Spot object required")
+        self.append_row(
+            spot.title, spot.url, spot.latitude, spot.longitude,
+            spot.elevation)
+
+    def append_row(self, title, url, latitude, longitude, elevation=None):
+        self._titles.append(title)
+        self._urls.append(url)
+        self._latitudes.append(latitude)
+        self._longitudes.append(longitude)
+        self._elevations.append(NAN if elevation is None else elevation)
+
+    def extend(self, spots):
+        if isinstance(spots, SpotCollection):
+            self._titles.extend(spots._titles)
+            self._urls.extend(spots._urls)
+            self._latitudes.extend(spots._latitudes)
+            self._longitudes.extend(spots._longitudes)
+            self._elevations.extend(spots._elevations)
+            return
+        for spot in spots:
+            self.append(spot)
+
+    def extend_columns(
+            self, titles, urls, latitudes, longitudes, elevations=None):
+        titles = list(titles)
+        urls = list(urls)
+        latitudes = array('d', latitudes)
+        longitudes = array('d', longitudes)
+        if elevations is None:
+            elevations = array('d', [NAN]) * len(titles)
+        else:
+            elevations = array('d', (
+                NAN if elevation is None else elevation
+                for elevation in elevations))
+        if not (len(titles) == len(urls) == len(latitudes) ==
+                len(longitudes) == len(elevations)):
+            raise ValueError("columns of different length")
+        self._titles.extend(titles)
+        self._urls.extend(urls)
+        self._latitudes.extend(latitudes)
+        self._longitudes.extend(longitudes)
+        self._elevations.extend(elevations)
+
+    def take(self, indices):
+        indices = list(indices)
+        collection = SpotCollection()
+        collection._titles = [self._titles[index] for index in indices]
+        collection._urls = [self._urls[index] for index in indices]
+        collection._latitudes = array(
+            'd', [self._latitudes[index] for index in indices])
+        collection._longitudes = array(
+            'd', [self._longitudes[index] for index in indices])
+        collection._elevations = array(
+            'd', [self._elevations[index] for index in indices])
+        return collection
+
+    def rows(self):
+        for title, url, latitude, longitude, elevation in izip(
+                self._titles, self._urls, self._latitudes, self._longitudes,
+                self._elevations):
+            if elevation != elevation:
+                elevation = None
+            yield title, url, latitude, longitude, elevation
+
+    def __len__(self):
+        return len(self._titles)
+
+    def __iter__(self):
+        for title, url, latitude, longitude, elevation in self.rows():
+            yield Spot(
+                title=title, latitude=latitude, longitude=longitude,
+                elevation=elevation, url=url)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            collection = SpotCollection()
+            collection._titles = self._titles[index]
+            collection._urls = self._urls[index]
+            collection._latitudes = self._latitudes[index]
+            collection._longitudes = self._longitudes[index]
+            collection._elevations = self._elevations[index]
+            return collection
+        elevation = self._elevations[index]
+        if elevation != elevation:
+            elevation = None
+        return Spot(
+            title=self._titles[index], latitude=self._latitudes[index],
+            longitude=self._longitudes[index], elevation=elevation,
+            url=self._urls[index])
+
+    @property
+    def titles(self):
+        return self._titles
+
+    @property
+    def urls(self):
+        return self._urls
+
+    @property
+    def latitudes(self):
+        return self._latitudes
+
+    @property
+    def longitudes(self):
+        return self._longitudes
+
+    @property
+    def elevations(self):
+        return self._elevations
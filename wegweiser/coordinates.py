@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from array import array
+
+# degrees, minutes and seconds with symbols, spaces or both, decimal
+# points or commas and an optional hemisphere letter or french word
+COORDINATE = re.compile(u'''
+    ^\\s*(?P<sign>[-+−])?\\s*
+    (?P<degrees>\\d+(?:[.,]\\d*)?)\\s*[°º]?\\s*
+    (?:(?<=[°º\\s])(?P<minutes>\\d+(?:[.,]\\d*)?)\\s*[′’']?\\s*
+    (?:(?<=[′’'\\s])(?P<seconds>\\d+(?:[.,]\\d*)?)\\s*(?:[″"]|''|′′)?\\s*)?)?
+    (?P<hemisphere>nord|sud|est|ouest|[NSEWO])?\\.?\\s*$''',
+    re.UNICODE | re.VERBOSE | re.I)
+
+LANGUAGES = ['de', 'en', 'fr']
+# O is east (Ost) in german but west (Ouest) in french
+NEGATIVE = {
+    'de': frozenset([u'S', u's', u'W', u'w']),
+    'en': frozenset([u'S', u's', u'W', u'w']),
+    'fr': frozenset([u'S', u's', u'W', u'w', u'O', u'o']),
+}
+# spelled out hemispheres are french in any language
+HEMISPHERES = {u'nord': u'N', u'sud': u'S', u'est': u'E', u'ouest': u'W'}
+# degrees north or south, east or west at most
+LATITUDE = 90.0
+LONGITUDE = 180.0
+
+
+def _invalid(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return ValueError("'%s' no valid coordinate" % text)
+
+
+def _checked(value, limit, text):
+    # also false for NaN
+    if not -limit <= value <= limit:
+        raise _invalid(text)
+    return value
+
+
+def _parse(text, negative):
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    match = COORDINATE.match(text)
+    if match is None:
+        raise _invalid(text)
+    sign, degrees, minutes, seconds, hemisphere = match.groups()
+    if hemisphere is not None:
+        hemisphere = HEMISPHERES.get(hemisphere.lower(), hemisphere)
+    value = float(degrees.replace(u',', u'.'))
+    if minutes is not None:
+        minutes = float(minutes.replace(u',', u'.'))
+        if minutes >= 60:
+            raise _invalid(text)
+        value += minutes / 60
+        if seconds is not None:
+            seconds = float(seconds.replace(u',', u'.'))
+            if seconds >= 60:
+                raise _invalid(text)
+            value += seconds / 3600
+    if (sign is not None and sign != u'+') != (hemisphere in negative):
+        return -value
+    return value
+
+
+def parse_coordinate(text, language='en', limit=LONGITUDE):
+    if language not in NEGATIVE:
+        raise ValueError(
+            "'%s' no valid language %s" % (language, LANGUAGES))
+    # plain decimal degrees are the common case
+    try:
+        value = float(text)
+    except ValueError:
+        value = _parse(text, NEGATIVE[language])
+    return _checked(value, limit, text)
+
+
+def _within(values, limit):
+    # NaN spreads through the sum, infinities fail the bounds
+    if not values:
+        return True
+    total = sum(values)
+    return total == total and -limit <= min(values) and max(
+        values) <= limit
+
+
+def parse_coordinates(texts, language='en', limit=LONGITUDE):
+    if language not in NEGATIVE:
+        raise ValueError(
+            "'%s' no valid language %s" % (language, LANGUAGES))
+    texts = texts if isinstance(texts, list) else list(texts)
+    # decimal degrees are converted all at once, others one by one
+    try:
+        values = array('d', map(float, texts))
+    except ValueError:
+        try:
+            values = array('d', map(float, [
+                text.replace(',', '.') for text in texts]))
+        except ValueError:
+            values = None
+    if values is not None and _within(values, limit):
+        return values
+    negative = NEGATIVE[language]
+    values = array('d')
+    append = values.append
+    for text in texts:
+        try:
+            value = float(text)
+        except ValueError:
+            value = _parse(text, negative)
+        append(_checked(value, limit, text))
+    return values
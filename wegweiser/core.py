@@ -1,13 +1,64 @@
 # -*- coding: utf-8 -*-
 
 import re
+import time
+import json
+import codecs
+import urllib
 import urllib2
+import urlparse
+import threading
 
+from collections import deque
+from itertools import islice
 from cStringIO import StringIO
+from htmlentitydefs import name2codepoint
+from HTMLParser import HTMLParser, HTMLParseError
 from xml.etree import ElementTree
-
-agent = urllib2.build_opener()
+from wegweiser.cache import normalize_url, normalize_title
+from wegweiser.coordinates import parse_coordinate, LATITUDE, LONGITUDE
+from wegweiser.future import Future, ThreadTransport, completed, failed
+from wegweiser.instrument import Phase, emit
+from wegweiser.throttle import Scheduler
+from wegweiser.transport import Agent
+
+agent = Agent(scheduler=Scheduler())
 agent.addheaders = [('User-agent', 'Mozilla/5.0')]
+# local spot store, consulted before going online
+store = None
+# asynchronous transport, requests of the agent on a thread pool by default
+transport = None
+# coalesces searches and page scrapes of the same term or article
+flight = None
+# parser processes, pages are parsed in process if not set
+parsers = None
+_transport_lock = threading.Lock()
+
+
+def _coalesce(key, function):
+    if flight is None:
+        return function()
+    return flight.do(key, function)
+
+
+def _page_key(url):
+    # article urls differ in escaping, underscores and the case of the
+    # first letter of the title only
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    title = urllib.unquote(path[len('/wiki/'):]).decode('utf-8', 'replace')
+    title = title.replace(u' ', u'_')
+    return ('page', netloc.lower(), title[:1].upper() + title[1:])
+
+
+def _transport():
+    global transport
+    with _transport_lock:
+        if transport is None:
+            transport = ThreadTransport(
+                lambda url, **options: agent.open(url, **options))
+        return transport
 
 
 class Search(object):
@@ -30,14 +81,32 @@ class Search(object):
         self._results = []
 
     def search_term(self):
-        url = Search.BASE_URL % (
-                self._language, self._term.replace(" ", "%20"), self._limit)
-        fd = agent.open(url)
-        content = fd.read()
+        # terms differing in case and spacing only are searched once
+        key = ('term', self._language, normalize_title(self._term),
+               self._limit)
+        self._results = list(_coalesce(key, self._search))
+
+    def _search(self):
+        fd = agent.open(self._search_url())
+        try:
+            content = fd.read()
+        finally:
+            fd.close()
         self._evaluate_result(content)
+        return self._results
+
+    def asearch_term(self):
+        return _transport().fetch(self._search_url()).then(
+            self._evaluate_result)
+
+    def _search_url(self):
+        return Search.BASE_URL % (
+                self._language, self._term.replace(" ", "%20"), self._limit)
 
     def _evaluate_result(self, content):
-        tree = ElementTree.parse(StringIO(content))
+        with Phase('parse') as phase:
+            phase.bytes = len(content)
+            tree = ElementTree.parse(StringIO(content))
         items = tree.findall(
             '%sSection/%sItem' % (Search.NAMESPACE, Search.NAMESPACE))
         for item in items:
@@ -66,78 +135,341 @@ class Search(object):
         return self._limit
 
 
+class Locate(object):
+
+    API_URL = 'https://%s.wikipedia.org/w/api.php'
+    API_OPTS = '?action=query&generator=search&gsrnamespace=0&gsrlimit=1'
+    API_OPTS += '&prop=coordinates|info&coprimary=primary&inprop=url'
+    API_OPTS += '&format=json&gsrsearch=%s'
+
+    def __init__(self, term, language='de'):
+        if language not in Search.LANGUAGES:
+            raise ValueError(
+                "'%s' no valid language %s" % (language, Search.LANGUAGES))
+        self._term = term
+        self._language = language
+        self._title = None
+        self._url = None
+        self._latitude = None
+        self._longitude = None
+
+    def locate_term(self):
+        term = self._term
+        if isinstance(term, unicode):
+            term = term.encode('utf-8')
+        url = Locate.API_URL % self._language
+        url += Locate.API_OPTS % urllib.quote(term)
+        fd = agent.open(url)
+        try:
+            content = fd.read()
+        finally:
+            fd.close()
+        with Phase('parse', url) as phase:
+            phase.bytes = len(content)
+            self._evaluate_result(json.loads(content))
+
+    def _evaluate_result(self, content):
+        pages = content.get('query', {}).get('pages', {}).values()
+        if not pages:
+            raise UserWarning("'%s' no search results" % self._term)
+        page = min(pages, key=lambda page: page.get('index', 0))
+        self._title = _text([page['title']])
+        self._url = page['fullurl'].encode('utf-8')
+        for entry in page.get('coordinates', []):
+            if entry.get('globe', 'earth') != 'earth':
+                continue
+            self._latitude = float(entry['lat'])
+            self._longitude = float(entry['lon'])
+            break
+
+    @property
+    def term(self):
+        return self._term
+
+    @property
+    def language(self):
+        return self._language
+
+    @property
+    def title(self):
+        return self._title
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def latitude(self):
+        return self._latitude
+
+    @property
+    def longitude(self):
+        return self._longitude
+
+    @property
+    def elevation(self):
+        return None
+
+
+def _text(parts):
+    text = u''.join(parts).strip()
+    try:
+        return text.encode('ascii')
+    except UnicodeEncodeError:
+        return text
+
+
+class _PageParser(HTMLParser):
+
+    SPANS = ['latitude', 'longitude', 'elevation']
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.fields = {}
+        self._field = None
+        self._tag = None
+        self._depth = 0
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._field is not None:
+            if tag == self._tag:
+                self._depth += 1
+            return
+        if tag == 'link':
+            attrs = dict(attrs)
+            if attrs.get('rel') == 'canonical' and attrs.get('href'):
+                self.fields.setdefault('canonical', attrs['href'])
+            return
+        classes = (dict(attrs).get('class') or '').split()
+        if tag == 'h1' and 'firstHeading' in classes:
+            field = 'title'
+        elif tag == 'span':
+            field = None
+            for span in _PageParser.SPANS:
+                if span in classes:
+                    field = span
+                    break
+        else:
+            return
+        # only the first matching tag counts
+        if field is None or field in self.fields:
+            return
+        self._field = field
+        self._tag = tag
+        self._depth = 1
+        self._parts = []
+
+    def handle_endtag(self, tag):
+        if self._field is None or tag != self._tag:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            self.fields[self._field] = _text(self._parts)
+            self._field = None
+
+    def handle_data(self, data):
+        if self._field is not None:
+            self._parts.append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        else:
+            self.handle_data(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ('x', 'X'):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except (ValueError, OverflowError):
+            self.handle_data(u'&#%s;' % name)
+
+    @property
+    def located(self):
+        return (
+            'title' in self.fields and 'latitude' in self.fields and
+            'longitude' in self.fields)
+
+    @property
+    def complete(self):
+        return self.located and 'elevation' in self.fields
+
+
 class Scrape(object):
 
     URL_OPTS = '%s?printable=yes'
+    CHUNK_SIZE = 16 * 1024
+    LOOKAHEAD = 32 * 1024
+    URL_PATTERN = re.compile(r'^https://(de|en|fr).wikipedia.org/wiki/.+')
 
     def __init__(self, url):
-        pattern = re.compile(r'^https://(de|en|fr).wikipedia.org/wiki/.+')
-        if not pattern.match(url):
+        if not Scrape.URL_PATTERN.match(url):
             raise ValueError("'%s' no valid URL" % url)
         self._url = url
         self._title = None
         self._latitude = None
         self._longitude = None
         self._elevation = None
+        # etag and last modified of the scraped page
+        self._validators = (None, None)
 
     def scrape_url(self):
+        fields = _coalesce(_page_key(self.url), self._fields)
+        self._set_fields(fields)
+
+    def _fields(self):
+        entry, fresh = self._cached_entry()
+        if fresh:
+            fields = entry['fields']
+        else:
+            fields = self._scrape_fields(lambda: self._scrape_page(entry))
+        # redirected articles are known by their canonical url as well
+        canonical = fields.get('canonical')
+        if flight is not None and canonical and Scrape.URL_PATTERN.match(
+                canonical):
+            flight.add(_page_key(canonical), fields)
+        return fields
+
+    def ascrape_url(self):
+        entry, fresh = self._cached_entry()
+        if fresh:
+            return completed(entry['fields']).then(self._set_fields)
+        if agent.cache is not None:
+            # scraped, revalidated and cached like blocking scrapes
+            return _transport().submit(self._fields).then(self._set_fields)
+        # the page is read completely before it is parsed
+        future = _transport().fetch(Scrape.URL_OPTS % self.url, cache=False)
+        if parsers is not None:
+            # no transport thread waits for the parser processes
+            future = future.then(
+                lambda content: parsers.aparse(self.url, content))
+            return future.then(self._set_fields)
+        return future.then(
+            lambda content: self._set_fields(self._parse(content)))
+
+    def _cached_entry(self):
+        # scraped fields, also negative ones, with the validators of the page
+        if agent.cache is None:
+            return None, False
+        with Phase('cache', self.url) as phase:
+            entry, fresh = agent.cache.get(self._cache_key())
+            phase.cached = fresh
+        return entry, fresh
+
+    def _cache_key(self):
+        return 'scrape:%s' % normalize_url(self.url)
+
+    def _scrape_fields(self, scrape):
+        try:
+            fields = scrape()
+        except UserWarning as error:
+            fields = {'error': error.args[0]}
+        if agent.cache is not None:
+            etag, last_modified = self._validators
+            agent.cache.set(self._cache_key(), {
+                'fields': fields,
+                'etag': etag,
+                'last_modified': last_modified,
+            })
+        return fields
+
+    def _set_fields(self, fields):
+        if 'error' in fields:
+            raise UserWarning(fields['error'])
+
+        self._title = fields['title']
+        self._latitude = fields['latitude']
+        self._longitude = fields['longitude']
+        self._elevation = fields['elevation']
+
+    def _scrape_page(self, entry=None):
         url = Scrape.URL_OPTS % self.url
-        fd = agent.open(url)
-        content = fd.read()
-        tree = ElementTree.parse(StringIO(content))
-        root = tree.getroot()
-
-        for tag in root.iter(tag='h1'):
-            if 'class' in tag.attrib:
-                if tag.attrib['class'] == 'firstHeading':
-                    title = tag.text
-
-        tags = root.getiterator(tag='span')
-        for tag in tags:
-            if 'class' in tag.attrib:
-                if tag.attrib['class'] == 'latitude':
-                    if 'latitude' in locals():
-                        continue
-                    latitude = tag.text
-                if tag.attrib['class'] == 'longitude':
-                    if 'longitude' in locals():
-                        continue
-                    longitude = tag.text
-                if tag.attrib['class'] == 'elevation':
-                    if 'elevation' in locals():
-                        continue
-                    elevation = tag.text
-        if 'latitude' not in locals() or 'longitude' not in locals():
+        headers = {}
+        # revalidate stale entry
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        # the scraped fields are cached, not the page
+        try:
+            fd = agent.open(url, headers=headers, cache=False)
+        except urllib2.HTTPError as error:
+            if error.code != 304 or entry is None:
+                raise
+            self._validators = (entry['etag'], entry['last_modified'])
+            return entry['fields']
+        if agent.cache is not None:
+            info = fd.info()
+            self._validators = (
+                info.getheader('ETag'), info.getheader('Last-Modified'))
+        if parsers is not None:
+            # fetched here, parsed by another process
+            try:
+                content = fd.read()
+            finally:
+                fd.close()
+            return self._parse(content)
+        try:
+            fields = self._evaluate_page(fd)
+        finally:
+            # stops downloading if the page was not read completely
+            fd.close()
+        return self._evaluate_fields(fields)
+
+    def _parse(self, content):
+        if parsers is not None:
+            return parsers.parse(self.url, content)
+        return self._evaluate_fields(self._evaluate_page(StringIO(content)))
+
+    def _evaluate_fields(self, fields):
+        title = fields.get('title')
+        if 'latitude' not in fields or 'longitude' not in fields:
             raise UserWarning("'%s' no valid geographic spot" % title)
-        if 'en.wikipedia.org' in self.url:
-            latitude = self._calculate_decimal_degree(latitude)
-            longitude = self._calculate_decimal_degree(longitude)
-
         self._title = title
-        self._latitude = float(latitude)
-        self._longitude = float(longitude)
-        if 'elevation' in locals():
-            self._elevation = float(elevation)
-
-    def _calculate_decimal_degree(self, coordinates):
-        coordinates = coordinates.replace(u'°', ' ')
-        coordinates = coordinates.replace(u'′', ' ')
-        coordinates = coordinates.replace(u'″', ' ')
-        length = len(coordinates.split())
-        if length == 4:
-            degree, minutes, seconds, orientation = coordinates.split()
-        elif length == 3:
-            degree, minutes, orientation = coordinates.split()
-        else:
-            raise UserWarning("'%s' no valid geographic spot" % self.title)
-        if 'seconds' not in locals():
-            coordinates = (float(minutes) / 60) + int(degree)
+        language = Scrape.URL_PATTERN.match(self.url).group(1)
+        try:
+            with Phase('coordinates', self.url):
+                fields['latitude'] = parse_coordinate(
+                    fields['latitude'], language, limit=LATITUDE)
+                fields['longitude'] = parse_coordinate(
+                    fields['longitude'], language, limit=LONGITUDE)
+        except ValueError:
+            raise UserWarning("'%s' no valid geographic spot" % title)
+        if 'elevation' in fields:
+            fields['elevation'] = float(fields['elevation'])
         else:
-            coordinates = (((float(seconds) / 60) + float(minutes)) / 60)
-            coordinates = coordinates + int(degree)
-        if 'W' in orientation or 'S' in orientation:
-            coordinates *= (-1)
-        return coordinates
+            fields['elevation'] = None
+        return fields
+
+    def _evaluate_page(self, fd):
+        parser = _PageParser()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        size = 0
+        found = None
+        # parsing is timed apart from reading
+        elapsed = 0.0
+        try:
+            while not parser.complete:
+                chunk = fd.read(Scrape.CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                start = time.time()
+                parser.feed(decoder.decode(chunk))
+                elapsed += time.time() - start
+                # elevation is looked up a little further only
+                if found is None and parser.located:
+                    found = size
+                if found is not None and size - found >= Scrape.LOOKAHEAD:
+                    break
+        except HTMLParseError:
+            pass
+        emit('parse', elapsed, self.url, size)
+        return parser.fields
 
     @property
     def url(self):
@@ -160,8 +492,120 @@ class Scrape(object):
         return self._elevation
 
 
+class BatchScrape(object):
+
+    API_URL = 'https://%s.wikipedia.org/w/api.php'
+    API_OPTS = '?action=query&prop=coordinates&coprimary=primary'
+    API_OPTS += '&colimit=max&redirects=1&format=json&titles=%s'
+    LIMIT = 50
+
+    def __init__(self, urls, fallback=True):
+        urls = list(urls)
+        for url in urls:
+            if not Scrape.URL_PATTERN.match(url):
+                raise ValueError("'%s' no valid URL" % url)
+        self._urls = urls
+        self._fallback = fallback
+        self._results = []
+
+    def scrape_urls(self):
+        results = [None] * len(self.urls)
+        languages = {}
+        for index, url in enumerate(self.urls):
+            language = Scrape.URL_PATTERN.match(url).group(1)
+            languages.setdefault(language, []).append(index)
+        for language, indices in sorted(languages.items()):
+            for offset in range(0, len(indices), BatchScrape.LIMIT):
+                batch = indices[offset:offset + BatchScrape.LIMIT]
+                titles = [self._url_title(self.urls[index]) for index in batch]
+                try:
+                    pages = self._query(language, titles)
+                except Exception as error:
+                    pages = dict((title, error) for title in titles)
+                for index, title in zip(batch, titles):
+                    results[index] = pages.get(title)
+        # pages without coordinates in the api are scraped
+        for index, url in enumerate(self.urls):
+            result = results[index]
+            if result is not None and not isinstance(result, Exception):
+                result['url'] = url
+                continue
+            if result is None and self._fallback:
+                result = self._scrape(url)
+            elif result is None:
+                result = UserWarning("'%s' no valid geographic spot" % url)
+            results[index] = result
+        self._results = results
+
+    def _query(self, language, titles):
+        query = '|'.join(title.encode('utf-8') for title in titles)
+        url = BatchScrape.API_URL % language
+        url += BatchScrape.API_OPTS % urllib.quote(query)
+        fd = agent.open(url)
+        try:
+            content = fd.read()
+        finally:
+            fd.close()
+        with Phase('parse', url) as phase:
+            phase.bytes = len(content)
+            return self._evaluate_result(json.loads(content), titles)
+
+    def _evaluate_result(self, content, titles):
+        query = content.get('query', {})
+        aliases = {}
+        for entry in query.get('normalized', []) + query.get('redirects', []):
+            aliases[entry['from']] = entry['to']
+        coordinates = {}
+        for page in query.get('pages', {}).values():
+            for entry in page.get('coordinates', []):
+                if entry.get('globe', 'earth') != 'earth':
+                    continue
+                coordinates[page['title']] = {
+                    'title': _text([page['title']]),
+                    'latitude': float(entry['lat']),
+                    'longitude': float(entry['lon']),
+                    'elevation': None,
+                }
+                break
+        pages = {}
+        for title in titles:
+            target = aliases.get(title, title)
+            target = aliases.get(target, target)
+            if target in coordinates:
+                pages[title] = dict(coordinates[target])
+        return pages
+
+    def _url_title(self, url):
+        path = urlparse.urlsplit(url).path[len('/wiki/'):]
+        return urllib.unquote(path).decode('utf-8').replace('_', ' ')
+
+    def _scrape(self, url):
+        scrape = Scrape(url)
+        try:
+            scrape.scrape_url()
+        except Exception as error:
+            return error
+        return {
+            'title': scrape.title,
+            'url': scrape.url,
+            'latitude': scrape.latitude,
+            'longitude': scrape.longitude,
+            'elevation': scrape.elevation,
+        }
+
+    @property
+    def urls(self):
+        return self._urls
+
+    @property
+    def results(self):
+        return self._results
+
+
 class Spot(object):
 
+    __slots__ = ('_title', '_latitude', '_longitude', '_elevation', '_url')
+
     def __init__(
         self, title=None, latitude=None, longitude=None, elevation=None,
             url=None):
@@ -171,27 +615,139 @@ class Spot(object):
         self._elevation = elevation
         self._url = url
 
+    def __eq__(self, other):
+        if not isinstance(other, Spot):
+            return NotImplemented
+        return self._row() == other._row()
+
+    def __ne__(self, other):
+        if not isinstance(other, Spot):
+            return NotImplemented
+        return self._row() != other._row()
+
+    def __hash__(self):
+        return hash(self._row())
+
+    def __repr__(self):
+        return 'Spot(title=%r, latitude=%r, longitude=%r, elevation=%r)' % (
+            self._title, self._latitude, self._longitude, self._elevation)
+
+    def __getstate__(self):
+        return self._row()
+
+    def __setstate__(self, state):
+        (self._title, self._url, self._latitude, self._longitude,
+            self._elevation) = state
+
+    def _row(self):
+        return (
+            self._title, self._url, self._latitude, self._longitude,
+            self._elevation)
+
     @classmethod
     def from_scrape(cls, scrape):
         if not isinstance(scrape, Scrape):
             raise ValueError("Scrape object required")
+        if store is not None:
+            spot = store.get_url(scrape.url)
+            if spot is not None:
+                return spot
         scrape.scrape_url()
         cls = cls(
             title=scrape.title, latitude=scrape.latitude,
             longitude=scrape.longitude, elevation=scrape.elevation,
             url=scrape.url)
+        _remember([cls])
         return cls
 
+    @classmethod
+    def afrom_scrape(cls, scrape):
+        if not isinstance(scrape, Scrape):
+            raise ValueError("Scrape object required")
+        if store is not None:
+            spot = store.get_url(scrape.url)
+            if spot is not None:
+                return completed(spot)
+
+        def scraped(result):
+            spot = cls(
+                title=scrape.title, latitude=scrape.latitude,
+                longitude=scrape.longitude, elevation=scrape.elevation,
+                url=scrape.url)
+            _remember([spot])
+            return spot
+
+        return scrape.ascrape_url().then(scraped)
+
     @classmethod
     def from_search(cls, search):
         if not isinstance(search, Search):
             raise ValueError("Search object required")
+        if store is not None:
+            spot = store.get_term(search.language, search.term)
+            if spot is not None:
+                return spot
         search.search_term()
         result = search.results[0]
         scrape = Scrape(result['url'])
         cls = Spot.from_scrape(scrape)
+        _remember([cls], [(search.language, search.term, cls.url)])
+        return cls
+
+    @classmethod
+    def afrom_search(cls, search):
+        if not isinstance(search, Search):
+            raise ValueError("Search object required")
+        if store is not None:
+            spot = store.get_term(search.language, search.term)
+            if spot is not None:
+                return completed(spot)
+
+        def searched(result):
+            scrape = Scrape(search.results[0]['url'])
+            return cls.afrom_scrape(scrape).then(remembered)
+
+        def remembered(spot):
+            _remember([spot], [(search.language, search.term, spot.url)])
+            return spot
+
+        return search.asearch_term().then(searched)
+
+    @classmethod
+    def from_locate(cls, locate):
+        if not isinstance(locate, Locate):
+            raise ValueError("Locate object required")
+        if store is not None:
+            spot = store.get_term(locate.language, locate.term)
+            if spot is not None:
+                return spot
+        locate.locate_term()
+        # best match without coordinates in the api is scraped
+        spots = []
+        if locate.latitude is None or locate.longitude is None:
+            cls = cls.from_scrape(Scrape(locate.url))
+        else:
+            cls = cls(
+                title=locate.title, latitude=locate.latitude,
+                longitude=locate.longitude, elevation=locate.elevation,
+                url=locate.url)
+            spots.append(cls)
+        _remember(spots, [(locate.language, locate.term, cls.url)])
         return cls
 
+    @classmethod
+    def from_titles(cls, batch):
+        if not isinstance(batch, BatchScrape):
+            raise ValueError("BatchScrape object required")
+        batch.scrape_urls()
+        spots = []
+        for result in batch.results:
+            if isinstance(result, Exception):
+                spots.append(result)
+            else:
+                spots.append(cls(**result))
+        return spots
+
     @property
     def title(self):
         return self._title
@@ -211,3 +767,212 @@ class Spot(object):
     @property
     def elevation(self):
         return self._elevation
+
+
+def _remember(spots, terms=()):
+    # resolved spots and search terms are written back to the store
+    if store is None:
+        return
+    languages = {}
+    for spot in spots:
+        match = Scrape.URL_PATTERN.match(spot.url)
+        if match is not None:
+            languages.setdefault(match.group(1), []).append(spot)
+    for language, spots in languages.iteritems():
+        store.upsert(language, spots)
+    for language, term, url in terms:
+        store.add_term(language, term, url)
+
+
+def _lookup(obj, language='de'):
+    if store is None:
+        return None
+    with Phase('store', obj) as phase:
+        if Scrape.URL_PATTERN.match(obj):
+            spot = store.get_url(obj)
+        else:
+            spot = store.get_term(language, obj)
+        phase.cached = spot is not None
+    return spot
+
+
+def resolve_spot(obj, language='de'):
+    with Phase('resolve', obj):
+        return _resolve_spot(obj, language)
+
+
+def _resolve_spot(obj, language):
+    if Scrape.URL_PATTERN.match(obj):
+        # scrape url
+        return Spot.from_scrape(Scrape(obj))
+    # search term
+    try:
+        return Spot.from_search(Search(obj, language=language))
+    except IndexError:
+        raise UserWarning("'%s' no search results" % obj)
+
+
+def aresolve_spot(obj, language='de'):
+    start = time.time()
+    try:
+        if Scrape.URL_PATTERN.match(obj):
+            future = Spot.afrom_scrape(Scrape(obj))
+        else:
+            future = Spot.afrom_search(Search(obj, language=language))
+    except Exception as error:
+        future = failed(error)
+    result = Future()
+
+    def done(future):
+        emit('resolve', time.time() - start, obj)
+        if isinstance(future._exception, IndexError):
+            result.set_exception(
+                UserWarning("'%s' no search results" % obj))
+        else:
+            result._copy(future)
+
+    future._add_done_callback(done, result)
+    return result
+
+
+def aresolve_spots(objs, language='de', limit=64):
+    if limit < 1:
+        raise ValueError("'%d' no valid limit" % limit)
+    # one future per object, no more than limit lookups in flight
+    objs = list(objs)
+    futures = [Future() for obj in objs]
+    pending = deque(zip(objs, futures))
+    lock = threading.Lock()
+
+    def start():
+        # lookups finished right away start the next one in place
+        while True:
+            with lock:
+                if not pending:
+                    return
+                obj, future = pending.popleft()
+            lookup = aresolve_spot(obj, language=language)
+            if not lookup.done():
+                lookup._add_done_callback(
+                    lambda lookup, future=future: finish(lookup, future),
+                    future)
+                return
+            future._copy(lookup)
+
+    def finish(lookup, future):
+        future._copy(lookup)
+        start()
+
+    for index in xrange(min(limit, len(objs))):
+        start()
+    return futures
+
+
+def _locate(obj, language='de'):
+    if Scrape.URL_PATTERN.match(obj):
+        return obj
+    # search term and coordinates of the best match in one request
+    locate = Locate(obj, language=language)
+    locate.locate_term()
+    if locate.latitude is None or locate.longitude is None:
+        return locate.url
+    return Spot(
+        title=locate.title, latitude=locate.latitude,
+        longitude=locate.longitude, elevation=locate.elevation,
+        url=locate.url)
+
+
+def _map(function, objs, workers):
+    # failed objects are reported by their exception, order is kept
+    def call(obj):
+        try:
+            return function(obj)
+        except Exception as error:
+            return error
+
+    if workers == 1 or len(objs) < 2:
+        return [call(obj) for obj in objs]
+    # multiprocessing is imported for concurrent runs only
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(objs)))
+    try:
+        return pool.map(call, objs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _imap(function, objs, workers):
+    # like _map, but results are yielded as soon as they are in order
+    def call(obj):
+        try:
+            return function(obj)
+        except Exception as error:
+            return error
+
+    if workers == 1:
+        for obj in objs:
+            yield call(obj)
+        return
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(call, objs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def resolve_spots(objs, language='de', workers=1, api=False):
+    if workers < 1:
+        raise ValueError("'%d' no valid number of workers" % workers)
+    objs = list(objs)
+    if not api:
+        return _map(
+            lambda obj: resolve_spot(obj, language=language), objs, workers)
+    # stored spots are taken as they are, the others are located online
+    results = [_lookup(obj, language=language) for obj in objs]
+    pending = [
+        index for index, result in enumerate(results) if result is None]
+    located = _map(
+        lambda obj: _locate(obj, language=language),
+        [objs[index] for index in pending], workers)
+    for index, result in zip(pending, located):
+        results[index] = result
+    # coordinates of remaining urls are fetched in batches
+    indices = [
+        index for index in pending if isinstance(results[index], basestring)]
+    batch = BatchScrape([results[index] for index in indices])
+    for index, spot in zip(indices, Spot.from_titles(batch)):
+        results[index] = spot
+    found = [index for index in pending if isinstance(results[index], Spot)]
+    _remember(
+        [results[index] for index in found],
+        [(language, objs[index], results[index].url) for index in found
+         if not Scrape.URL_PATTERN.match(objs[index])])
+    return results
+
+
+def iresolve_spots(objs, language='de', workers=1, api=False):
+    if workers < 1:
+        raise ValueError("'%d' no valid number of workers" % workers)
+    return _iresolve_spots(objs, language, workers, api)
+
+
+def _iresolve_spots(objs, language, workers, api):
+    if not api:
+        for result in _imap(
+                lambda obj: resolve_spot(obj, language=language), objs,
+                workers):
+            yield result
+        return
+    # api lookups are batched, results follow batch by batch
+    objs = iter(objs)
+    while True:
+        chunk = list(islice(objs, BatchScrape.LIMIT))
+        if not chunk:
+            break
+        for result in resolve_spots(
+                chunk, language=language, workers=workers, api=True):
+            yield result
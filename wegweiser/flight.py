@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self, memoize=True):
+        self._memoize = memoize
+        self._calls = {}
+        self._shared = 0
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        # the first caller of a key runs function, the others wait for it
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._shared += 1
+        if leader:
+            try:
+                call.result = function()
+            except Exception as error:
+                call.error = error
+            finally:
+                if not self._memoize:
+                    with self._lock:
+                        del self._calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def add(self, key, result):
+        # a finished result known under another key as well
+        if not self._memoize:
+            return
+        with self._lock:
+            if key in self._calls:
+                return
+            call = self._calls[key] = _Call()
+            call.result = result
+            call.event.set()
+
+    def forget(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._calls.clear()
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def __len__(self):
+        return len(self._calls)
+
+    @property
+    def memoize(self):
+        return self._memoize
+
+    @property
+    def shared(self):
+        return self._shared
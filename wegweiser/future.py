@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import traceback
+
+from Queue import Queue, Empty
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class Future(object):
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self._done:
+                raise ValueError("future already done")
+            self._result = result
+            self._exception = exception
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notify_all()
+        for callback, future in callbacks:
+            self._call(callback, future)
+
+    def _call(self, callback, future):
+        # a failing callback fails its downstream future, not the caller
+        try:
+            callback(self)
+        except Exception as error:
+            if future is None:
+                traceback.print_exc()
+            elif not future.done():
+                future.set_exception(error)
+
+    def _copy(self, future):
+        self._finish(future._result, future._exception)
+
+    def add_done_callback(self, callback):
+        self._add_done_callback(callback, None)
+
+    def _add_done_callback(self, callback, future):
+        with self._condition:
+            if not self._done:
+                self._callbacks.append((callback, future))
+                return
+        self._call(callback, future)
+
+    def then(self, function):
+        # function is called with the result, a returned future is chained
+        future = Future()
+
+        def done(self):
+            if self._exception is not None:
+                future.set_exception(self._exception)
+                return
+            try:
+                result = function(self._result)
+            except Exception as error:
+                future.set_exception(error)
+                return
+            if isinstance(result, Future):
+                result._add_done_callback(future._copy, future)
+            else:
+                future.set_result(result)
+
+        self._add_done_callback(done, future)
+        return future
+
+    def done(self):
+        return self._done
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise TimeoutError("future not done after %ss" % timeout)
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exception
+
+
+def completed(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def failed(exception):
+    future = Future()
+    future.set_exception(exception)
+    return future
+
+
+def gather(futures):
+    # results in order, failed futures by their exception
+    futures = list(futures)
+    future = Future()
+    if not futures:
+        future.set_result([])
+        return future
+    results = [None] * len(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(index, item):
+        if item._exception is not None:
+            results[index] = item._exception
+        else:
+            results[index] = item._result
+        with lock:
+            remaining[0] -= 1
+            last = not remaining[0]
+        if last:
+            future.set_result(results)
+
+    for index, item in enumerate(futures):
+        item._add_done_callback(
+            lambda item, index=index: done(index, item), future)
+    return future
+
+
+def as_completed(futures, timeout=None):
+    futures = list(futures)
+    queue = Queue()
+    for future in futures:
+        future.add_done_callback(queue.put)
+    for index in xrange(len(futures)):
+        try:
+            yield queue.get(True, timeout)
+        except Empty:
+            raise TimeoutError("future not done after %ss" % timeout)
+
+
+class ThreadTransport(object):
+
+    WORKERS = 16
+
+    def __init__(self, open, workers=WORKERS):
+        if workers < 1:
+            raise ValueError("'%d' no valid number of workers" % workers)
+        self._open = open
+        self._workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, function):
+        # blocking calls run on a pool, the future gets their result
+        future = Future()
+        with self._lock:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self._workers)
+            pool = self._pool
+        pool.apply_async(self._call, (function, future))
+        return future
+
+    def _call(self, function, future):
+        try:
+            result = function()
+        except Exception as error:
+            future.set_exception(error)
+            return
+        future.set_result(result)
+
+    def fetch(self, url, **options):
+        return self.submit(lambda: self._read(url, options))
+
+    def _read(self, url, options):
+        fd = self._open(url, **options)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    @property
+    def workers(self):
+        return self._workers
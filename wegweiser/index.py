@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import math
+import heapq
+import marshal
+
+from array import array
+from wegweiser.core import Spot
+from wegweiser.collection import SpotCollection
+
+EARTH_RADIUS = 6371008.8
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    latitude1 = math.radians(latitude1)
+    latitude2 = math.radians(latitude2)
+    a = math.sin((latitude2 - latitude1) / 2) ** 2
+    a += math.cos(latitude1) * math.cos(latitude2) * math.sin(
+        math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _vector(latitude, longitude):
+    latitude = math.radians(latitude)
+    longitude = math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude))
+
+
+def _chord(angle):
+    return 2 * math.sin(min(angle, math.pi) / 2)
+
+
+class SpotIndex(object):
+
+    VERSION = 1
+
+    def __init__(self, spots=None, cell_size=0.1):
+        if not 0 < cell_size <= 90:
+            raise ValueError("'%s' no valid cell size" % cell_size)
+        self._cell_size = float(cell_size)
+        self._rows = int(math.ceil(180 / self._cell_size))
+        self._columns = int(math.ceil(360 / self._cell_size))
+        self._spots = SpotCollection()
+        # unit vectors make distance checks cheap dot products
+        self._x = array('d')
+        self._y = array('d')
+        self._z = array('d')
+        self._cells = {}
+        if spots is not None:
+            self.extend(spots)
+
+    def insert(self, spot):
+        if not isinstance(spot, Spot):
+            raise ValueError("Spot object required")
+        self._spots.append(spot)
+        self._index(len(self._spots) - 1)
+
+    def extend(self, spots):
+        start = len(self._spots)
+        self._spots.extend(spots)
+        for index in xrange(start, len(self._spots)):
+            self._index(index)
+
+    def _index(self, index):
+        latitude = self._spots.latitudes[index]
+        longitude = self._spots.longitudes[index]
+        x, y, z = _vector(latitude, longitude)
+        self._x.append(x)
+        self._y.append(y)
+        self._z.append(z)
+        cell = self._cell(latitude, longitude)
+        if cell not in self._cells:
+            self._cells[cell] = array('l')
+        self._cells[cell].append(index)
+
+    def _cell(self, latitude, longitude):
+        row = int((latitude + 90) / self._cell_size)
+        column = int((longitude + 180) / self._cell_size)
+        return min(max(row, 0), self._rows - 1), column % self._columns
+
+    def _ring(self, row, column, radius):
+        # cells of the square ring around a cell
+        if radius == 0:
+            yield row, column
+            return
+        for delta in xrange(-radius, radius + 1):
+            for cell_row in row - radius, row + radius:
+                yield cell_row, column + delta
+            if abs(delta) != radius:
+                for cell_column in column - radius, column + radius:
+                    yield row + delta, cell_column
+
+    def nearest(self, latitude, longitude, k=1):
+        if k < 1:
+            raise ValueError("'%d' no valid number of spots" % k)
+        x, y, z = _vector(latitude, longitude)
+        row, column = self._cell(latitude, longitude)
+        cells = self._cells
+        xs, ys, zs = self._x, self._y, self._z
+        # min heap of the k best by dot product, the worst is on top
+        heap = []
+
+        def examine(indices):
+            for index in indices:
+                dot = x * xs[index] + y * ys[index] + z * zs[index]
+                if len(heap) < k:
+                    heapq.heappush(heap, (dot, index))
+                elif dot > heap[0][0]:
+                    heapq.heapreplace(heap, (dot, index))
+
+        # spots beyond a ring are this far in latitude or longitude at least
+        reach = math.cos(math.radians(latitude))
+        visited = set()
+        for radius in xrange(max(self._rows, self._columns) + 1):
+            if len(heap) == k and radius > 1:
+                # lower bound of the distance to cells of this ring
+                degrees = math.radians((radius - 1) * self._cell_size)
+                angle = min(degrees, math.asin(
+                    min(1.0, reach * math.sin(min(degrees, math.pi / 2)))))
+                if math.cos(angle) < heap[0][0]:
+                    break
+            # sparse grid, remaining cells are cheaper to scan directly
+            if len(visited) > len(cells):
+                for cell, indices in cells.iteritems():
+                    if cell not in visited:
+                        examine(indices)
+                break
+            for cell_row, cell_column in self._ring(row, column, radius):
+                if not 0 <= cell_row < self._rows:
+                    continue
+                cell = (cell_row, cell_column % self._columns)
+                if cell in visited:
+                    continue
+                visited.add(cell)
+                examine(cells.get(cell, ()))
+        return self._spots.take(
+            index for dot, index in sorted(heap, reverse=True))
+
+    def within(self, latitude, longitude, radius):
+        if radius < 0:
+            raise ValueError("'%s' no valid radius" % radius)
+        x, y, z = _vector(latitude, longitude)
+        angle = radius / EARTH_RADIUS
+        threshold = 1 - _chord(angle) ** 2 / 2
+        degrees = math.degrees(angle)
+        south = latitude - degrees
+        north = latitude + degrees
+        if south <= -90 or north >= 90:
+            west, east = -180.0, 180.0
+        else:
+            spread = degrees / math.cos(
+                math.radians(max(abs(south), abs(north))))
+            west, east = longitude - spread, longitude + spread
+        xs, ys, zs = self._x, self._y, self._z
+        found = []
+        for index in self._candidates(south, west, north, east):
+            dot = x * xs[index] + y * ys[index] + z * zs[index]
+            if dot >= threshold:
+                found.append((-dot, index))
+        found.sort()
+        return self._spots.take(index for dot, index in found)
+
+    def bbox(self, south, west, north, east):
+        latitudes = self._spots.latitudes
+        longitudes = self._spots.longitudes
+        found = []
+        for index in self._candidates(south, west, north, east):
+            if not south <= latitudes[index] <= north:
+                continue
+            longitude = longitudes[index]
+            # boxes across the antimeridian have west > east
+            if west <= east:
+                if not west <= longitude <= east:
+                    continue
+            elif east < longitude < west:
+                continue
+            found.append(index)
+        found.sort()
+        return self._spots.take(found)
+
+    def _candidates(self, south, west, north, east):
+        south_row = self._cell(max(south, -90), 0)[0]
+        north_row = self._cell(min(north, 90), 0)[0]
+        if west > east:
+            east += 360
+        if east - west >= 360:
+            columns = range(self._columns)
+        else:
+            west_column = int((west + 180) // self._cell_size)
+            east_column = int((east + 180) // self._cell_size)
+            columns = [
+                column % self._columns
+                for column in xrange(west_column, east_column + 1)]
+        cells = self._cells
+        # large areas are cheaper to match against the occupied cells
+        if (north_row - south_row + 1) * len(columns) > len(cells):
+            columns = set(columns)
+            for (row, column), indices in cells.iteritems():
+                if south_row <= row <= north_row and column in columns:
+                    for index in indices:
+                        yield index
+            return
+        for row in xrange(south_row, north_row + 1):
+            for column in columns:
+                for index in cells.get((row, column), ()):
+                    yield index
+
+    def save(self, filename):
+        spots = self._spots
+        data = {
+            'version': SpotIndex.VERSION,
+            'cell_size': self._cell_size,
+            'titles': spots.titles,
+            'urls': spots.urls,
+            'latitudes': spots.latitudes.tostring(),
+            'longitudes': spots.longitudes.tostring(),
+            'elevations': spots.elevations.tostring(),
+            'x': self._x.tostring(),
+            'y': self._y.tostring(),
+            'z': self._z.tostring(),
+            'cells': dict(
+                (cell, indices.tostring())
+                for cell, indices in self._cells.iteritems()),
+        }
+        with open(filename, 'wb') as f:
+            marshal.dump(data, f, 2)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            data = marshal.load(f)
+        if data.get('version') != SpotIndex.VERSION:
+            raise ValueError("'%s' no valid spot index" % filename)
+        index = cls(cell_size=data['cell_size'])
+        spots = index._spots
+        spots._titles = data['titles']
+        spots._urls = data['urls']
+        spots._latitudes.fromstring(data['latitudes'])
+        spots._longitudes.fromstring(data['longitudes'])
+        spots._elevations.fromstring(data['elevations'])
+        index._x.fromstring(data['x'])
+        index._y.fromstring(data['y'])
+        index._z.fromstring(data['z'])
+        for cell, indices in data['cells'].iteritems():
+            index._cells[cell] = array('l')
+            index._cells[cell].fromstring(indices)
+        return index
+
+    def __len__(self):
+        return len(self._spots)
+
+    @property
+    def spots(self):
+        return self._spots
+
+    @property
+    def cell_size(self):
+        return self._cell_size
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import re
+import gzip
+import urllib
+import sqlite3
+import tempfile
+
+from itertools import islice, izip
+from wegweiser.core import Search
+from wegweiser.cache import PATH_SAFE
+
+VALUE = re.compile(r"'([^'\\]*(?:\\.[^'\\]*)*)'|([^,()';\s]+)")
+ESCAPE = re.compile(r'\\(.)')
+ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+COLUMN = re.compile(r'^\s*`(\w+)`\s+(\w+)')
+INTEGERS = ['tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint']
+FLOATS = ['decimal', 'float', 'double', 'real']
+
+URL = 'https://%s.wikipedia.org/wiki/%s'
+
+
+def open_dump(filename):
+    if filename == '-':
+        return io.open(0, 'rb', closefd=False)
+    if filename.endswith('.gz'):
+        return io.BufferedReader(gzip.open(filename, 'rb'), 1024 * 1024)
+    return io.open(filename, 'rb', 1024 * 1024)
+
+
+def _unescape(text):
+    return ESCAPE.sub(lambda match: ESCAPES.get(
+        match.group(1), match.group(1)), text)
+
+
+def _convert(value):
+    text, literal = value
+    if not literal:
+        if '\\' in text:
+            return _unescape(text)
+        return text
+    if literal == 'NULL':
+        return None
+    if '.' in literal or 'e' in literal or 'E' in literal:
+        return float(literal)
+    return int(literal)
+
+
+def _column(values, kind):
+    # numbers are converted in bulk unless there are NULL values
+    if kind in INTEGERS or kind in FLOATS:
+        try:
+            return map(
+                int if kind in INTEGERS else float,
+                [literal for text, literal in values])
+        except ValueError:
+            return map(_convert, values)
+    if any(literal for text, literal in values):
+        return map(_convert, values)
+    return [_unescape(text) if '\\' in text else text
+            for text, literal in values]
+
+
+def read_dump(fd, table, columns):
+    create = 'CREATE TABLE `%s` (' % table
+    insert = 'INSERT INTO `%s` VALUES ' % table
+    names = None
+    kinds = None
+    indices = None
+    for line in fd:
+        if line.startswith(create):
+            names = []
+            kinds = []
+            continue
+        if names is not None and indices is None:
+            match = COLUMN.match(line)
+            if match is not None:
+                names.append(match.group(1))
+                kinds.append(match.group(2).lower())
+                continue
+            if not line.startswith(')'):
+                continue
+            for column in columns:
+                if column not in names:
+                    raise ValueError(
+                        "'%s' no column of table '%s'" % (column, table))
+            indices = [names.index(column) for column in columns]
+            continue
+        if not line.startswith(insert):
+            continue
+        if indices is None:
+            raise ValueError("'%s' no table definition found" % table)
+        # values of all rows at once, only selected columns are converted
+        values = VALUE.findall(line, len(insert))
+        if len(values) % len(names):
+            raise ValueError("'%s' unexpected number of values" % table)
+        selected = [
+            _column(values[index::len(names)], kinds[index])
+            for index in indices]
+        for row in izip(*selected):
+            yield row
+
+
+class Ingest(object):
+
+    BATCH_SIZE = 500
+    GEO_COLUMNS = [
+        'gt_page_id', 'gt_globe', 'gt_primary', 'gt_lat', 'gt_lon']
+    PAGE_COLUMNS = ['page_id', 'page_namespace', 'page_title']
+
+    def __init__(self, store, language='de'):
+        if language not in Search.LANGUAGES:
+            raise ValueError(
+                "'%s' no valid language %s" % (language, Search.LANGUAGES))
+        self._store = store
+        self._language = language
+
+    def ingest(self, geo_tags, page):
+        fd, filename = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        staging = sqlite3.connect(filename)
+        try:
+            staging.execute('PRAGMA journal_mode = OFF')
+            staging.execute('PRAGMA synchronous = OFF')
+            staging.execute(
+                'CREATE TABLE geo (page_id INTEGER PRIMARY KEY, '
+                'latitude REAL, longitude REAL)')
+            with open_dump(geo_tags) as fd:
+                self._stage_geo_tags(staging, fd)
+            with open_dump(page) as fd:
+                count = self._store.upsert_rows(
+                    self._language, self._join_pages(staging, fd))
+        finally:
+            staging.close()
+            os.remove(filename)
+        return count
+
+    def _stage_geo_tags(self, staging, fd):
+        # primary coordinates on earth only
+        rows = (
+            (page_id, latitude, longitude)
+            for page_id, globe, primary, latitude, longitude
+            in read_dump(fd, 'geo_tags', Ingest.GEO_COLUMNS)
+            if primary == 1 and globe == 'earth' and latitude is not None
+            and longitude is not None)
+        with staging:
+            staging.executemany(
+                'INSERT OR IGNORE INTO geo VALUES (?, ?, ?)', rows)
+
+    def _join_pages(self, staging, fd):
+        pages = (
+            (page_id, title)
+            for page_id, namespace, title
+            in read_dump(fd, 'page', Ingest.PAGE_COLUMNS)
+            if namespace == 0)
+        while True:
+            batch = dict(islice(pages, Ingest.BATCH_SIZE))
+            if not batch:
+                break
+            query = 'SELECT page_id, latitude, longitude FROM geo '
+            query += 'WHERE page_id IN (%s)' % ','.join('?' * len(batch))
+            for page_id, latitude, longitude in staging.execute(
+                    query, batch.keys()):
+                title = batch[page_id]
+                # quoted like normalize_url, the store expects it that way
+                url = URL % (
+                    self._language, urllib.quote(title, safe=PATH_SAFE))
+                yield (
+                    title.decode('utf-8', 'replace').replace('_', ' '), url,
+                    latitude, longitude, None)
+
+    @property
+    def language(self):
+        return self._language
+
+    @property
+    def store(self):
+        return self._store
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+
+from collections import namedtuple, deque
+
+# a timed phase of a run, bytes transferred and cache hits if known
+Event = namedtuple('Event', ['phase', 'seconds', 'url', 'bytes', 'cached'])
+
+_hooks = []
+
+
+def subscribe(hook):
+    _hooks.append(hook)
+
+
+def unsubscribe(hook):
+    _hooks.remove(hook)
+
+
+def emit(phase, seconds, url=None, bytes=None, cached=None):
+    if not _hooks:
+        return
+    event = Event(phase, seconds, url, bytes, cached)
+    for hook in list(_hooks):
+        hook(event)
+
+
+class Phase(object):
+
+    def __init__(self, phase, url=None):
+        self._phase = phase
+        self._url = url
+        self._bytes = None
+        self._cached = None
+        self._start = None
+
+    def __enter__(self):
+        # nothing is timed without subscribers
+        if _hooks:
+            self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        if self._start is not None:
+            emit(self._phase, time.time() - self._start, self._url,
+                 self._bytes, self._cached)
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @bytes.setter
+    def bytes(self, bytes):
+        self._bytes = bytes
+
+    @property
+    def cached(self):
+        return self._cached
+
+    @cached.setter
+    def cached(self, cached):
+        self._cached = cached
+
+
+def percentile(values, fraction):
+    # nearest rank of sorted values
+    if not values:
+        raise ValueError("no values")
+    if not 0 <= fraction <= 1:
+        raise ValueError("'%s' no valid fraction" % fraction)
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, rank)]
+
+
+class Profile(object):
+
+    PERCENTILES = [0.5, 0.95, 0.99]
+
+    def __init__(self, window=None):
+        if window is not None and window < 1:
+            raise ValueError("'%s' no valid window" % window)
+        # percentiles over the latest `window` events per phase only
+        self._window = window
+        self._seconds = {}
+        self._counts = {}
+        self._totals = {}
+        self._bytes = {}
+        self._lookups = {}
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        phase = event.phase
+        with self._lock:
+            if phase not in self._seconds:
+                self._seconds[phase] = deque(maxlen=self._window)
+            self._seconds[phase].append(event.seconds)
+            self._counts[phase] = self._counts.get(phase, 0) + 1
+            self._totals[phase] = self._totals.get(phase, 0) + event.seconds
+            if event.bytes is not None:
+                self._bytes[phase] = self._bytes.get(phase, 0) + event.bytes
+            if event.cached is not None:
+                self._lookups[phase] = self._lookups.get(phase, 0) + 1
+                if event.cached:
+                    self._hits[phase] = self._hits.get(phase, 0) + 1
+
+    def percentiles(self, phase):
+        with self._lock:
+            values = sorted(self._seconds.get(phase, []))
+        return [percentile(values, fraction)
+                for fraction in Profile.PERCENTILES]
+
+    def stats(self):
+        stats = {}
+        for phase in self.phases:
+            p50, p95, p99 = self.percentiles(phase)
+            with self._lock:
+                stats[phase] = {
+                    'count': self._counts[phase],
+                    'seconds': self._totals[phase],
+                    'p50': p50,
+                    'p95': p95,
+                    'p99': p99,
+                    'bytes': self._bytes.get(phase),
+                    'lookups': self._lookups.get(phase),
+                    'hits': self._hits.get(phase),
+                }
+        return stats
+
+    def report(self):
+        lines = ['%-12s %7s %9s %9s %9s %10s %12s %9s' % (
+            'phase', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'total ms',
+            'bytes', 'hits')]
+        for phase, entry in sorted(self.stats().iteritems()):
+            lines.append('%-12s %7d %9.1f %9.1f %9.1f %10.1f %12s %9s' % (
+                phase, entry['count'], entry['p50'] * 1000,
+                entry['p95'] * 1000, entry['p99'] * 1000,
+                entry['seconds'] * 1000,
+                '-' if entry['bytes'] is None else entry['bytes'],
+                '-' if entry['lookups'] is None else '%d/%d' % (
+                    entry['hits'] or 0, entry['lookups'])))
+        return '\n'.join(lines)
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def phases(self):
+        with self._lock:
+            return sorted(self._seconds)
+
+    def count(self, phase):
+        with self._lock:
+            return self._counts.get(phase, 0)
+
+    def bytes(self, phase):
+        with self._lock:
+            return self._bytes.get(phase, 0)
+
+    def hits(self, phase):
+        with self._lock:
+            return self._hits.get(phase, 0), self._lookups.get(phase, 0)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+
+def read_objs(fd):
+    # one url or search term per line, blank lines are skipped
+    for line in fd:
+        obj = line.strip()
+        if obj:
+            yield obj
+
+
+class Journal(object):
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._done = set()
+        self._failed = 0
+        complete = True
+        if os.path.exists(filename):
+            complete = self._load()
+        self._fd = open(filename, 'a')
+        if not complete:
+            self._fd.write('\n')
+
+    def _load(self):
+        line = '\n'
+        with open(self._filename) as f:
+            for line in f:
+                # a record cut off by a crash is resolved again
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                obj = record['obj']
+                if isinstance(obj, unicode):
+                    obj = obj.encode('utf-8')
+                self._done.add(obj)
+                if record.get('error') is not None:
+                    self._failed += 1
+        return line.endswith('\n')
+
+    def record(self, obj, error=None):
+        self._fd.write(json.dumps(
+            {'obj': obj, 'error': error}, sort_keys=True) + '\n')
+        # kept by a restart even if this process is killed right after
+        self._fd.flush()
+        self._done.add(obj)
+        if error is not None:
+            self._failed += 1
+
+    def __contains__(self, obj):
+        return obj in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def close(self):
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def failed(self):
+        return self._failed
@@ -1,38 +1,345 @@
 # -*- coding: utf-8 -*-
 
-import urllib
+import math
+import shutil
 
+from array import array
+from itertools import izip
 from motionless import DecoratedMap, LatLonMarker
+from wegweiser import core
 from wegweiser.core import Spot
+from wegweiser.collection import SpotCollection
+from wegweiser.instrument import Phase
+
+METERS_PER_DEGREE = 111319.49
+POLYLINE_FACTOR = 1e5
+TILE_SIZE = 256
+MAX_ZOOM = 21
+
+
+def encode_polyline(latitudes, longitudes):
+    # rounded first, the deltas of consecutive points are encoded
+    latitudes = [int(round(value * POLYLINE_FACTOR)) for value in latitudes]
+    longitudes = [int(round(value * POLYLINE_FACTOR)) for value in longitudes]
+    chunks = []
+    append = chunks.append
+    previous_latitude = previous_longitude = 0
+    for latitude, longitude in izip(latitudes, longitudes):
+        for value in (latitude - previous_latitude,
+                      longitude - previous_longitude):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            append(chr(value + 63))
+        previous_latitude = latitude
+        previous_longitude = longitude
+    return ''.join(chunks)
+
+
+def decode_polyline(polyline):
+    values = []
+    value = shift = 0
+    for char in polyline:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    if shift:
+        raise ValueError("'%s' no valid polyline" % polyline)
+    latitudes = array('d')
+    longitudes = array('d')
+    latitude = longitude = 0
+    for index in xrange(0, len(values) - 1, 2):
+        latitude += values[index]
+        longitude += values[index + 1]
+        latitudes.append(latitude / POLYLINE_FACTOR)
+        longitudes.append(longitude / POLYLINE_FACTOR)
+    return latitudes, longitudes
+
+
+def simplify(latitudes, longitudes, tolerance):
+    if tolerance < 0:
+        raise ValueError("'%s' no valid tolerance" % tolerance)
+    count = len(latitudes)
+    if count < 3:
+        return range(count)
+    # equirectangular projection in meters around the mean latitude
+    scale = math.cos(math.radians(sum(latitudes) / count)) * METERS_PER_DEGREE
+    xs = [longitude * scale for longitude in longitudes]
+    ys = [latitude * METERS_PER_DEGREE for latitude in latitudes]
+    keep = bytearray(count)
+    keep[0] = keep[-1] = 1
+    squared = tolerance * tolerance
+    # Douglas-Peucker on a stack instead of recursion
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = xs[first], ys[first]
+        dx, dy = xs[last] - x1, ys[last] - y1
+        length = dx * dx + dy * dy
+        farthest, index = -1.0, None
+        for current in xrange(first + 1, last):
+            px, py = xs[current] - x1, ys[current] - y1
+            if length:
+                t = (px * dx + py * dy) / length
+                if t < 0:
+                    t = 0.0
+                elif t > 1:
+                    t = 1.0
+                px -= t * dx
+                py -= t * dy
+            distance = px * px + py * py
+            if distance > farthest:
+                farthest, index = distance, current
+        if index is not None and farthest > squared:
+            keep[index] = 1
+            stack.append((index, last))
+            stack.append((first, index))
+    return [index for index in xrange(count) if keep[index]]
+
+
+def cluster(latitudes, longitudes, cell_size):
+    if cell_size <= 0:
+        raise ValueError("'%s' no valid cell size" % cell_size)
+    # spots of a grid cell are merged into their centroid
+    cells = {}
+    floor = math.floor
+    for latitude, longitude in izip(latitudes, longitudes):
+        cell = (floor(latitude / cell_size), floor(longitude / cell_size))
+        try:
+            total = cells[cell]
+            total[0] += latitude
+            total[1] += longitude
+            total[2] += 1
+        except KeyError:
+            cells[cell] = [latitude, longitude, 1]
+    totals = sorted(cells.itervalues(), key=lambda total: -total[2])
+    weights = array('l', [count for _, _, count in totals])
+    return (
+        array('d', [latitude / count for latitude, _, count in totals]),
+        array('d', [longitude / count for _, longitude, count in totals]),
+        weights)
+
+
+def _mercator(latitude):
+    latitude = math.radians(max(-85.0511, min(85.0511, latitude)))
+    return math.log(math.tan(math.pi / 4 + latitude / 2))
+
+
+def fit_zoom(south, west, north, east, size_x, size_y):
+    # highest web mercator zoom level showing the whole box
+    zoom = MAX_ZOOM
+    if east > west:
+        zoom = min(zoom, math.log(
+            size_x * 360.0 / (TILE_SIZE * (east - west)), 2))
+    if north > south:
+        zoom = min(zoom, math.log(
+            size_y * 2 * math.pi /
+            (TILE_SIZE * (_mercator(north) - _mercator(south))), 2))
+    return max(0, int(math.floor(zoom)))
+
+
+def _marker_style(weight):
+    # single spots are plain markers, clusters are labelled by weight
+    if weight == 1:
+        return None, None, None
+    if weight < 10:
+        return 'mid', 'orange', str(weight)
+    return None, 'red', None
 
 
 class Map(DecoratedMap):
 
+    CHUNK_SIZE = 64 * 1024
+    CLUSTER_RADIUS = 32
+    MAX_MARKERS = 64
+    # meters, paths too long for a url are simplified from here on
+    MIN_TOLERANCE = 1.0
+
     def __init__(
             self, size_x=400, size_y=400, maptype='roadmap', region=False,
-            fillcolor='green', pathweight=None, pathcolor=None, filename=None):
+            fillcolor='green', pathweight=None, pathcolor=None, filename=None,
+            tolerance=None):
         DecoratedMap.__init__(
                 self, size_x=size_x, size_y=size_y, maptype=maptype,
                 region=region, fillcolor=fillcolor, pathweight=None,
                 pathcolor=None)
+        if tolerance is not None and tolerance < 0:
+            raise ValueError("'%s' no valid tolerance" % tolerance)
         self._filename = filename
-        self._spots = []
+        self._tolerance = tolerance
+        # raised as far as needed for the url to fit
+        self._fitted = tolerance
+        self._encoded = 0
+        self._spots = SpotCollection()
+        self._latitudes = array('d')
+        self._longitudes = array('d')
 
     def add_marker(self, spot, size=None, color=None, label=None):
+        if isinstance(spot, SpotCollection):
+            self._spots.extend(spot)
+            for latitude, longitude in izip(spot.latitudes, spot.longitudes):
+                self.markers.append(LatLonMarker(
+                    latitude, longitude, size, color, label))
+            return
         if not isinstance(spot, Spot):
             raise ValueError("Spot object required")
         self._spots.append(spot)
         self.markers.append(
             LatLonMarker(spot.latitude, spot.longitude, size, color, label))
 
-    def save_map_file(self):
+    def add_cluster(self, spot, radius=CLUSTER_RADIUS):
+        if isinstance(spot, Spot):
+            spot = SpotCollection([spot])
+        if not isinstance(spot, SpotCollection):
+            raise ValueError("SpotCollection object required")
+        if not len(spot):
+            return 0
+        self._spots.extend(spot)
+        zoom = self.zoom
+        if zoom is None:
+            zoom = fit_zoom(
+                min(spot.latitudes), min(spot.longitudes),
+                max(spot.latitudes), max(spot.longitudes),
+                self.size_x, self.size_y)
+        # cells of about radius pixels at the zoom level of the map
+        cell_size = radius * 360.0 / (TILE_SIZE * 2 ** zoom)
+        latitudes, longitudes, weights = cluster(
+            spot.latitudes, spot.longitudes, cell_size)
+        for latitude, longitude, weight in izip(
+                latitudes, longitudes, weights):
+            size, color, label = _marker_style(weight)
+            self.markers.append(LatLonMarker(
+                round(latitude, 5), round(longitude, 5), size, color, label))
+        return len(weights)
+
+    @classmethod
+    def tiles(cls, spots, max_markers=MAX_MARKERS,
+              radius=CLUSTER_RADIUS, **options):
+        # spots are split at the median of the wider side until the
+        # clusters of every tile fit on one map
+        if max_markers < 1:
+            raise ValueError("'%d' no valid number of markers" % max_markers)
+        maps = []
+        pending = [spots]
+        while pending:
+            spots = pending.pop()
+            map = cls(**options)
+            count = map.add_cluster(spots, radius=radius)
+            if count <= max_markers or len(spots) < 2:
+                try:
+                    map.generate_url()
+                    maps.append(map)
+                    continue
+                except ValueError:
+                    if len(spots) < 2:
+                        raise
+            latitudes = spots.latitudes
+            longitudes = spots.longitudes
+            if max(latitudes) - min(latitudes) > (
+                    max(longitudes) - min(longitudes)):
+                column = latitudes
+            else:
+                column = longitudes
+            indices = sorted(xrange(len(spots)), key=column.__getitem__)
+            half = len(indices) // 2
+            pending.append(spots.take(indices[half:]))
+            pending.append(spots.take(indices[:half]))
+        return maps
+
+    def add_path(self, spot):
+        if isinstance(spot, SpotCollection):
+            for latitude, longitude in izip(spot.latitudes, spot.longitudes):
+                self.add_path_latlon(latitude, longitude)
+            return
+        if not isinstance(spot, Spot):
+            raise ValueError("Spot object required")
+        self.add_path_latlon(spot.latitude, spot.longitude)
+
+    def add_path_latlon(self, lat, lon):
+        DecoratedMap.add_path_latlon(self, lat, lon)
+        self._latitudes.append(float(lat))
+        self._longitudes.append(float(lon))
+
+    def generate_url(self):
+        with Phase('map') as phase:
+            url = self._fit_url()
+            phase.bytes = len(url)
+        return url
+
+    def _fit_url(self):
+        while True:
+            try:
+                return DecoratedMap.generate_url(self)
+            except ValueError:
+                # too long, unless the path can be simplified any further
+                if not self.path or self._encoded <= 2:
+                    raise
+            self._fitted = max(
+                self._fitted or 0, Map.MIN_TOLERANCE / 4) * 4
+
+    def _polyencode(self):
+        latitudes = self._latitudes
+        longitudes = self._longitudes
+        if self._fitted:
+            indices = simplify(latitudes, longitudes, self._fitted)
+            latitudes = [latitudes[index] for index in indices]
+            longitudes = [longitudes[index] for index in indices]
+        self._encoded = len(latitudes)
+        return encode_polyline(latitudes, longitudes)
+
+    def save_map_file(self, cache=None):
         url = self.generate_url()
-        urllib.urlretrieve(url, self._filename)
+        # images are cached as files, not as responses
+        if cache is None:
+            fd = core.agent.open(url, cache=False)
+            try:
+                with open(self._filename, 'wb') as f:
+                    self._copy(fd, f)
+            finally:
+                fd.close()
+            return
+        # unchanged maps are copied from the cache by their url
+        with Phase('cache', url) as phase:
+            path = cache.get(url)
+            phase.cached = path is not None
+        if path is None:
+            path = cache.set(url, lambda f: self._download(url, f))
+        shutil.copyfile(path, self._filename)
+
+    def _download(self, url, f):
+        fd = core.agent.open(url, cache=False)
+        try:
+            self._copy(fd, f)
+        finally:
+            fd.close()
+
+    def _copy(self, fd, f):
+        while True:
+            chunk = fd.read(Map.CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
 
     @property
     def spots(self):
+        return list(self._spots)
+
+    @property
+    def collection(self):
         return self._spots
 
+    @property
+    def tolerance(self):
+        return self._tolerance
+
+    @property
+    def fitted_tolerance(self):
+        return self._fitted
+
     @property
     def filename(self):
         return self._filename
@@ -40,3 +347,67 @@ class Map(DecoratedMap):
     @filename.setter
     def filename(self, filename):
         self._filename = filename
+
+
+def build_maps(
+        spots, size='640x400', type='roadmap', path=False, region=False,
+        simplify=None, each=False):
+    labels = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    # plain lists of spots are taken as well
+    if not isinstance(spots, SpotCollection):
+        spots = SpotCollection(spots)
+    try:
+        size_x, size_y = [int(value) for value in size.split('x')]
+    except ValueError:
+        raise ValueError("'%s' no valid size" % size)
+    options = dict(
+        size_x=size_x, size_y=size_y, maptype=type, region=region,
+        fillcolor='gray', tolerance=simplify)
+    geomap = Map(**options)
+    maps = [geomap]
+    if each is True:
+        # one map per spot
+        maps = []
+        for spot in spots:
+            maps.append(Map(**options))
+            maps[-1].add_marker(spot, label=labels[0])
+    elif region is True:
+        geomap.add_path(spots)
+        geomap.add_path(spots[0])
+    elif path is True:
+        geomap.add_path(spots)
+        # long paths are marked at their ends only
+        if len(spots) > len(labels):
+            spots = spots.take([0, len(spots) - 1])
+        for index, spot in enumerate(spots):
+            geomap.add_marker(spot, label=labels[index])
+    elif len(spots) > len(labels):
+        # clustered and split into several maps if necessary
+        maps = Map.tiles(spots, **options)
+    else:
+        for index, spot in enumerate(spots):
+            geomap.add_marker(spot, label=labels[index])
+    return maps
+
+
+def save_map_files(maps, workers=1, cache=None):
+    if workers < 1:
+        raise ValueError("'%d' no valid number of workers" % workers)
+    # failed maps are reported by their exception, None otherwise
+    def save(map):
+        try:
+            return map.save_map_file(cache=cache)
+        except Exception as error:
+            return error
+
+    maps = list(maps)
+    if workers == 1 or len(maps) < 2:
+        return [save(map) for map in maps]
+    # multiprocessing is imported for concurrent downloads only
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(maps)))
+    try:
+        return pool.map(save, maps)
+    finally:
+        pool.close()
+        pool.join()
@@ -1,7 +1,113 @@
 # -*- coding: utf-8 -*-
 
-import simplekml
+import os
+import zipfile
+import tempfile
+
+from cStringIO import StringIO
 from wegweiser.core import Spot
+from wegweiser.collection import SpotCollection
+from wegweiser.instrument import Phase
+
+# layout and ids of simplekml's pretty printed Folder/Point documents
+KML_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2" \
+xmlns:gx="http://www.google.com/kml/ext/2.2">
+    <Document id="1">
+        <Folder id="2">
+%s'''
+KML_PLACEMARK = '''            <Placemark id="%d">
+%s                <Point id="%d">
+                    <coordinates>%s</coordinates>
+                </Point>
+            </Placemark>
+'''
+KML_FOOTER = '''        </Folder>
+    </Document>
+</kml>
+'''
+
+
+def _escape(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    text = text.replace('&', '&amp;').replace('<', '&lt;')
+    return text.replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _name(text, indent):
+    # simplekml leaves out names that are not set
+    if text is None:
+        return ''
+    return '%s<name>%s</name>\n' % (' ' * indent, _escape(text))
+
+
+class KmlWriter(object):
+
+    def __init__(self, fd, title='Wegweiser'):
+        self._fd = fd
+        self._title = title
+        self._count = 0
+        self._closed = False
+        fd.write(KML_HEADER % _name(title, 12))
+
+    def write(self, spot):
+        if not isinstance(spot, Spot):
+            raise ValueError("Spot object required")
+        self.write_row(
+            spot.title, spot.url, spot.latitude, spot.longitude,
+            spot.elevation)
+
+    def write_row(self, title, url, latitude, longitude, elevation=None):
+        if elevation is None:
+            elevation = 0.0
+        # ids follow the point, placemark creation order of simplekml
+        point = 3 + 2 * self._count
+        self._fd.write(KML_PLACEMARK % (
+            point + 1, _name(title, 16), point,
+            '{0},{1},{2}'.format(longitude, latitude, elevation)))
+        self._count += 1
+
+    def extend(self, spots):
+        if isinstance(spots, SpotCollection):
+            for row in spots.rows():
+                self.write_row(*row)
+            return
+        for spot in spots:
+            self.write(spot)
+
+    def close(self):
+        if not self._closed:
+            self._fd.write(KML_FOOTER)
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def title(self):
+        return self._title
+
+    @property
+    def count(self):
+        return self._count
+
+
+def write_kmz(filename, spots, title='Wegweiser'):
+    # the document is spooled to disk and compressed from there
+    fd, spool = tempfile.mkstemp(suffix='.kml')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with KmlWriter(f, title=title) as writer:
+                writer.extend(spots)
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            kmz.write(spool, 'doc.kml')
+    finally:
+        os.remove(spool)
+    return writer.count
 
 
 class Markup(object):
@@ -9,29 +115,34 @@ class Markup(object):
     def __init__(self, title='Wegweiser', filename=None):
         self._title = title
         self._filename = filename
-        self._spots = []
+        self._spots = SpotCollection()
 
     def add_spot(self, spot):
+        if isinstance(spot, SpotCollection):
+            self._spots.extend(spot)
+            return
         if not isinstance(spot, Spot):
             raise ValueError("Spot object required")
         self._spots.append(spot)
 
     def generate_kml(self):
-        self._kml = simplekml.Kml()
-        folder = self._kml.newfolder(name=self.title)
-        for spot in self.spots:
-            point = folder.newpoint()
-            point.name = spot.title
-            if spot.elevation is not None:
-                point.coords = [
-                    (spot.longitude, spot.latitude, spot.elevation)]
-            else:
-                point.coords = [(spot.longitude, spot.latitude)]
-        return self._kml.kml()
+        f = StringIO()
+        self.write_kml(f)
+        return f.getvalue().decode('utf-8')
+
+    def write_kml(self, fd):
+        with Phase('kml'):
+            with KmlWriter(fd, title=self.title) as writer:
+                writer.extend(self._spots)
 
     def save_kml_file(self):
-        self.generate_kml()
-        self._kml.save(self._filename)
+        # zip compressed for .kmz files
+        if self._filename.lower().endswith('.kmz'):
+            with Phase('kml'):
+                write_kmz(self._filename, self._spots, title=self.title)
+            return
+        with open(self._filename, 'wb') as f:
+            self.write_kml(f)
 
     @property
     def title(self):
@@ -39,6 +150,10 @@ class Markup(object):
 
     @property
     def spots(self):
+        return list(self._spots)
+
+    @property
+    def collection(self):
         return self._spots
 
     @property
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import time
+import cPickle
+import multiprocessing
+
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from wegweiser import instrument
+from wegweiser.core import Scrape
+from wegweiser.future import Future, TimeoutError
+from wegweiser.instrument import emit
+
+
+def _initialize():
+    # events of parser processes would never reach their subscribers
+    del instrument._hooks[:]
+
+
+def _parse_page(url, content):
+    # runs in a parser process, only the extracted fields are sent back
+    scrape = Scrape(url)
+    try:
+        return True, scrape._evaluate_fields(
+            scrape._evaluate_page(StringIO(content)))
+    except UserWarning as error:
+        return True, {'error': error.args[0]}
+    except Exception as error:
+        return False, _portable(error)
+
+
+def _portable(error):
+    # an exception the pool can not send back would stop all parsing
+    try:
+        cPickle.loads(cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+class ParserPool(object):
+
+    # fetching threads per parser, pages are fetched while others are parsed
+    FETCHERS = 2
+    # seconds a page may take to be parsed, a killed parser never answers
+    TIMEOUT = 60
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError("'%d' no valid number of parsers" % workers)
+        self._workers = workers
+        # forked right away, before any fetching threads are running
+        self._pool = multiprocessing.Pool(workers, _initialize)
+        # threads waiting for the parser processes
+        self._waiters = ThreadPool(self.fetchers)
+
+    def aparse(self, url, content):
+        # the caller goes on fetching, the future gets the fields
+        future = Future()
+        start = time.time()
+
+        result = self._pool.apply_async(_parse_page, (url, content))
+
+        def wait():
+            timeout = max(0, start + ParserPool.TIMEOUT - time.time())
+            try:
+                success, value = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                success, value = False, TimeoutError(
+                    "'%s' not parsed after %ss" % (
+                        url, ParserPool.TIMEOUT))
+            except Exception as error:
+                success, value = False, error
+            emit('parse', time.time() - start, url, len(content))
+            if success:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        self._waiters.apply_async(wait)
+        return future
+
+    def parse(self, url, content):
+        fields = self.aparse(url, content).result()
+        if 'error' in fields:
+            raise UserWarning(fields['error'])
+        return fields
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._waiters.close()
+        self._waiters.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._waiters.terminate()
+        self._waiters.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def fetchers(self):
+        return self._workers * ParserPool.FETCHERS
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from collections import OrderedDict
+from cStringIO import StringIO
+from wegweiser.core import Spot, Search, resolve_spots
+from wegweiser.collection import SpotCollection
+from wegweiser.instrument import Phase, Profile, subscribe, unsubscribe
+from wegweiser.markup import Markup
+from wegweiser.map import build_maps
+
+
+def _record(spot):
+    return {
+        'title': spot.title,
+        'url': spot.url,
+        'latitude': spot.latitude,
+        'longitude': spot.longitude,
+        'elevation': spot.elevation
+    }
+
+
+class SpotService(object):
+
+    SIZE = 10000
+    TTL = 3600
+
+    def __init__(self, language='de', jobs=1, api=False, size=SIZE, ttl=TTL):
+        if language not in Search.LANGUAGES:
+            raise ValueError(
+                "'%s' no valid language %s" % (language, Search.LANGUAGES))
+        if size < 0:
+            raise ValueError("'%d' no valid cache size" % size)
+        self._language = language
+        self._jobs = jobs
+        self._api = api
+        self._size = size
+        self._ttl = ttl
+        # resolved spots by language, api and object, least recent first
+        self._spots = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, objs, language=None, api=None):
+        language = language or self._language
+        api = self._api if api is None else api
+        results = [self._get((language, api, obj)) for obj in objs]
+        pending = [
+            index for index, result in enumerate(results) if result is None]
+        with self._lock:
+            self._hits += len(objs) - len(pending)
+            self._misses += len(pending)
+        if not pending:
+            return results
+        resolved = resolve_spots(
+            [objs[index] for index in pending], language=language,
+            workers=self._jobs, api=api)
+        for index, result in zip(pending, resolved):
+            results[index] = result
+            if isinstance(result, Spot):
+                self._set((language, api, objs[index]), result)
+        return results
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._spots.pop(key, None)
+            if entry is None:
+                return None
+            spot, expires = entry
+            if expires < time.time():
+                return None
+            self._spots[key] = entry
+            return spot
+
+    def _set(self, key, spot):
+        if not self._size:
+            return
+        with self._lock:
+            self._spots.pop(key, None)
+            self._spots[key] = (spot, time.time() + self._ttl)
+            while len(self._spots) > self._size:
+                self._spots.popitem(last=False)
+
+    @property
+    def language(self):
+        return self._language
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._spots)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._dispatch('')
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self._dispatch(self.rfile.read(length))
+
+    def _dispatch(self, body):
+        url = urlparse.urlsplit(self.path)
+        route = self.server.ROUTES.get(url.path)
+        if route is None:
+            self._send(404, {'error': "'%s' not found" % url.path})
+            return
+        params = urlparse.parse_qs(url.query)
+        for name, values in urlparse.parse_qs(body).iteritems():
+            params.setdefault(name, []).extend(values)
+        with Phase('serve %s' % url.path, self.path):
+            try:
+                code, content = getattr(self.server, route)(params)
+            except ValueError as error:
+                code, content = 400, {'error': str(error)}
+            except Exception as error:
+                code, content = 500, {'error': str(error)}
+            self._send(code, content)
+
+    def _send(self, code, content):
+        content_type = 'application/json'
+        if isinstance(content, tuple):
+            content_type, content = content
+        else:
+            content = json.dumps(content, sort_keys=True)
+        self.server._count(code, len(content))
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    ROUTES = {
+        '/spots': 'spots',
+        '/kml': 'kml',
+        '/map': 'map',
+        '/stats': 'stats',
+    }
+    WINDOW = 10000
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+        self._service = service
+        self._started = time.time()
+        self._requests = 0
+        self._errors = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # latencies of requests and their phases while serving
+        self._profile = Profile(window=Server.WINDOW)
+        subscribe(self._profile)
+        self._subscribed = True
+
+    def _count(self, code, size):
+        with self._lock:
+            self._requests += 1
+            self._bytes += size
+            if code >= 400:
+                self._errors += 1
+
+    def _resolve(self, params):
+        objs = params.get('q', [])
+        if not objs:
+            raise ValueError("no wikipedia url or search term (q)")
+        language = params.get('language', [None])[0]
+        if language is not None and language not in Search.LANGUAGES:
+            raise ValueError(
+                "'%s' no valid language %s" % (language, Search.LANGUAGES))
+        api = params.get('api', [None])[0]
+        if api is not None:
+            api = api.lower() in ('1', 'true', 'yes')
+        results = self._service.resolve(objs, language=language, api=api)
+        spots = SpotCollection()
+        errors = []
+        for obj, result in zip(objs, results):
+            if isinstance(result, Exception):
+                errors.append({'obj': obj, 'error': str(result)})
+            else:
+                spots.append(result)
+        return spots, errors
+
+    def spots(self, params):
+        spots, errors = self._resolve(params)
+        return 200, {
+            'spots': [_record(spot) for spot in spots], 'errors': errors}
+
+    def kml(self, params):
+        spots, errors = self._resolve(params)
+        if not spots:
+            return 404, {'errors': errors}
+        markup = Markup(title=params.get('title', ['Wegweiser'])[0])
+        markup.add_spot(spots)
+        f = StringIO()
+        markup.write_kml(f)
+        return 200, ('application/vnd.google-earth.kml+xml', f.getvalue())
+
+    def map(self, params):
+        spots, errors = self._resolve(params)
+        if not spots:
+            return 404, {'errors': errors}
+
+        def flag(name):
+            value = params.get(name, ['0'])[0]
+            return value.lower() in ('1', 'true', 'yes')
+
+        simplify = params.get('simplify', [None])[0]
+        maps = build_maps(
+            spots, size=params.get('size', ['640x400'])[0],
+            type=params.get('type', ['roadmap'])[0], path=flag('path'),
+            region=flag('region'), each=flag('each'),
+            simplify=None if simplify is None else float(simplify))
+        return 200, {
+            'urls': [geomap.generate_url() for geomap in maps],
+            'errors': errors}
+
+    def stats(self, params):
+        with self._lock:
+            requests, errors = self._requests, self._errors
+            bytes = self._bytes
+        uptime = time.time() - self._started
+        return 200, {
+            'uptime': uptime,
+            'requests': requests,
+            'errors': errors,
+            'bytes': bytes,
+            'rate': requests / uptime if uptime else 0.0,
+            'cache': {
+                'size': len(self._service),
+                'hits': self._service.hits,
+                'misses': self._service.misses,
+            },
+            'phases': self._profile.stats(),
+        }
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        if self._subscribed:
+            unsubscribe(self._profile)
+            self._subscribed = False
+
+    @property
+    def service(self):
+        return self._service
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+
+from itertools import islice
+from wegweiser.core import Spot
+from wegweiser.cache import normalize_url, normalize_title
+from wegweiser.collection import SpotCollection
+
+# titles are case sensitive, normalized keys may be shared by articles
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS spots (
+    language TEXT NOT NULL,
+    key TEXT NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL PRIMARY KEY,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    elevation REAL
+);
+CREATE INDEX IF NOT EXISTS spots_key ON spots (language, key);
+CREATE INDEX IF NOT EXISTS spots_coordinates ON spots (latitude, longitude);
+CREATE TABLE IF NOT EXISTS terms (
+    language TEXT NOT NULL,
+    term TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (language, term)
+);
+'''
+
+COLUMNS = 'spots.title, spots.url, latitude, longitude, elevation'
+
+
+class SpotStore(object):
+
+    BATCH_SIZE = 10000
+    TIMEOUT = 30
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._lock = threading.Lock()
+        # several processes may share the store
+        self._connection = sqlite3.connect(
+            filename, timeout=SpotStore.TIMEOUT, check_same_thread=False)
+        self._connection.text_factory = _text_factory
+        if filename != ':memory:':
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.executescript(SCHEMA)
+
+    def upsert(self, language, spots):
+        if isinstance(spots, SpotCollection):
+            rows = spots.rows()
+        else:
+            rows = (
+                (spot.title, spot.url, spot.latitude, spot.longitude,
+                 spot.elevation) for spot in spots)
+        return self.upsert_rows(language, (
+            (title, normalize_url(url), latitude, longitude, elevation)
+            for title, url, latitude, longitude, elevation in rows))
+
+    def upsert_rows(self, language, rows):
+        rows = iter(rows)
+        count = 0
+        while True:
+            batch = [
+                (language, normalize_title(title), _unicode(title),
+                 _unicode(url), latitude, longitude, elevation)
+                for title, url, latitude, longitude, elevation
+                in islice(rows, SpotStore.BATCH_SIZE)]
+            if not batch:
+                break
+            with self._lock:
+                with self._connection:
+                    self._connection.executemany(
+                        'INSERT OR REPLACE INTO spots (language, key, title, '
+                        'url, latitude, longitude, elevation) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            count += len(batch)
+        return count
+
+    def add_term(self, language, term, url):
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO terms (language, term, url) '
+                    'VALUES (?, ?, ?)',
+                    (language, normalize_title(term),
+                     _unicode(normalize_url(url))))
+
+    def get(self, language, title):
+        return self._match(language, title)
+
+    def get_url(self, url):
+        return self._fetchone(
+            'SELECT %s FROM spots WHERE url = ?' % COLUMNS,
+            (_unicode(normalize_url(url)),))
+
+    def get_term(self, language, term):
+        # a search term resolves like before or to a title of the same name
+        spot = self._fetchone(
+            'SELECT %s FROM terms JOIN spots ON terms.url = spots.url '
+            'WHERE terms.language = ? AND terms.term = ?' % COLUMNS,
+            (language, normalize_title(term)))
+        if spot is None:
+            spot = self._match(language, term)
+        return spot
+
+    def _match(self, language, title):
+        spots = self._fetchall(
+            'SELECT %s FROM spots WHERE language = ? AND key = ?' % COLUMNS,
+            (language, normalize_title(title)))
+        if len(spots) == 1:
+            return spots[0]
+        # titles differing by case only are told apart by the exact title,
+        # others are left to a search
+        title = u' '.join(_unicode(title).replace(u'_', u' ').split())
+        for spot in spots:
+            if spot.title == title:
+                return spot
+        return None
+
+    def search(self, language, prefix, limit=10):
+        key = normalize_title(prefix)
+        return self._fetchall(
+            'SELECT %s FROM spots WHERE language = ? AND key >= ? '
+            'AND key < ? ORDER BY key LIMIT ?' % COLUMNS,
+            (language, key, key + u'\U0010ffff', limit))
+
+    def bbox(self, south, west, north, east, language=None):
+        query = 'SELECT %s FROM spots WHERE latitude BETWEEN ? AND ? ' % (
+            COLUMNS)
+        parameters = [south, north]
+        # boxes across the antimeridian have west > east
+        if west <= east:
+            query += 'AND longitude BETWEEN ? AND ?'
+        else:
+            query += 'AND (longitude >= ? OR longitude <= ?)'
+        parameters.extend([west, east])
+        if language is not None:
+            query += ' AND language = ?'
+            parameters.append(language)
+        return self._fetchall(query, parameters)
+
+    def _fetchone(self, query, parameters):
+        with self._lock:
+            row = self._connection.execute(query, parameters).fetchone()
+        if row is None:
+            return None
+        return _spot(row)
+
+    def _fetchall(self, query, parameters):
+        collection = SpotCollection()
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        for title, url, latitude, longitude, elevation in rows:
+            collection.append_row(title, url, latitude, longitude, elevation)
+        return collection
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM spots').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+def _unicode(text):
+    if isinstance(text, str):
+        return text.decode('utf-8')
+    return text
+
+
+def _text_factory(data):
+    text = data.decode('utf-8')
+    try:
+        return text.encode('ascii')
+    except UnicodeEncodeError:
+        return text
+
+
+def _spot(row):
+    title, url, latitude, longitude, elevation = row
+    return Spot(
+        title=title, latitude=latitude, longitude=longitude,
+        elevation=elevation, url=url)
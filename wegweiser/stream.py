@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from wegweiser.core import Spot
+from wegweiser.collection import SpotCollection
+
+
+class NdjsonWriter(object):
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._count = 0
+        self._closed = False
+
+    def write(self, spot):
+        if not isinstance(spot, Spot):
+            raise ValueError("Spot object required")
+        self.write_row(
+            spot.title, spot.url, spot.latitude, spot.longitude,
+            spot.elevation)
+
+    def write_row(self, title, url, latitude, longitude, elevation=None):
+        self._write(self._record(title, url, latitude, longitude, elevation))
+        self._count += 1
+
+    def _record(self, title, url, latitude, longitude, elevation):
+        return json.dumps({
+            'title': title,
+            'url': url,
+            'latitude': latitude,
+            'longitude': longitude,
+            'elevation': elevation
+        }, sort_keys=True) + '\n'
+
+    def _write(self, data):
+        # every record is flushed for consumers downstream
+        self._fd.write(data)
+        self._fd.flush()
+
+    def extend(self, spots):
+        if isinstance(spots, SpotCollection):
+            for row in spots.rows():
+                self.write_row(*row)
+            return
+        for spot in spots:
+            self.write(spot)
+
+    def close(self):
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def count(self):
+        return self._count
+
+
+class GeoJsonWriter(NdjsonWriter):
+
+    HEADER = '{"type": "FeatureCollection", "features": [\n'
+    FOOTER = ']}\n'
+
+    def __init__(self, fd):
+        NdjsonWriter.__init__(self, fd)
+        self._write(GeoJsonWriter.HEADER)
+
+    def _record(self, title, url, latitude, longitude, elevation):
+        coordinates = [longitude, latitude]
+        if elevation is not None:
+            coordinates.append(elevation)
+        feature = json.dumps({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coordinates},
+            'properties': {'title': title, 'url': url}
+        }, sort_keys=True)
+        # features are separated ahead, the last one needs no trailer
+        if self._count:
+            return ',\n' + feature
+        return feature
+
+    def close(self):
+        if not self._closed:
+            self._write(('\n' if self._count else '') + GeoJsonWriter.FOOTER)
+            self._closed = True
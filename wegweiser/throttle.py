@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import urllib2
+import urlparse
+import threading
+
+from email.utils import parsedate_tz, mktime_tz
+from wegweiser.instrument import emit
+
+
+def retry_after(value, now=None):
+    # seconds or a http date, None if missing or invalid
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, mktime_tz(date) - now)
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0:
+            raise ValueError("'%s' no valid rate" % rate)
+        if burst < 1:
+            raise ValueError("'%s' no valid burst" % burst)
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # tokens are reserved ahead, waiting happens outside the lock
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self._burst,
+                self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self._rate
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def burst(self):
+        return self._burst
+
+
+class Limiter(object):
+
+    def __init__(self, maximum, minimum=1):
+        if minimum < 1 or maximum < minimum:
+            raise ValueError(
+                "'%s-%s' no valid concurrency" % (minimum, maximum))
+        self._minimum = minimum
+        self._maximum = maximum
+        self._limit = float(maximum)
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= int(self._limit):
+                self._condition.wait()
+            self._active += 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def increase(self):
+        # additive, about one more request per round of `limit` requests
+        with self._condition:
+            limit = self._limit
+            self._limit = min(self._maximum, limit + 1.0 / limit)
+            if int(self._limit) > int(limit):
+                self._condition.notify()
+
+    def decrease(self):
+        with self._condition:
+            self._limit = max(self._minimum, self._limit / 2)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def active(self):
+        return self._active
+
+
+class _Host(object):
+
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = None
+        if rate is not None:
+            self.bucket = TokenBucket(rate, burst)
+        self.limiter = Limiter(concurrency)
+        self.resume = 0.0
+
+
+class Scheduler(object):
+
+    RETRY_CODES = [429, 502, 503, 504]
+    THROTTLE_CODES = [429, 503]
+    RETRIES = 4
+    BACKOFF = 0.5
+    MAX_DELAY = 120.0
+    CONCURRENCY = 16
+
+    def __init__(
+            self, rate=None, burst=1, concurrency=CONCURRENCY,
+            retries=RETRIES, backoff=BACKOFF, max_delay=MAX_DELAY):
+        if rate is not None and rate <= 0:
+            raise ValueError("'%s' no valid rate" % rate)
+        if retries < 0:
+            raise ValueError("'%d' no valid number of retries" % retries)
+        self._rate = rate
+        self._burst = burst
+        self._concurrency = concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._max_delay = max_delay
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        netloc = urlparse.urlsplit(url).netloc
+        with self._lock:
+            host = self._hosts.get(netloc)
+            if host is None:
+                host = self._hosts[netloc] = _Host(
+                    self._rate, self._burst, self._concurrency)
+            return host
+
+    def run(self, url, request):
+        host = self.host(url)
+        for attempt in range(self._retries + 1):
+            # a host asking to retry later is paused for all requests
+            pause = host.resume - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            if host.bucket is not None:
+                host.bucket.acquire()
+            host.limiter.acquire()
+            try:
+                fd = request()
+            except urllib2.HTTPError as error:
+                if error.code not in Scheduler.RETRY_CODES:
+                    raise
+                if attempt == self._retries:
+                    raise
+                delay = self._throttled(host, error.info(), attempt,
+                                        error.code)
+            else:
+                if fd.info().getheader('MediaWiki-API-Error') != 'maxlag':
+                    host.limiter.increase()
+                    return fd
+                # replication lag, the servers ask to slow down
+                info = fd.info()
+                fd.close()
+                if attempt == self._retries:
+                    raise urllib2.HTTPError(
+                        url, 503, 'maxlag', info, None)
+                delay = self._throttled(host, info, attempt, 503)
+            finally:
+                host.limiter.release()
+            emit('retry', delay, url)
+            time.sleep(delay)
+
+    def _throttled(self, host, info, attempt, code):
+        if code in Scheduler.THROTTLE_CODES:
+            host.limiter.decrease()
+        delay = retry_after(info.getheader('Retry-After') if info else None)
+        if delay is None:
+            # full jitter on an exponential backoff
+            return min(random.uniform(0, self._backoff * 2 ** attempt),
+                       self._max_delay)
+        # long pauses asked for are not waited for beyond max_delay
+        delay = min(delay, self._max_delay)
+        host.resume = max(host.resume, time.time() + delay)
+        return delay
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @property
+    def retries(self):
+        return self._retries
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+import time
+import base64
+import socket
+import urllib
+import urllib2
+import httplib
+import urlparse
+import threading
+
+from cStringIO import StringIO
+from wegweiser.cache import normalize_url
+from wegweiser.instrument import Phase, emit
+
+
+class Response(object):
+
+    CHUNK_SIZE = 16 * 1024
+    DRAIN_SIZE = 16 * 1024
+
+    def __init__(self, agent, key, connection, response, url):
+        self._agent = agent
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._url = url
+        self._buffer = ''
+        self._decompressor = None
+        self._elapsed = 0.0
+        self._bytes = 0
+        encoding = response.getheader('Content-Encoding', '')
+        if encoding.lower() in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read(self, size=-1):
+        if self._connection is None:
+            return self._consume(size)
+        start = time.time()
+        try:
+            if self._decompressor is None:
+                if size < 0:
+                    data = self._response.read()
+                else:
+                    data = self._response.read(size)
+            else:
+                data = self._decompress(size)
+        except (socket.error, httplib.HTTPException):
+            self._discard()
+            raise
+        self._elapsed += time.time() - start
+        self._bytes += len(data)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def _decompress(self, size):
+        # decompress no more than required for the requested size
+        while size < 0 or len(self._buffer) < size:
+            chunk = self._response.read(Response.CHUNK_SIZE)
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                break
+            self._buffer += self._decompressor.decompress(chunk)
+        return self._consume(size)
+
+    def _consume(self, size):
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        if self._connection is None:
+            return
+        # a small rest is cheaper to read than a new connection
+        length = self._response.length
+        if length is not None and length <= Response.DRAIN_SIZE:
+            try:
+                self._response.read()
+            except (socket.error, httplib.HTTPException):
+                self._discard()
+                return
+        if self._response.isclosed():
+            self._release()
+        else:
+            # unread body, connection is not reusable
+            self._discard()
+
+    def _release(self):
+        self._downloaded()
+        if self._response.will_close:
+            self._connection.close()
+        else:
+            self._agent._release(self._key, self._connection)
+        self._connection = None
+
+    def _discard(self):
+        self._downloaded()
+        self._response.close()
+        self._connection.close()
+        self._connection = None
+
+    def _downloaded(self):
+        # time spent reading the body, decompressed bytes
+        emit('download', self._elapsed, self._url, self._bytes)
+
+    def info(self):
+        return self._response.msg
+
+    def getcode(self):
+        return self._response.status
+
+    def geturl(self):
+        return self._url
+
+
+class Agent(object):
+
+    MAX_REDIRECTS = 5
+
+    def __init__(
+            self, cache=None, timeout=30, max_connections=8, scheduler=None,
+            proxies=None):
+        self.cache = cache
+        self.scheduler = scheduler
+        self.addheaders = []
+        # http_proxy, https_proxy and no_proxy like urllib2's ProxyHandler
+        if proxies is None:
+            proxies = urllib.getproxies()
+        self._proxies = proxies
+        self._timeout = timeout
+        self._max_connections = max_connections
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def open(self, url, headers=None, cache=True):
+        # scrapes read pages partially and cache their fields instead
+        if self.cache is None or not cache:
+            return self._open(url, headers)
+        key = normalize_url(url)
+        with Phase('cache', url) as phase:
+            entry, fresh = self.cache.get(key)
+            phase.cached = fresh
+        if fresh:
+            return StringIO(entry['data'])
+        headers = dict(headers or {})
+        # revalidate stale entry
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            fd = self._open(url, headers)
+        except urllib2.HTTPError as error:
+            if error.code != 304 or entry is None:
+                raise
+            self.cache.set(key, entry)
+            return StringIO(entry['data'])
+        try:
+            data = fd.read()
+            info = fd.info()
+        finally:
+            fd.close()
+        entry = {
+            'data': data,
+            'etag': info.getheader('ETag'),
+            'last_modified': info.getheader('Last-Modified'),
+        }
+        self.cache.set(key, entry)
+        return StringIO(data)
+
+    def _open(self, url, headers=None):
+        # throttled requests are retried by the scheduler
+        if self.scheduler is None:
+            return self._fetch(url, headers)
+        return self.scheduler.run(url, lambda: self._fetch(url, headers))
+
+    def _fetch(self, url, headers=None):
+        for redirect in range(Agent.MAX_REDIRECTS + 1):
+            fd = self._request(url, headers)
+            code = fd.getcode()
+            location = fd.info().getheader('Location')
+            if code in (301, 302, 303, 307, 308) and location is not None:
+                fd.close()
+                url = urlparse.urljoin(url, location)
+                continue
+            if code >= 300:
+                info = fd.info()
+                data = fd.read()
+                fd.close()
+                raise urllib2.HTTPError(
+                    url, code, httplib.responses.get(code, ''), info,
+                    StringIO(data))
+            return fd
+        raise urllib2.HTTPError(
+            url, code, 'too many redirects', fd.info(), StringIO(''))
+
+    def _request(self, url, headers=None):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if scheme not in ('http', 'https'):
+            raise urllib2.URLError("'%s' no valid URL" % url)
+        key = (scheme, netloc)
+        selector = urlparse.urlunsplit(('', '', path or '/', query, ''))
+        request_headers = {'Accept-Encoding': 'gzip'}
+        proxy = self._proxy(scheme, netloc)
+        if proxy is not None and scheme == 'http':
+            # plain requests go to the proxy with the absolute url
+            selector = urlparse.urlunsplit(
+                (scheme, netloc, path or '/', query, ''))
+            request_headers.update(proxy[1])
+        request_headers.update(self.addheaders)
+        request_headers.update(headers or {})
+        # a pooled connection might have been closed by the server
+        for attempt in range(2):
+            connection, pooled = self._acquire(key)
+            try:
+                # dns lookup, tcp and tls handshake
+                if not pooled:
+                    with Phase('connect', url):
+                        connection.connect()
+                with Phase('request', url):
+                    connection.request(
+                        'GET', selector, headers=request_headers)
+                    response = connection.getresponse()
+            except (socket.error, httplib.HTTPException) as error:
+                connection.close()
+                if pooled and attempt == 0:
+                    continue
+                raise urllib2.URLError(error)
+            return Response(self, key, connection, response, url)
+
+    def _acquire(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool:
+                return pool.pop(), True
+        scheme, netloc = key
+        proxy = self._proxy(scheme, netloc)
+        if proxy is None:
+            address = netloc
+        else:
+            address, proxy_headers = proxy
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(
+                address, timeout=self._timeout)
+            # tls to the server through a CONNECT tunnel of the proxy
+            if proxy is not None:
+                target = urlparse.urlsplit('//' + netloc)
+                connection.set_tunnel(
+                    target.hostname, target.port, headers=proxy_headers)
+        else:
+            connection = httplib.HTTPConnection(
+                address, timeout=self._timeout)
+        return connection, False
+
+    def _proxy(self, scheme, netloc):
+        # proxy address and headers, None for direct connections
+        proxy = self._proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(netloc.split(':')[0]):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        proxy = urlparse.urlsplit(proxy)
+        address = proxy.hostname
+        if proxy.port is not None:
+            address = '%s:%d' % (address, proxy.port)
+        headers = {}
+        if proxy.username is not None:
+            credentials = '%s:%s' % (
+                urllib.unquote(proxy.username),
+                urllib.unquote(proxy.password or ''))
+            headers['Proxy-Authorization'] = (
+                'Basic %s' % base64.b64encode(credentials))
+        return address, headers
+
+    def _release(self, key, connection):
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self._max_connections:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+
+    @property
+    def max_connections(self):
+        return self._max_connections
+
+    @property
+    def proxies(self):
+        return self._proxies